@@ -0,0 +1,232 @@
+"""Motor de asignación: transportistas candidatos para una orden de carga
+
+Se evalúan todos los pares transportista/camión de una instantánea en memoria
+guardada como arrays de numpy (una fila por camión), así que ordenar miles de
+candidatos son unas pocas operaciones vectorizadas y no un recorrido en Python.
+
+- Restricciones (descartan el par): transportista disponible, menos de
+  MAX_OFERTAS_ACEPTADAS órdenes aceptadas, capacidad_kg >= peso_kg,
+  volumen_m3 >= volumen de la orden y reefer / ADR si la orden los pide.
+- Puntaje (0 a 1, suma ponderada con PESOS): kilómetros en vacío desde la
+  posición actual hasta el origen, reputación y CO2 estimado del viaje
+  (vacío + recorrido con carga) según el combustible del camión.
+
+De cada transportista queda su mejor camión. La instantánea se recarga de la
+base al vencer ASIGNACION_TTL_SEGUNDOS; posición y disponibilidad se
+actualizan en el momento (`mover`, `actualizar_disponibilidad`) desde los
+mismos endpoints que mantienen el índice espacial. Cuando una orden entra o
+sale del estado aceptada la instantánea se descarta (`invalidar`), porque
+cambia el conteo de ofertas aceptadas.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func
+
+import models
+from rutas import RADIO_TIERRA_KM
+
+MAX_OFERTAS_ACEPTADAS = 2
+PESOS = {"distancia": 0.5, "reputacion": 0.3, "co2": 0.2}
+# Kilómetros en vacío con los que el puntaje de distancia baja a la mitad
+DISTANCIA_MEDIA_KM = 100.0
+# Mismos valores que la estimación de CO2 al crear una oferta (frontend)
+CONSUMO_LITROS_POR_KM = 0.35
+FACTORES_EMISION = {"Diesel": 2.68, "GNC": 2.2, "Eléctrico": 0.5, "Gasolina": 2.3}
+FACTOR_EMISION_DEFECTO = 2.68
+
+
+class InstantaneaCandidatos:
+    """Columnas de los pares transportista/camión (arrays alineados por fila)"""
+
+    def __init__(self, transportista_id, camion_id, lat, lon, disponible, ofertas_aceptadas,
+                 reputacion, capacidad_kg, volumen_m3, reefer, adr, factor_emision):
+        self.transportista_id = np.asarray(transportista_id, dtype=np.int64)
+        self.camion_id = np.asarray(camion_id, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)  # NaN sin posición
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.disponible = np.asarray(disponible, dtype=bool)
+        self.ofertas_aceptadas = np.asarray(ofertas_aceptadas, dtype=np.int64)
+        self.reputacion = np.asarray(reputacion, dtype=np.float64)
+        self.capacidad_kg = np.asarray(capacidad_kg, dtype=np.float64)
+        self.volumen_m3 = np.asarray(volumen_m3, dtype=np.float64)
+        self.reefer = np.asarray(reefer, dtype=bool)
+        self.adr = np.asarray(adr, dtype=bool)
+        self.factor_emision = np.asarray(factor_emision, dtype=np.float64)
+        self.filas_por_transportista = {}
+        for fila, transportista_id in enumerate(self.transportista_id.tolist()):
+            self.filas_por_transportista.setdefault(transportista_id, []).append(fila)
+
+    def __len__(self):
+        return len(self.camion_id)
+
+    @classmethod
+    def cargar(cls, db):
+        """Todos los camiones con los datos de su transportista, en una consulta"""
+        aceptadas = db.query(
+            models.OrdenCarga.transportista_asignado_id.label("transportista_id"),
+            func.count(models.OrdenCarga.id).label("cantidad")
+        ).filter(models.OrdenCarga.estado == "aceptada").group_by(
+            models.OrdenCarga.transportista_asignado_id
+        ).subquery()
+
+        filas = db.query(
+            models.Transportista.id,
+            models.Camion.id,
+            models.Transportista.ubicacion_actual_lat,
+            models.Transportista.ubicacion_actual_lon,
+            models.Transportista.disponible,
+            func.coalesce(aceptadas.c.cantidad, 0),
+            models.Transportista.reputacion,
+            models.Camion.capacidad_kg,
+            models.Camion.volumen_m3,
+            models.Camion.reefer,
+            models.Camion.adr,
+            models.Camion.combustible
+        ).join(
+            models.Camion, models.Camion.transportista_id == models.Transportista.id
+        ).outerjoin(
+            aceptadas, aceptadas.c.transportista_id == models.Transportista.id
+        ).all()
+
+        def numero(valor, defecto=0.0):
+            return float(valor) if valor is not None else defecto
+
+        return cls(
+            [f[0] for f in filas],
+            [f[1] for f in filas],
+            [numero(f[2], np.nan) for f in filas],
+            [numero(f[3], np.nan) for f in filas],
+            [bool(f[4]) for f in filas],
+            [f[5] for f in filas],
+            [numero(f[6]) for f in filas],
+            [numero(f[7]) for f in filas],
+            [numero(f[8]) for f in filas],
+            [bool(f[9]) for f in filas],
+            [bool(f[10]) for f in filas],
+            [FACTORES_EMISION.get(f[11], FACTOR_EMISION_DEFECTO) for f in filas]
+        )
+
+
+def distancias_km(lat, lon, lat_destino, lon_destino):
+    """Haversine vectorizado desde arrays de posiciones hasta un punto"""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lat_destino)
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(lon_destino - lon) / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def rankear(instantanea, origen_lat, origen_lon, distancia_km, peso_kg, volumen_m3=0.0,
+            req_reefer=False, req_adr=False, k=10, pesos=PESOS):
+    """Los k mejores candidatos: lista de dicts (transportista_id, camion_id, puntaje...)"""
+    i = instantanea
+    validos = (
+        i.disponible
+        & (i.ofertas_aceptadas < MAX_OFERTAS_ACEPTADAS)
+        & (i.capacidad_kg >= peso_kg)
+        & (i.volumen_m3 >= (volumen_m3 or 0.0))
+        & ~np.isnan(i.lat)
+    )
+    if req_reefer:
+        validos &= i.reefer
+    if req_adr:
+        validos &= i.adr
+    filas = np.flatnonzero(validos)
+    if len(filas) == 0:
+        return []
+
+    vacio_km = distancias_km(i.lat[filas], i.lon[filas], origen_lat, origen_lon)
+    co2_kg = (vacio_km + (distancia_km or 0.0)) * CONSUMO_LITROS_POR_KM * i.factor_emision[filas]
+    puntaje = (
+        pesos["distancia"] / (1 + vacio_km / DISTANCIA_MEDIA_KM)
+        + pesos["reputacion"] * np.clip(i.reputacion[filas] / 5, 0, 1)
+        # Relativo al menor CO2 entre los candidatos (el mejor vale 1)
+        + pesos["co2"] * np.divide(co2_kg.min(), co2_kg, out=np.ones_like(co2_kg), where=co2_kg > 0)
+    )
+
+    # El mejor camión de cada transportista: ordenar por (transportista, -puntaje) y quedarse con el primero
+    orden = np.lexsort((-puntaje, i.transportista_id[filas]))
+    transportistas_ordenados = i.transportista_id[filas][orden]
+    primeros = orden[np.r_[True, transportistas_ordenados[1:] != transportistas_ordenados[:-1]]]
+
+    if len(primeros) > k:
+        primeros = primeros[np.argpartition(-puntaje[primeros], k - 1)[:k]]
+    primeros = primeros[np.argsort(-puntaje[primeros], kind="stable")]
+
+    return [
+        {
+            "transportista_id": int(i.transportista_id[filas[j]]),
+            "camion_id": int(i.camion_id[filas[j]]),
+            "distancia_vacio_km": round(float(vacio_km[j]), 2),
+            "co2_estimado_kg": round(float(co2_kg[j]), 2),
+            "puntaje": round(float(puntaje[j]), 4)
+        }
+        for j in primeros.tolist()
+    ]
+
+
+class MotorAsignacion:
+    def __init__(self, ttl_segundos=60):
+        self.ttl = ttl_segundos
+        self._instantanea = None
+        self._expira = 0.0
+        self._lock = threading.Lock()
+        self.cargas = 0
+
+    def instantanea(self, db):
+        """Instantánea vigente, recargándola con `db` (Session) si venció"""
+        with self._lock:
+            if self._instantanea is not None and time.monotonic() < self._expira:
+                return self._instantanea
+        instantanea = InstantaneaCandidatos.cargar(db)
+        with self._lock:
+            self._instantanea = instantanea
+            self._expira = time.monotonic() + self.ttl
+            self.cargas += 1
+        return instantanea
+
+    def candidatos(self, db, orden, k=10):
+        """Top-k para una OrdenCarga (con su origen cargado); sin coordenadas de origen, ninguno"""
+        origen = orden.origen
+        if origen is None or origen.lat is None or origen.lon is None:
+            return []
+        instantanea = self.instantanea(db)
+        with self._lock:
+            return rankear(
+                instantanea,
+                float(origen.lat), float(origen.lon),
+                float(orden.distancia_km or 0),
+                float(orden.peso_kg or 0),
+                float(orden.volumen_m3 or 0),
+                bool(orden.req_reefer), bool(orden.req_adr),
+                k=k
+            )
+
+    def mover(self, transportista_id, lat, lon):
+        with self._lock:
+            if self._instantanea is None:
+                return
+            filas = self._instantanea.filas_por_transportista.get(transportista_id)
+            if filas:
+                self._instantanea.lat[filas] = float(lat) if lat is not None else np.nan
+                self._instantanea.lon[filas] = float(lon) if lon is not None else np.nan
+
+    def actualizar_disponibilidad(self, transportista_id, disponible):
+        with self._lock:
+            if self._instantanea is None:
+                return
+            filas = self._instantanea.filas_por_transportista.get(transportista_id)
+            if filas:
+                self._instantanea.disponible[filas] = bool(disponible)
+
+    def invalidar(self):
+        """Forzar la recarga (p. ej. un transportista o camión nuevo, o un
+        cambio en las ofertas aceptadas)"""
+        with self._lock:
+            self._instantanea = None
+
+
+motor_asignacion = MotorAsignacion(ttl_segundos=float(os.getenv("ASIGNACION_TTL_SEGUNDOS", "60")))
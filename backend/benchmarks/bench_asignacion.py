@@ -0,0 +1,96 @@
+"""Benchmark: ranking de candidatos para una orden (asignacion.py)
+
+Compara el ranking vectorizado sobre la instantánea en numpy con el mismo
+cálculo hecho fila por fila en Python, para flotas sintéticas de 1.000, 10.000
+y 50.000 camiones repartidos por la península, y comprueba que los dos
+devuelven el mismo top-k.
+
+Uso (desde backend/): python benchmarks/bench_asignacion.py
+"""
+import heapq
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asignacion  # noqa: E402
+from rutas import distancia_haversine  # noqa: E402
+
+ORDEN = dict(origen_lat=40.4168, origen_lon=-3.7038, distancia_km=620.0, peso_kg=15000.0,
+             volumen_m3=40.0, req_reefer=True, req_adr=False, k=10)
+
+
+def flota_sintetica(n, semilla=7):
+    """n camiones; algunos transportistas tienen dos"""
+    rng = np.random.default_rng(semilla)
+    transportistas = np.sort(rng.integers(1, int(n * 0.8) + 1, n))
+    return asignacion.InstantaneaCandidatos(
+        transportista_id=transportistas,
+        camion_id=np.arange(1, n + 1),
+        lat=rng.uniform(36.5, 43.5, n),
+        lon=rng.uniform(-9.0, 3.0, n),
+        disponible=rng.random(n) < 0.7,
+        ofertas_aceptadas=rng.integers(0, 3, n),
+        reputacion=rng.uniform(3.0, 5.0, n),
+        capacidad_kg=rng.choice([10000, 12000, 18000, 24000, 28000], n),
+        volumen_m3=rng.choice([30, 50, 90], n),
+        reefer=rng.random(n) < 0.4,
+        adr=rng.random(n) < 0.2,
+        factor_emision=rng.choice(list(asignacion.FACTORES_EMISION.values()), n)
+    )
+
+
+def rankear_python(inst, origen_lat, origen_lon, distancia_km, peso_kg, volumen_m3, req_reefer, req_adr, k):
+    """El mismo ranking recorriendo los camiones uno por uno"""
+    candidatos = []
+    for f in range(len(inst)):
+        if not inst.disponible[f] or inst.ofertas_aceptadas[f] >= asignacion.MAX_OFERTAS_ACEPTADAS:
+            continue
+        if inst.capacidad_kg[f] < peso_kg or inst.volumen_m3[f] < volumen_m3:
+            continue
+        if (req_reefer and not inst.reefer[f]) or (req_adr and not inst.adr[f]):
+            continue
+        vacio = distancia_haversine(inst.lat[f], inst.lon[f], origen_lat, origen_lon)
+        co2 = (vacio + distancia_km) * asignacion.CONSUMO_LITROS_POR_KM * inst.factor_emision[f]
+        candidatos.append((f, vacio, co2))
+    if not candidatos:
+        return []
+    co2_min = min(co2 for _, _, co2 in candidatos)
+    pesos = asignacion.PESOS
+    mejor_por_transportista = {}
+    for f, vacio, co2 in candidatos:
+        puntaje = (pesos["distancia"] / (1 + vacio / asignacion.DISTANCIA_MEDIA_KM)
+                   + pesos["reputacion"] * min(max(inst.reputacion[f] / 5, 0), 1)
+                   + pesos["co2"] * (co2_min / co2 if co2 > 0 else 1))
+        t = int(inst.transportista_id[f])
+        if t not in mejor_por_transportista or puntaje > mejor_por_transportista[t][0]:
+            mejor_por_transportista[t] = (puntaje, int(inst.camion_id[f]))
+    mejores = heapq.nlargest(k, mejor_por_transportista.items(), key=lambda par: par[1][0])
+    return [(t, camion) for t, (_, camion) in mejores]
+
+
+def medir(funcion, repeticiones):
+    funcion()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1000
+
+
+def main():
+    print(f"{'camiones':>10}{'python (ms)':>14}{'numpy (ms)':>13}{'x':>8}")
+    for n in (1000, 10000, 50000):
+        inst = flota_sintetica(n)
+        vectorizado = asignacion.rankear(inst, **ORDEN)
+        esperado = rankear_python(inst, **ORDEN)
+        assert [(c["transportista_id"], c["camion_id"]) for c in vectorizado] == esperado, n
+
+        t_python = medir(lambda: rankear_python(inst, **ORDEN), 3)
+        t_numpy = medir(lambda: asignacion.rankear(inst, **ORDEN), 50)
+        print(f"{n:>10}{t_python:>14.2f}{t_numpy:>13.3f}{t_python / t_numpy:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark: costo por actualización GPS del cálculo de distancia recorrida
+
+Compara la implementación original en Python puro (vértice más cercano +
+re-suma de segmentos) con la vectorizada de rutas.py, sobre rutas sintéticas
+de 5.000 y 50.000 puntos.
+
+Uso (desde backend/): python benchmarks/bench_progreso_ruta.py
+"""
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rutas  # noqa: E402
+
+
+def distancia_recorrida_python(ruta, lat_actual, lon_actual):
+    """Implementación anterior de calcular_distancia_recorrida"""
+    def distancia_haversine(lat1, lon1, lat2, lon2):
+        R = 6371
+        dlat = math.radians(lat2 - lat1)
+        dlon = math.radians(lon2 - lon1)
+        a = (math.sin(dlat / 2) ** 2 +
+             math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+             math.sin(dlon / 2) ** 2)
+        return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    distancia_min = float("inf")
+    indice_cercano = 0
+    for i, punto in enumerate(ruta):
+        dist = distancia_haversine(lat_actual, lon_actual, punto["lat"], punto["lng"])
+        if dist < distancia_min:
+            distancia_min = dist
+            indice_cercano = i
+
+    total = 0
+    for i in range(indice_cercano):
+        total += distancia_haversine(ruta[i]["lat"], ruta[i]["lng"], ruta[i + 1]["lat"], ruta[i + 1]["lng"])
+    return total
+
+
+def ruta_sintetica(n):
+    """Ruta zigzagueante Madrid -> Barcelona con n puntos"""
+    f = np.linspace(0, 1, n)
+    lat = 40.4168 + (41.3851 - 40.4168) * f + 0.05 * np.sin(f * 60)
+    lon = -3.7038 + (2.1734 + 3.7038) * f
+    return np.column_stack([lat, lon])
+
+
+def medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1000
+
+
+def main():
+    for n in (5_000, 50_000):
+        coordenadas = rutas.decodificar_ruta(rutas.codificar_ruta(ruta_sintetica(n)))
+        ruta_json = rutas.ruta_a_json(coordenadas)
+        lat, lon = coordenadas[n * 2 // 3] + 0.001
+
+        acumuladas = rutas.distancias_acumuladas(coordenadas)
+
+        t_python = medir(lambda: distancia_recorrida_python(ruta_json, lat, lon), 3)
+        t_completo = medir(lambda: rutas.proyectar_en_ruta(
+            coordenadas, rutas.distancias_acumuladas(coordenadas), lat, lon), 50)
+        t_precalculado = medir(lambda: rutas.proyectar_en_ruta(coordenadas, acumuladas, lat, lon), 200)
+
+        print(f"Ruta de {n:,} puntos")
+        print(f"  {'Python puro':34}{t_python:9.3f} ms/actualización")
+        print(f"  {'numpy (recalculando acumuladas)':34}{t_completo:9.3f} ms/actualización")
+        print(f"  {'numpy (acumuladas precalculadas)':34}{t_precalculado:9.3f} ms/actualización")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark: serialización de listados de 10.000 filas
+
+Compara, para transportistas, órdenes y viajes, la respuesta de FastAPI con
+`response_model` (validación + json) contra serializacion.respuesta_json
+(orjson, sin validación). Las filas son sintéticas y con la misma forma que
+arman los endpoints; las consultas a la base no se miden. Se hace el pedido
+HTTP completo dentro del proceso (TestClient) y se comprueba que los dos
+caminos devuelven el mismo JSON.
+
+Uso (desde backend/): python benchmarks/bench_serializacion.py [--filas 10000] [--repeticiones 10]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import schemas  # noqa: E402
+import serializacion  # noqa: E402
+
+
+def transportista(i):
+    return {
+        "id": i,
+        "usuario_id": 1000 + i,
+        "nombre": f"Transportista {i}",
+        "cuil_cuit": f"20-{30000000 + i}-9",
+        "telefono": f"+54 11 5555-{i % 10000:04d}",
+        "disponible": i % 3 != 0,
+        "ubicacion_actual_lat": -34.6037 + (i % 1000) / 1000,
+        "ubicacion_actual_lon": -58.3816 + (i % 777) / 1000,
+        "camion": {
+            "id": i,
+            "patente": f"AB{i:06d}",
+            "tipo_camion": "Semirremolque",
+            "capacidad_kg": 28000.0,
+            "volumen_m3": 90.5,
+            "reefer": i % 5 == 0,
+            "adr": i % 7 == 0,
+            "combustible": "diesel"
+        },
+        "viajes_completados": i % 120,
+        "reputacion": 4.25,
+        "emisiones_co2_total": 1234.56 + i
+    }
+
+
+def orden(i):
+    creada = datetime(2024, 1, 1) + timedelta(minutes=i)
+    return {
+        "id": i,
+        "proveedor_id": i % 50 + 1,
+        "tipo_carga": "Carga general",
+        "peso_kg": 12000.5,
+        "volumen_m3": 40.0,
+        "origen": "Buenos Aires",
+        "destino": "Córdoba",
+        "ventana_desde": creada.isoformat(),
+        "ventana_hasta": (creada + timedelta(days=2)).isoformat(),
+        "req_reefer": i % 5 == 0,
+        "req_adr": False,
+        "estado": "publicada",
+        "precio": 850000.0 + i,
+        "distancia_km": 702.3,
+        "co2_estimado": 512.75,
+        "creada_en": creada.isoformat()
+    }
+
+
+def viaje(i):
+    inicio = datetime(2024, 1, 1) + timedelta(minutes=i)
+    return {
+        "id": i,
+        "transportista_id": i % 300 + 1,
+        "orden_id": i,
+        "proveedor_id": i % 50 + 1,
+        "origen": "Buenos Aires",
+        "destino": "Córdoba",
+        "origen_lat": -34.6037,
+        "origen_lon": -58.3816,
+        "destino_lat": -31.4201,
+        "destino_lon": -64.1888,
+        "ubicacion_actual_lat": -33.1 + (i % 1000) / 1000,
+        "ubicacion_actual_lon": -60.2 - (i % 1000) / 1000,
+        "distancia_total_km": 702.3,
+        "distancia_recorrida_km": float(i % 700),
+        "tiempo_estimado_minutos": 540,
+        "tiempo_transcurrido_minutos": i % 540,
+        "estado": "en_progreso",
+        "fecha_inicio": inicio.isoformat(),
+        "fecha_fin": None,
+        "ultima_actualizacion": (inicio + timedelta(hours=1)).isoformat(),
+        "detenido_minutos": 0,
+        "ruta_completa": None,
+        "ruta_estado": "calculada"
+    }
+
+
+CASOS = [
+    ("transportistas", schemas.TransportistaDetalle, transportista),
+    ("ordenes", schemas.OrdenCargaDetalle, orden),
+    ("viajes", schemas.ViajeDetalle, viaje),
+]
+
+
+def agregar_rutas(app, nombre, modelo, datos):
+    # Antes: FastAPI valida contra response_model y codifica con json
+    @app.get(f"/antes/{nombre}", response_model=List[modelo])
+    def antes():
+        return datos
+
+    # Después: orjson sin validación
+    @app.get(f"/despues/{nombre}", response_model=List[modelo])
+    def despues():
+        return serializacion.respuesta_json(datos)
+
+
+def crear_app(filas):
+    app = FastAPI()
+    for nombre, modelo, generar in CASOS:
+        agregar_rutas(app, nombre, modelo, [generar(i) for i in range(1, filas + 1)])
+    return app
+
+
+def medir(client, url, repeticiones):
+    client.get(url)  # calentamiento
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        respuesta = client.get(url)
+    return (time.perf_counter() - inicio) / repeticiones, respuesta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=10)
+    args = parser.parse_args()
+
+    client = TestClient(crear_app(args.filas))
+    print(f"{args.filas} filas por respuesta, {args.repeticiones} repeticiones\n")
+    print(f"{'listado':<15}{'antes (ms)':>12}{'después (ms)':>14}{'antes (resp/s)':>16}{'después (resp/s)':>18}{'x':>7}")
+    for nombre, _, _ in CASOS:
+        t_antes, r_antes = medir(client, f"/antes/{nombre}", args.repeticiones)
+        t_despues, r_despues = medir(client, f"/despues/{nombre}", args.repeticiones)
+        assert json.loads(r_antes.content) == json.loads(r_despues.content), nombre
+        print(
+            f"{nombre:<15}{t_antes * 1000:>12.1f}{t_despues * 1000:>14.1f}"
+            f"{1 / t_antes:>16.1f}{1 / t_despues:>18.1f}{t_antes / t_despues:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
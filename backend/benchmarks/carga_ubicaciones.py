@@ -0,0 +1,105 @@
+"""Prueba de carga: latencia de pedidos no relacionados durante una ráfaga de GPS
+
+Mientras varios clientes envían PUT /api/transportistas/{id}/ubicacion sin
+pausa, otro cliente consulta un endpoint liviano (GET /api/config/tipos-camion)
+y se mide su latencia. Si los endpoints de ubicación bloquean el event loop
+(sesión sincrónica dentro de un async def), la p99 de esas consultas crece con
+la ráfaga; con la sesión async debería quedar cerca de la medida en reposo.
+
+Requiere la API corriendo contra una base con datos (seed_data.py).
+
+Uso (desde backend/):
+    python benchmarks/carga_ubicaciones.py --url http://localhost:8000 \
+        --transportistas 50 --concurrencia 32 --segundos 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def resumen(nombre, latencias_ms):
+    print(
+        f"  {nombre:28} n={len(latencias_ms):6}  "
+        f"p50={percentil(latencias_ms, 50):8.1f} ms  "
+        f"p95={percentil(latencias_ms, 95):8.1f} ms  "
+        f"p99={percentil(latencias_ms, 99):8.1f} ms"
+    )
+
+
+async def enviar_ubicaciones(client, transportistas, fin, latencias, errores):
+    while time.perf_counter() < fin:
+        transportista_id = random.choice(transportistas)
+        cuerpo = {
+            "ubicacion_actual_lat": round(random.uniform(36.0, 43.5), 6),
+            "ubicacion_actual_lon": round(random.uniform(-9.0, 3.0), 6)
+        }
+        inicio = time.perf_counter()
+        try:
+            r = await client.put(f"/api/transportistas/{transportista_id}/ubicacion", json=cuerpo)
+            if r.status_code != 200:
+                errores.append(r.status_code)
+        except httpx.HTTPError as e:
+            errores.append(type(e).__name__)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+
+async def consultar_no_relacionado(client, fin, latencias, pausa):
+    while time.perf_counter() < fin:
+        inicio = time.perf_counter()
+        await client.get("/api/config/tipos-camion")
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        await asyncio.sleep(pausa)
+
+
+async def medir_reposo(client, segundos, pausa):
+    latencias = []
+    await consultar_no_relacionado(client, time.perf_counter() + segundos, latencias, pausa)
+    return latencias
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--transportistas", type=int, default=50, help="ids 1..N a los que se envían posiciones")
+    parser.add_argument("--concurrencia", type=int, default=32, help="clientes enviando GPS en paralelo")
+    parser.add_argument("--segundos", type=float, default=20)
+    parser.add_argument("--pausa", type=float, default=0.02, help="pausa entre consultas no relacionadas")
+    args = parser.parse_args()
+
+    limites = httpx.Limits(max_connections=args.concurrencia + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=30.0, limits=limites) as client:
+        transportistas = list(range(1, args.transportistas + 1))
+
+        reposo = await medir_reposo(client, min(5.0, args.segundos), args.pausa)
+
+        fin = time.perf_counter() + args.segundos
+        latencias_gps, latencias_otras, errores = [], [], []
+        await asyncio.gather(
+            consultar_no_relacionado(client, fin, latencias_otras, args.pausa),
+            *[
+                enviar_ubicaciones(client, transportistas, fin, latencias_gps, errores)
+                for _ in range(args.concurrencia)
+            ]
+        )
+
+    print(f"Ráfaga de {args.segundos:.0f} s con {args.concurrencia} clientes GPS ({len(latencias_gps) / args.segundos:.0f} actualizaciones/s)")
+    resumen("tipos-camion en reposo", reposo)
+    resumen("tipos-camion durante ráfaga", latencias_otras)
+    resumen("PUT ubicacion", latencias_gps)
+    if errores:
+        print(f"  {len(errores)} actualizaciones con error (ej.: {errores[:5]})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
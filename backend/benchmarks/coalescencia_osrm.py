@@ -0,0 +1,152 @@
+"""Chequeo: el cache de rutas OSRM consulta al router una sola vez por clave
+
+Levanta dentro del proceso un router de prueba que imita /route/v1/driving de
+OSRM (app ASGI, servida con httpx.ASGITransport) y le apunta un ClienteOSRM
+real, así que se ejercitan el armado de la URL, la lectura de la respuesta y
+el camino de error. El router cuenta los pedidos y tarda un poco en responder,
+para que los pedidos concurrentes se pisen. Verifica que:
+1. N pedidos concurrentes para la misma ruta hacen un solo pedido al router y
+   el resto espera ese resultado (coalescidos), con la ruta bien leída.
+2. Un cache nuevo (memoria vacía, p. ej. otro proceso) la encuentra en la
+   tabla rutas_osrm_cache sin consultar al router, y después en memoria.
+3. Una entrada vencida en la tabla no se usa.
+4. Si el router responde con error (HTTP 500 o sin rutas) no se guarda nada
+   y el siguiente pedido vuelve a consultar.
+
+Por defecto usa una base SQLite en memoria; con --url se puede apuntar a un
+Postgres de prueba (se borran y recrean las tablas).
+
+Uso (desde backend/): python benchmarks/coalescencia_osrm.py [--n 50] [--url postgresql://...]
+"""
+import argparse
+import asyncio
+import functools
+import os
+import sys
+from datetime import timedelta
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+import models  # noqa: E402
+import osrm  # noqa: E402
+import rutas  # noqa: E402
+
+ORIGEN = (-58.3816, -34.6037)
+DESTINO = (-64.1888, -31.4201)
+# Rutas para las que el router de prueba falla
+ORIGEN_ERROR_HTTP = (-60.0, -33.0)
+ORIGEN_SIN_RUTA = (-61.0, -32.0)
+
+
+def crear_router(demora=0.05):
+    """App que responde como OSRM: ruta origen -> punto medio -> destino"""
+    app = FastAPI()
+    app.state.pedidos = 0
+
+    @app.get("/route/v1/driving/{coordenadas}")
+    async def route(coordenadas: str, overview: str = None, geometries: str = None):
+        app.state.pedidos += 1
+        await asyncio.sleep(demora)
+        if overview != "full" or geometries != "geojson":
+            return JSONResponse({"code": "InvalidQuery"}, status_code=400)
+        (origen_lon, origen_lat), (destino_lon, destino_lat) = (
+            tuple(float(x) for x in punto.split(",")) for punto in coordenadas.split(";")
+        )
+        if (origen_lon, origen_lat) == ORIGEN_ERROR_HTTP:
+            return JSONResponse({"code": "Error"}, status_code=500)
+        if (origen_lon, origen_lat) == ORIGEN_SIN_RUTA:
+            return {"code": "NoRoute", "routes": []}
+        medio = [(origen_lon + destino_lon) / 2, (origen_lat + destino_lat) / 2]
+        return {
+            "code": "Ok",
+            "routes": [{
+                "geometry": {"type": "LineString", "coordinates": [[origen_lon, origen_lat], medio, [destino_lon, destino_lat]]},
+                "distance": 702345.0,
+                "duration": 32400.0
+            }]
+        }
+
+    return app
+
+
+async def pedir(cache, n, origen=ORIGEN):
+    return await asyncio.gather(*(cache.obtener(*origen, *DESTINO) for _ in range(n)))
+
+
+async def verificar(n):
+    router = crear_router()
+    cliente = osrm.ClienteOSRM("http://osrm-local", transport=httpx.ASGITransport(app=router))
+    consultar = functools.partial(osrm.consultar_osrm, cliente=cliente)
+
+    def cache_nuevo(**kwargs):
+        router.state.pedidos = 0
+        return osrm.CacheRutasOSRM(consultar=consultar, **kwargs)
+
+    try:
+        cache = cache_nuevo()
+        resultados = await pedir(cache, n)
+        print(f"{n} pedidos concurrentes: {router.state.pedidos} pedido(s) al router   {cache.resumen()}")
+        assert router.state.pedidos == 1, router.state.pedidos
+        assert cache.estadisticas["coalescidos"] == n - 1, cache.estadisticas
+        assert all(r == resultados[0] for r in resultados)
+        ruta = resultados[0]
+        assert (ruta["distance"], ruta["duration"]) == (702.35, 540), ruta
+        puntos = rutas.decodificar_ruta(ruta["ruta_geom"])
+        assert len(puntos) == 3
+        assert abs(puntos[0][0] - ORIGEN[1]) < 1e-4 and abs(puntos[0][1] - ORIGEN[0]) < 1e-4, puntos[0]
+
+        cache = cache_nuevo()
+        await pedir(cache, n)
+        await pedir(cache, n)
+        print(f"cache nuevo, 2 x {n} pedidos:  {router.state.pedidos} pedido(s) al router   {cache.resumen()}")
+        assert router.state.pedidos == 0, router.state.pedidos
+        assert cache.estadisticas["hits_db"] == 1, cache.estadisticas
+        assert cache.estadisticas["hits_memoria"] == n, cache.estadisticas
+
+        # Guardar la misma clave ya vencida: no tiene que servir desde la tabla
+        osrm.CacheRutasOSRM(ttl=timedelta(seconds=-1))._guardar_db(osrm.clave_ruta(*ORIGEN, *DESTINO), ruta)
+        cache = cache_nuevo()
+        await pedir(cache, n)
+        print(f"entrada vencida, {n} pedidos:  {router.state.pedidos} pedido(s) al router   {cache.resumen()}")
+        assert router.state.pedidos == 1, router.state.pedidos
+        assert cache.estadisticas["hits_db"] == 0, cache.estadisticas
+
+        for nombre, origen in (("HTTP 500", ORIGEN_ERROR_HTTP), ("sin ruta", ORIGEN_SIN_RUTA)):
+            cache = cache_nuevo()
+            primeros = await pedir(cache, n, origen)
+            segundos = await pedir(cache, n, origen)
+            print(f"router con error ({nombre}), 2 x {n} pedidos: {router.state.pedidos} pedido(s) al router   {cache.resumen()}")
+            assert all(r is None for r in primeros + segundos)
+            assert router.state.pedidos == 2, router.state.pedidos
+            assert cache.estadisticas["errores"] == 2, cache.estadisticas
+    finally:
+        await cliente.cerrar()
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=50)
+    parser.add_argument("--url", default=None, help="Base de prueba (por defecto SQLite en memoria)")
+    args = parser.parse_args()
+
+    if args.url:
+        engine = create_engine(args.url)
+    else:
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    asyncio.run(verificar(args.n))
+    print("OK: un pedido al router por clave, y el cache en la base respeta el vencimiento y no guarda errores")
+
+
+if __name__ == "__main__":
+    ejecutar()
@@ -0,0 +1,98 @@
+"""Chequeo: GET /api/transportistas hace la misma cantidad de consultas con 1 o N transportistas
+
+Cuenta las sentencias SQL que ejecuta el endpoint (listener
+before_cursor_execute) con una flota de 1 transportista y con una de N, y
+falla si difieren. Por defecto usa una base SQLite en memoria; con --url se
+puede apuntar a un Postgres de prueba (se borran y recrean las tablas).
+
+Uso (desde backend/): python benchmarks/consultas_transportistas.py [--n 200] [--url postgresql://...]
+"""
+import argparse
+import os
+import sys
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main  # noqa: E402
+import models  # noqa: E402
+
+
+def crear_flota(Session, n):
+    db = Session()
+    tipo = models.TipoCamion(nombre="Trailer")
+    db.add(tipo)
+    db.flush()
+    for i in range(n):
+        usuario = models.Usuario(email=f"t{n}-{i}@logistica.com", hash="x", rol_global="transportista")
+        db.add(usuario)
+        db.flush()
+        transportista = models.Transportista(
+            usuario_id=usuario.id, disponible=i % 2 == 0,
+            ubicacion_actual_lat=40.0 + i / 1000, ubicacion_actual_lon=-3.7,
+            viajes_completados=0, reputacion=4.5, emisiones_co2_total=0
+        )
+        db.add(transportista)
+        db.flush()
+        db.add(models.Camion(
+            transportista_id=transportista.id, patente=f"P{n}-{i}", tipo_camion_id=tipo.id,
+            capacidad_kg=12000, volumen_m3=50, reefer=i % 3 == 0, adr=False, combustible="Diesel"
+        ))
+    db.commit()
+    db.close()
+
+
+def contar_consultas(engine, n, url):
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    crear_flota(Session, n)
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[main.get_db] = get_db
+    sentencias = []
+
+    def registrar(conn, cursor, sentencia, *args):
+        sentencias.append(sentencia)
+
+    event.listen(engine, "before_cursor_execute", registrar)
+    try:
+        respuesta = TestClient(main.app).get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", registrar)
+        main.app.dependency_overrides.pop(main.get_db, None)
+    assert respuesta.status_code == 200, respuesta.text
+    return len(sentencias), len(respuesta.json())
+
+
+def ejecutar():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=200)
+    parser.add_argument("--url", default=None, help="Base de prueba (por defecto SQLite en memoria)")
+    args = parser.parse_args()
+
+    if args.url:
+        engine = create_engine(args.url)
+    else:
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+    for url in ("/api/transportistas", "/api/transportistas?disponible=true&reefer=true", "/api/transportistas?limit=50"):
+        consultas_1, filas_1 = contar_consultas(engine, 1, url)
+        consultas_n, filas_n = contar_consultas(engine, args.n, url)
+        print(f"{url:<50} 1 transportista: {consultas_1} consultas ({filas_1} filas)   "
+              f"{args.n} transportistas: {consultas_n} consultas ({filas_n} filas)")
+        assert consultas_1 == consultas_n, f"{url}: {consultas_1} != {consultas_n}"
+    print("OK: la cantidad de consultas no depende del tamaño de la flota")
+
+
+if __name__ == "__main__":
+    ejecutar()
@@ -0,0 +1,47 @@
+"""Respuestas GET condicionales (ETag / If-None-Match)
+
+El cliente reenvía el ETag recibido en If-None-Match; si la representación no
+cambió se responde 304 sin cuerpo y el navegador usa su copia.
+"""
+import hashlib
+
+from fastapi import Response
+
+# Los listados se pueden guardar, pero hay que revalidarlos en cada uso
+CACHE_CONTROL_REVALIDAR = "no-cache"
+
+
+def calcular_etag(cuerpo: bytes) -> str:
+    return '"' + hashlib.sha1(cuerpo).hexdigest() + '"'
+
+
+def etag_coincide(if_none_match, etag):
+    """Si el header If-None-Match incluye el ETag (comparación débil, como indica RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(candidato.strip().removeprefix("W/") == etag for candidato in if_none_match.split(","))
+
+
+def respuesta_json(cuerpo: bytes, etag, if_none_match, cache_control):
+    """Respuesta JSON ya serializada con ETag, o 304 si el cliente tiene la misma versión"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+
+def etag_version(*partes):
+    """ETag débil a partir de una versión (filtros + agregados de la consulta), sin serializar el cuerpo"""
+    return 'W/"' + hashlib.sha1(repr(partes).encode()).hexdigest() + '"'
+
+
+def no_modificado(response: Response, if_none_match, etag):
+    """Agregar ETag a la respuesta; devuelve un 304 si el cliente ya tiene esa versión, si no None"""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL_REVALIDAR}
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,88 @@
+"""Cache en memoria de los datos de referencia (tipos de camión y de carga)
+
+Estas tablas casi no cambian, pero se consultaban en cada pedido: en los
+endpoints de /api/config y al buscar tipos por nombre o id en el registro de
+transportistas, el login, el perfil y la creación de órdenes. Se cargan juntas
+en una instantánea inmutable (filas como dicts, índices por id y por nombre y
+el JSON ya serializado con su ETag) que se reemplaza entera al recargar.
+
+`crear_orden` invalida la cache al insertar un tipo de carga nuevo. Los demás
+procesos no se enteran de esa invalidación: recargan al vencer el TTL
+(CATALOGOS_TTL_SEGUNDOS), y una búsqueda por nombre que no está en la cache
+igual se confirma contra la base antes de insertar.
+"""
+import json
+import os
+import threading
+import time
+
+import models
+from cache_http import calcular_etag
+
+
+class TablaReferencia:
+    def __init__(self, filas):
+        self.filas = filas
+        self.cuerpo = json.dumps(filas, ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = calcular_etag(self.cuerpo)
+        self.por_id = {fila["id"]: fila for fila in filas}
+        self.por_nombre = {}
+        for fila in filas:
+            self.por_nombre.setdefault(fila["nombre"], fila)
+
+    def primera(self):
+        return self.filas[0] if self.filas else None
+
+
+def _numero(valor):
+    return float(valor) if valor is not None else None
+
+
+class CatalogoReferencia:
+    def __init__(self, ttl_segundos=300):
+        self.ttl = ttl_segundos
+        self._tablas = None  # {"tipos_camion": TablaReferencia, "tipos_carga": TablaReferencia}
+        self._expira = 0.0
+        self._lock = threading.Lock()
+        self.cargas = 0
+
+    def _vigentes(self):
+        tablas = self._tablas
+        if tablas is not None and time.monotonic() < self._expira:
+            return tablas
+        return None
+
+    def cargar(self, db):
+        """Leer las tablas de referencia con una sesión sincrónica y reemplazar la instantánea"""
+        tipos_camion = [
+            {"id": t.id, "nombre": t.nombre, "ejes": t.ejes, "largo_m": _numero(t.largo_m), "alto_m": _numero(t.alto_m)}
+            for t in db.query(models.TipoCamion).order_by(models.TipoCamion.id)
+        ]
+        tipos_carga = [
+            {"id": t.id, "nombre": t.nombre, "requiere_reefer": t.requiere_reefer, "adr_clase": t.adr_clase}
+            for t in db.query(models.TipoCarga).order_by(models.TipoCarga.id)
+        ]
+        tablas = {
+            "tipos_camion": TablaReferencia(tipos_camion),
+            "tipos_carga": TablaReferencia(tipos_carga)
+        }
+        with self._lock:
+            self._tablas = tablas
+            self._expira = time.monotonic() + self.ttl
+            self.cargas += 1
+        return tablas
+
+    def obtener(self, db):
+        """Tablas de referencia, recargándolas con `db` (Session) si hace falta"""
+        return self._vigentes() or self.cargar(db)
+
+    async def obtener_async(self, db):
+        """Igual que `obtener` pero con una AsyncSession"""
+        return self._vigentes() or await db.run_sync(self.cargar)
+
+    def invalidar(self):
+        with self._lock:
+            self._tablas = None
+
+
+catalogo = CatalogoReferencia(ttl_segundos=float(os.getenv("CATALOGOS_TTL_SEGUNDOS", "300")))
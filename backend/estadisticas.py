@@ -0,0 +1,326 @@
+"""Estadísticas de la plataforma mantenidas de forma incremental
+
+El dashboard de administración lee una sola fila (`estadisticas_plataforma`,
+id=1) en vez de recorrer usuarios, transportistas y órdenes en cada carga. Los
+endpoints que crean usuarios, cambian el estado de una orden, finalizan viajes
+o califican transportistas suman sus deltas a esa fila con `sumar` (o
+`sumar_async`) dentro de su propia transacción, así el contador y el cambio se
+confirman o se descartan juntos. Como es un `x = x + delta` en SQL, dos
+transacciones concurrentes no se pisan: la segunda espera el lock de la fila
+hasta que la primera hace commit.
+
+`reconciliar` recalcula todo desde las tablas y reporta las diferencias (por
+ejemplo, datos cargados con seed_data.py o editados a mano). Se ejecuta
+periódicamente desde la app (ESTADISTICAS_RECONCILIAR_HORAS), desde
+`POST /api/admin/estadisticas/reconciliar` o con: python estadisticas.py
+
+Las estadísticas de cada transportista (perfil) se calculan con una sola
+consulta y se guardan unos segundos en `cache_estadisticas_transportista`,
+que se invalida cuando cambian sus órdenes o viajes.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from sqlalchemy import func, update, select, true
+
+import database
+import models
+
+FILA_ID = 1
+ESTADOS_EN_PROGRESO = ("aceptada", "en_progreso")
+RECONCILIAR_CADA_HORAS = float(os.getenv("ESTADISTICAS_RECONCILIAR_HORAS", "24"))
+
+CONTADORES = [
+    "total_usuarios", "total_proveedores", "total_transportistas", "total_ordenes",
+    "ordenes_completadas", "ordenes_en_progreso", "viajes_completados",
+    "co2_emitido", "co2_ahorrado_transportistas", "co2_ahorrado_ordenes",
+    "ingresos_totales", "suma_reputacion", "transportistas_con_reputacion"
+]
+
+
+# ---------- actualización incremental ----------
+
+def incremento(**deltas):
+    """UPDATE que suma los deltas distintos de cero a la fila, o None si no hay nada que sumar"""
+    valores = {
+        campo: getattr(models.EstadisticasPlataforma, campo) + delta
+        for campo, delta in deltas.items() if delta
+    }
+    if not valores:
+        return None
+    return update(models.EstadisticasPlataforma).where(
+        models.EstadisticasPlataforma.id == FILA_ID
+    ).values(actualizada_en=func.now(), **valores)
+
+
+def sumar(db, **deltas):
+    sentencia = incremento(**deltas)
+    if sentencia is not None:
+        db.execute(sentencia)
+
+
+async def sumar_async(db, **deltas):
+    sentencia = incremento(**deltas)
+    if sentencia is not None:
+        await db.execute(sentencia)
+
+
+def delta_estado_orden(estado_anterior, estado_nuevo, precio):
+    """Deltas de los contadores de órdenes al pasar de un estado a otro"""
+    completada = int(estado_nuevo == "completada") - int(estado_anterior == "completada")
+    return {
+        "ordenes_en_progreso": int(estado_nuevo in ESTADOS_EN_PROGRESO) - int(estado_anterior in ESTADOS_EN_PROGRESO),
+        "ordenes_completadas": completada,
+        "ingresos_totales": completada * (precio or 0)
+    }
+
+
+# ---------- lectura ----------
+
+def a_respuesta(fila):
+    """Formato de GET /api/admin/estadisticas"""
+    promedio = fila.suma_reputacion / fila.transportistas_con_reputacion if fila.transportistas_con_reputacion else 0
+    return {
+        "total_usuarios": fila.total_usuarios,
+        "total_proveedores": fila.total_proveedores,
+        "total_transportistas": fila.total_transportistas,
+        "total_ordenes": fila.total_ordenes,
+        "ordenes_completadas": fila.ordenes_completadas,
+        "ordenes_en_progreso": fila.ordenes_en_progreso,
+        "co2_total_emitido": float(fila.co2_emitido),
+        "co2_total_ahorrado": float(fila.co2_ahorrado_transportistas) + float(fila.co2_ahorrado_ordenes),
+        "viajes_completados": fila.viajes_completados,
+        "ingresos_totales": float(fila.ingresos_totales),
+        "reputacion_promedio": float(promedio)
+    }
+
+
+# ---------- recálculo completo ----------
+
+def calcular(db):
+    """Valores reales de todos los contadores, calculados desde las tablas"""
+    transportistas = db.query(
+        func.count(models.Transportista.id),
+        func.coalesce(func.sum(models.Transportista.emisiones_co2_total), 0),
+        func.coalesce(func.sum(models.Transportista.co2_ahorrado), 0),
+        func.coalesce(func.sum(models.Transportista.viajes_completados), 0),
+        func.coalesce(func.sum(models.Transportista.reputacion), 0),
+        func.count(models.Transportista.reputacion)
+    ).one()
+    ordenes = db.query(
+        func.count(models.OrdenCarga.id),
+        func.count(models.OrdenCarga.id).filter(models.OrdenCarga.estado == "completada"),
+        func.count(models.OrdenCarga.id).filter(models.OrdenCarga.estado.in_(ESTADOS_EN_PROGRESO)),
+        func.coalesce(func.sum(models.OrdenCarga.co2_ahorrado), 0),
+        func.coalesce(func.sum(models.OrdenCarga.precio).filter(models.OrdenCarga.estado == "completada"), 0)
+    ).one()
+
+    return {
+        "total_usuarios": db.query(func.count(models.Usuario.id)).scalar(),
+        "total_proveedores": db.query(func.count(models.Proveedor.id)).scalar(),
+        "total_transportistas": transportistas[0],
+        "co2_emitido": transportistas[1],
+        "co2_ahorrado_transportistas": transportistas[2],
+        "viajes_completados": transportistas[3],
+        "suma_reputacion": transportistas[4],
+        "transportistas_con_reputacion": transportistas[5],
+        "total_ordenes": ordenes[0],
+        "ordenes_completadas": ordenes[1],
+        "ordenes_en_progreso": ordenes[2],
+        "co2_ahorrado_ordenes": ordenes[3],
+        "ingresos_totales": ordenes[4]
+    }
+
+
+def reconciliar(db):
+    """Recalcular los contadores desde cero y guardarlos.
+
+    Devuelve {campo: {"guardado": ..., "real": ...}} con los que no coincidían
+    (vacío si la fila recién se crea).
+    La fila se bloquea antes de calcular: las transacciones que estén sumando
+    deltas terminan antes (y su cambio entra en el cálculo) o esperan a que
+    termine el recálculo.
+    """
+    fila = db.query(models.EstadisticasPlataforma).filter(
+        models.EstadisticasPlataforma.id == FILA_ID
+    ).with_for_update().first()
+    nueva = fila is None
+    if nueva:
+        fila = models.EstadisticasPlataforma(id=FILA_ID, **{campo: 0 for campo in CONTADORES})
+        db.add(fila)
+
+    reales = calcular(db)
+    deriva = {}
+    for campo in CONTADORES:
+        guardado = getattr(fila, campo)
+        real = reales[campo]
+        if not nueva and Decimal(str(guardado)) != Decimal(str(real)):
+            deriva[campo] = {"guardado": float(guardado), "real": float(real)}
+        setattr(fila, campo, real)
+    fila.actualizada_en = func.now()
+    db.commit()
+
+    if deriva:
+        print(f"[v0] Estadísticas corregidas: {deriva}")
+    return deriva
+
+
+def reconciliar_en_sesion():
+    db = database.SessionLocal()
+    try:
+        return reconciliar(db)
+    finally:
+        db.close()
+
+
+def asegurar_fila():
+    """Crear la fila de contadores (recalculándolos) si todavía no existe"""
+    db = database.SessionLocal()
+    try:
+        if db.get(models.EstadisticasPlataforma, FILA_ID) is None:
+            reconciliar(db)
+    finally:
+        db.close()
+
+
+async def reconciliar_periodicamente():
+    if RECONCILIAR_CADA_HORAS <= 0:
+        return
+    while True:
+        await asyncio.sleep(RECONCILIAR_CADA_HORAS * 3600)
+        try:
+            await asyncio.to_thread(reconciliar_en_sesion)
+        except Exception as e:
+            print(f"[v0] Error reconciliando estadísticas: {e}")
+
+
+# ============== POR TRANSPORTISTA ==============
+
+def calcular_transportista(db, transportista_id):
+    """Estadísticas de un transportista en una consulta, o None si no existe.
+
+    Cada subconsulta agrega una tabla con FILTER (agregación condicional) y
+    devuelve siempre una fila, así que se pueden cruzar con la del transportista.
+    """
+    viajes = select(
+        func.count().filter(models.Viaje.estado == "completado").label("viajes_completados"),
+        func.count().filter(models.Viaje.estado == "en_progreso").label("viajes_en_progreso"),
+        func.sum(models.Viaje.distancia_total_km).filter(models.Viaje.estado == "completado").label("distancia_total")
+    ).where(models.Viaje.transportista_id == transportista_id).subquery()
+    ordenes = select(
+        func.count().filter(models.OrdenCarga.estado == "aceptada").label("ofertas_aceptadas"),
+        func.count().label("ofertas_recibidas"),
+        func.sum(models.OrdenCarga.precio).filter(models.OrdenCarga.estado == "completada").label("ingresos_totales")
+    ).where(models.OrdenCarga.transportista_asignado_id == transportista_id).subquery()
+
+    fila = db.execute(
+        select(
+            models.Transportista.reputacion,
+            models.Transportista.cantidad_calificaciones,
+            models.Transportista.emisiones_co2_total,
+            models.Transportista.co2_ahorrado,
+            viajes, ordenes
+        ).select_from(models.Transportista).join(viajes, true()).join(ordenes, true()).where(
+            models.Transportista.id == transportista_id
+        )
+    ).first()
+    if fila is None:
+        return None
+
+    viajes_completados = fila.viajes_completados
+    ingresos_totales = float(fila.ingresos_totales or 0)
+    emisiones = float(fila.emisiones_co2_total)
+    return {
+        "viajes_completados": viajes_completados,
+        "viajes_en_progreso": fila.viajes_en_progreso,
+        "ofertas_aceptadas": fila.ofertas_aceptadas,
+        "reputacion": float(fila.reputacion),
+        "cantidad_calificaciones": fila.cantidad_calificaciones,
+        "emisiones_co2_total": emisiones,
+        "co2_ahorrado": float(fila.co2_ahorrado) if fila.co2_ahorrado else 0,
+        "co2_promedio_viaje": emisiones / viajes_completados if viajes_completados > 0 else 0,
+        "ingresos_totales": ingresos_totales,
+        "ingreso_promedio_viaje": ingresos_totales / viajes_completados if viajes_completados > 0 else 0,
+        "distancia_total_km": float(fila.distancia_total or 0),
+        "tasa_aceptacion": round(
+            fila.ofertas_aceptadas / fila.ofertas_recibidas * 100 if fila.ofertas_recibidas > 0 else 0, 1
+        )
+    }
+
+
+class CacheEstadisticasTransportista:
+    """Estadísticas por transportista con TTL corto.
+
+    Si llegan varios pedidos juntos para un transportista que no está en la
+    cache, sólo el primero consulta la base y el resto usa ese resultado. Un
+    resultado calculado mientras se invalidaba no se guarda.
+    """
+
+    def __init__(self, ttl_segundos=30, max_transportistas=4096):
+        self.ttl = ttl_segundos
+        self.max_transportistas = max_transportistas
+        self._entradas = OrderedDict()  # transportista_id -> (expira, datos)
+        self._calculando = {}  # transportista_id -> Lock
+        self._generacion = 0  # aumenta con cada invalidación
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _vigente(self, transportista_id):
+        entrada = self._entradas.get(transportista_id)
+        if entrada is not None and entrada[0] > time.monotonic():
+            return entrada[1]
+        return None
+
+    def obtener(self, transportista_id, calcular):
+        """Estadísticas cacheadas, o el resultado de `calcular()` (que puede ser None)"""
+        with self._lock:
+            datos = self._vigente(transportista_id)
+            if datos is not None:
+                self.aciertos += 1
+                return datos
+            lock_clave = self._calculando.setdefault(transportista_id, threading.Lock())
+
+        with lock_clave:
+            with self._lock:
+                datos = self._vigente(transportista_id)
+                if datos is not None:
+                    self.aciertos += 1
+                    return datos
+                self.fallos += 1
+                generacion = self._generacion
+            try:
+                datos = calcular()
+            finally:
+                with self._lock:
+                    self._calculando.pop(transportista_id, None)
+            if datos is not None and self.ttl > 0:
+                with self._lock:
+                    if generacion == self._generacion:
+                        self._entradas[transportista_id] = (time.monotonic() + self.ttl, datos)
+                        self._entradas.move_to_end(transportista_id)
+                        while len(self._entradas) > self.max_transportistas:
+                            self._entradas.popitem(last=False)
+            return datos
+
+    def invalidar(self, *transportista_ids):
+        """Descartar las estadísticas de los transportistas (ids None se ignoran)"""
+        with self._lock:
+            self._generacion += 1
+            for transportista_id in transportista_ids:
+                if transportista_id is not None:
+                    self._entradas.pop(transportista_id, None)
+
+
+cache_estadisticas_transportista = CacheEstadisticasTransportista(
+    ttl_segundos=float(os.getenv("ESTADISTICAS_TRANSPORTISTA_TTL_SEGUNDOS", "30"))
+)
+
+
+if __name__ == "__main__":
+    deriva = reconciliar_en_sesion()
+    print(f"✅ Estadísticas reconciliadas ({len(deriva)} contadores corregidos)")
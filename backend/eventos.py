@@ -0,0 +1,52 @@
+"""Registro de eventos de dominio (tabla `eventos`, sólo inserciones)
+
+Los endpoints de registro, creación de órdenes y cambios de estado de órdenes y
+viajes agregan un evento con `registrar` en la misma transacción que el
+cambio: si el cambio se descarta, el evento también. Las filas nunca se
+modifican ni se borran.
+
+El feed de actividad del administrador lee el registro de más nuevo a más
+viejo por (creado_en, id). Otros consumidores pueden seguirlo en orden de id.
+"""
+from sqlalchemy import text
+
+import models
+
+# Eventos con los que se completa la tabla a partir de los datos existentes
+# (usuarios y órdenes anteriores al registro de eventos)
+SQL_POBLAR = [
+    """
+    INSERT INTO eventos (tipo, descripcion, usuario_id, entidad, entidad_id, creado_en)
+    SELECT 'usuario', 'Nuevo usuario registrado: ' || email, id, 'usuario', id, COALESCE(creado_en, CURRENT_TIMESTAMP)
+    FROM usuarios ORDER BY creado_en, id
+    """,
+    """
+    INSERT INTO eventos (tipo, descripcion, usuario_id, entidad, entidad_id, creado_en)
+    SELECT 'orden', 'Nueva orden de carga #' || id, proveedor_id, 'orden', id, COALESCE(creada_en, CURRENT_TIMESTAMP)
+    FROM ordenes_carga ORDER BY creada_en, id
+    """,
+]
+
+
+def registrar(db, tipo, descripcion, usuario_id=None, entidad=None, entidad_id=None, **datos):
+    """Agregar un evento a la sesión (sync o async); se guarda con el commit del llamador"""
+    evento = models.Evento(
+        tipo=tipo,
+        descripcion=descripcion,
+        usuario_id=usuario_id,
+        entidad=entidad,
+        entidad_id=entidad_id,
+        datos=datos or None
+    )
+    db.add(evento)
+    return evento
+
+
+def poblar_desde_tablas(conn):
+    """Crear los eventos de usuarios y órdenes existentes si la tabla está vacía"""
+    if conn.execute(text("SELECT 1 FROM eventos LIMIT 1")).first() is not None:
+        return 0
+    total = 0
+    for sentencia in SQL_POBLAR:
+        total += conn.execute(text(sentencia)).rowcount
+    return total
@@ -0,0 +1,213 @@
+"""Índice espacial en memoria de transportistas
+
+Grilla regular de celdas lat/lon (por defecto 0,25° ≈ 28 km) que permite
+responder "los k transportistas disponibles más cercanos a un punto" sin
+recorrer la flota completa: se revisan anillos de celdas alrededor del punto
+hasta que ya no pueda aparecer nadie más cerca que el k-ésimo encontrado.
+
+El índice se carga de la base la primera vez que se usa y después lo mantienen
+al día los endpoints que cambian ubicación o disponibilidad.
+"""
+import heapq
+import math
+import threading
+
+from sqlalchemy import func
+
+import models
+from rutas import KM_POR_GRADO, distancia_haversine
+
+
+class EntradaTransportista:
+    """Datos del transportista y de su camión necesarios para filtrar"""
+
+    __slots__ = ("id", "lat", "lon", "disponible", "capacidad_kg", "volumen_m3", "reefer", "adr")
+
+    def __init__(self, id, lat, lon, disponible, capacidad_kg, volumen_m3, reefer, adr):
+        self.id = id
+        self.lat = lat
+        self.lon = lon
+        self.disponible = disponible
+        self.capacidad_kg = capacidad_kg
+        self.volumen_m3 = volumen_m3
+        self.reefer = reefer
+        self.adr = adr
+
+    def cumple(self, capacidad_kg=None, volumen_m3=None, reefer=None, adr=None):
+        if not self.disponible:
+            return False
+        if capacidad_kg is not None and self.capacidad_kg < capacidad_kg:
+            return False
+        if volumen_m3 is not None and self.volumen_m3 < volumen_m3:
+            return False
+        if reefer is not None and self.reefer != reefer:
+            return False
+        if adr is not None and self.adr != adr:
+            return False
+        return True
+
+
+class IndiceTransportistas:
+    def __init__(self, tamano_celda=0.25):
+        self.tamano_celda = tamano_celda
+        self._entradas = {}
+        self._celdas = {}
+        self._cargado = False
+        self._lock = threading.RLock()
+
+    def _celda(self, lat, lon):
+        return (math.floor(lat / self.tamano_celda), math.floor(lon / self.tamano_celda))
+
+    # ---------- carga y mantenimiento ----------
+
+    def asegurar_cargado(self, db):
+        """Cargar el índice desde la base si todavía no se hizo"""
+        if self._cargado:
+            return
+        with self._lock:
+            if not self._cargado:
+                self.recargar(db)
+
+    def recargar(self, db):
+        """Reconstruir el índice completo con una sola consulta"""
+        primer_camion = db.query(
+            models.Camion.transportista_id.label("transportista_id"),
+            func.min(models.Camion.id).label("camion_id")
+        ).group_by(models.Camion.transportista_id).subquery()
+
+        filas = db.query(
+            models.Transportista.id,
+            models.Transportista.ubicacion_actual_lat,
+            models.Transportista.ubicacion_actual_lon,
+            models.Transportista.disponible,
+            models.Camion.capacidad_kg,
+            models.Camion.volumen_m3,
+            models.Camion.reefer,
+            models.Camion.adr
+        ).join(
+            primer_camion, primer_camion.c.transportista_id == models.Transportista.id
+        ).join(
+            models.Camion, models.Camion.id == primer_camion.c.camion_id
+        ).all()
+
+        with self._lock:
+            self._entradas = {}
+            self._celdas = {}
+            for fila in filas:
+                self._insertar(EntradaTransportista(
+                    fila.id,
+                    float(fila.ubicacion_actual_lat) if fila.ubicacion_actual_lat is not None else None,
+                    float(fila.ubicacion_actual_lon) if fila.ubicacion_actual_lon is not None else None,
+                    bool(fila.disponible),
+                    float(fila.capacidad_kg or 0),
+                    float(fila.volumen_m3 or 0),
+                    bool(fila.reefer),
+                    bool(fila.adr)
+                ))
+            self._cargado = True
+
+    def _insertar(self, entrada):
+        self._entradas[entrada.id] = entrada
+        if entrada.lat is not None and entrada.lon is not None:
+            self._celdas.setdefault(self._celda(entrada.lat, entrada.lon), set()).add(entrada.id)
+
+    def _quitar_de_celda(self, entrada):
+        if entrada.lat is None or entrada.lon is None:
+            return
+        celda = self._celda(entrada.lat, entrada.lon)
+        ids = self._celdas.get(celda)
+        if ids is not None:
+            ids.discard(entrada.id)
+            if not ids:
+                del self._celdas[celda]
+
+    def registrar(self, transportista, camion):
+        """Agregar o reemplazar un transportista (por ejemplo al registrarse)"""
+        if not self._cargado:
+            return
+        with self._lock:
+            anterior = self._entradas.get(transportista.id)
+            if anterior is not None:
+                self._quitar_de_celda(anterior)
+            self._insertar(EntradaTransportista(
+                transportista.id,
+                float(transportista.ubicacion_actual_lat) if transportista.ubicacion_actual_lat is not None else None,
+                float(transportista.ubicacion_actual_lon) if transportista.ubicacion_actual_lon is not None else None,
+                bool(transportista.disponible),
+                float(camion.capacidad_kg or 0),
+                float(camion.volumen_m3 or 0),
+                bool(camion.reefer),
+                bool(camion.adr)
+            ))
+
+    def mover(self, transportista_id, lat, lon):
+        """Actualizar la posición de un transportista"""
+        with self._lock:
+            entrada = self._entradas.get(transportista_id)
+            if entrada is None:
+                return
+            self._quitar_de_celda(entrada)
+            entrada.lat = float(lat) if lat is not None else None
+            entrada.lon = float(lon) if lon is not None else None
+            if entrada.lat is not None and entrada.lon is not None:
+                self._celdas.setdefault(self._celda(entrada.lat, entrada.lon), set()).add(entrada.id)
+
+    def actualizar_disponibilidad(self, transportista_id, disponible):
+        with self._lock:
+            entrada = self._entradas.get(transportista_id)
+            if entrada is not None:
+                entrada.disponible = bool(disponible)
+
+    # ---------- consultas ----------
+
+    def cercanos(self, lat, lon, k=10, radio_max_km=None, **filtros):
+        """Los k transportistas disponibles más cercanos: lista de (id, distancia_km)"""
+        with self._lock:
+            if not self._celdas:
+                return []
+            celda_lat, celda_lon = self._celda(lat, lon)
+            # Cantidad máxima de anillos: hasta cubrir todas las celdas ocupadas
+            max_anillo = max(
+                max(abs(c_lat - celda_lat), abs(c_lon - celda_lon))
+                for c_lat, c_lon in self._celdas
+            )
+            # Distancia mínima garantizada por cada anillo de celdas (en km). Se usa
+            # el lado más corto de una celda (el de longitud, a la latitud más alta).
+            lat_extrema = min(89.0, abs(lat) + self.tamano_celda * (max_anillo + 1))
+            lado_km = self.tamano_celda * KM_POR_GRADO * math.cos(math.radians(lat_extrema))
+
+            mejores = []  # heap de (-distancia, id) con los k mejores
+            for anillo in range(max_anillo + 1):
+                if len(mejores) >= k and (anillo - 1) * lado_km > -mejores[0][0]:
+                    break
+                if radio_max_km is not None and (anillo - 1) * lado_km > radio_max_km:
+                    break
+                for celda in self._celdas_del_anillo(celda_lat, celda_lon, anillo):
+                    for transportista_id in self._celdas.get(celda, ()):
+                        entrada = self._entradas[transportista_id]
+                        if not entrada.cumple(**filtros):
+                            continue
+                        distancia = distancia_haversine(lat, lon, entrada.lat, entrada.lon)
+                        if radio_max_km is not None and distancia > radio_max_km:
+                            continue
+                        if len(mejores) < k:
+                            heapq.heappush(mejores, (-distancia, transportista_id))
+                        elif distancia < -mejores[0][0]:
+                            heapq.heapreplace(mejores, (-distancia, transportista_id))
+
+            return sorted(((id, -d) for d, id in mejores), key=lambda par: par[1])
+
+    @staticmethod
+    def _celdas_del_anillo(celda_lat, celda_lon, anillo):
+        if anillo == 0:
+            yield (celda_lat, celda_lon)
+            return
+        for d in range(-anillo, anillo + 1):
+            yield (celda_lat - anillo, celda_lon + d)
+            yield (celda_lat + anillo, celda_lon + d)
+        for d in range(-anillo + 1, anillo):
+            yield (celda_lat + d, celda_lon - anillo)
+            yield (celda_lat + d, celda_lon + anillo)
+
+
+indice_transportistas = IndiceTransportistas()
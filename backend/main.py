@@ -1,20 +1,37 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Response, BackgroundTasks, Request, Header
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base
+from sqlalchemy.orm import Session, joinedload, aliased, defer
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, AsyncSessionLocal, engine, Base, async_engine, get_async_db
 from typing import List, Optional
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import func, or_, and_, select, tuple_
 import models
 import schemas
 import os
 from dotenv import load_dotenv
-import json
-import httpx
-import math # Added for calcular_distancia_recorrida
+import base64
+import asyncio
+from contextlib import asynccontextmanager
 
+# Cargar el .env antes de importar los módulos que leen su configuración al importarse
 load_dotenv()
 
+import rutas
+from indice_espacial import indice_transportistas
+from asignacion import motor_asignacion
+from osrm import cache_rutas_osrm, cliente_osrm
+from ubicaciones import aplicar_ubicaciones, buffer_ubicaciones, publicar_viajes
+import tiempo_real
+import estadisticas
+import eventos
+from catalogos import catalogo
+import cache_http
+import sincronizacion
+import serializacion
+
 # Leer ALLOWED_ORIGINS del .env
 allowed_origins_env = os.getenv("ALLOWED_ORIGINS", "")
 if allowed_origins_env:
@@ -24,7 +41,25 @@ else:
         "http://localhost:3000"
     ]
 
-app = FastAPI(title="Plataforma Logística API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cliente OSRM compartido: una sola conexión keep-alive para toda la app
+    await cliente_osrm.iniciar()
+    # Rutas que quedaron sin calcular si el proceso se detuvo a mitad de camino
+    tarea_rutas = asyncio.create_task(completar_rutas_pendientes())
+    buffer_ubicaciones.iniciar()
+    # Contadores del dashboard de administración (ver estadisticas.py)
+    await asyncio.to_thread(estadisticas.asegurar_fila)
+    tarea_estadisticas = asyncio.create_task(estadisticas.reconciliar_periodicamente())
+    yield
+    tarea_rutas.cancel()
+    tarea_estadisticas.cancel()
+    # Escribir las posiciones que el modo write-behind tenga pendientes
+    await buffer_ubicaciones.detener()
+    await cliente_osrm.cerrar()
+    await async_engine.dispose()
+
+app = FastAPI(title="Plataforma Logística API", version="1.0.0", lifespan=lifespan)
 
 # CORS CONFIG
 app.add_middleware(
@@ -33,6 +68,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],     # también lo podés dejar así
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor", "ETag", "X-Sync-Cursor"],
 )
 
 # Dependencia DB
@@ -43,6 +79,36 @@ def get_db():
     finally:
         db.close()
 
+# Cursores de paginación: "<iso timestamp>|<id>" codificado en base64 url-safe
+def codificar_cursor(fecha: datetime, id: int) -> str:
+    crudo = f"{fecha.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode()
+
+def decodificar_cursor(cursor: str):
+    try:
+        fecha_iso, id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(fecha_iso), int(id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+# Listados en streaming (?formato=stream|ndjson): la consulta se recorre con un
+# cursor del lado del servidor (yield_per) en una sesión propia, que dura lo que
+# dura la respuesta; en memoria queda sólo un lote de filas
+FILAS_POR_LOTE_STREAM = 1000
+FORMATO_STREAM = Query(None, pattern="^(stream|ndjson)$")
+
+def filas_en_stream(query, a_dict):
+    db = SessionLocal()
+    try:
+        for fila in query.with_session(db).yield_per(FILAS_POR_LOTE_STREAM):
+            yield a_dict(fila)
+    finally:
+        db.close()
+
+def volcar_con_schema(schema):
+    """a_dict para objetos ORM: el mismo JSON que genera el response_model en la respuesta común"""
+    return lambda fila: schema.model_validate(fila, from_attributes=True).model_dump(mode="json")
+
 # ============== AUTH ENDPOINTS ==============
 
 @app.post("/api/auth/registro/proveedor", response_model=schemas.LoginResponse)
@@ -74,6 +140,11 @@ def registro_proveedor(datos: schemas.RegistroProveedor, db: Session = Depends(g
         telefono=datos.telefono
     )
     db.add(nuevo_proveedor)
+    estadisticas.sumar(db, total_usuarios=1, total_proveedores=1)
+    eventos.registrar(
+        db, "usuario", f"Nuevo usuario registrado: {nuevo_usuario.email}",
+        usuario_id=nuevo_usuario.id, entidad="usuario", entidad_id=nuevo_usuario.id, rol="proveedor"
+    )
     db.commit()
     db.refresh(nuevo_proveedor)
     
@@ -120,17 +191,13 @@ def registro_transportista(datos: schemas.RegistroTransportista, db: Session = D
     db.flush()
     
     # Buscar tipo de camión
-    tipo_camion = db.query(models.TipoCamion).filter(
-        models.TipoCamion.nombre == datos.tipo_camion
-    ).first()
-    
-    if not tipo_camion:
-        tipo_camion = db.query(models.TipoCamion).first()
+    tipos_camion = catalogo.obtener(db)["tipos_camion"]
+    tipo_camion = tipos_camion.por_nombre.get(datos.tipo_camion) or tipos_camion.primera()
     
     # Crear camión
     nuevo_camion = models.Camion(
         transportista_id=nuevo_transportista.id,
-        tipo_camion_id=tipo_camion.id if tipo_camion else 1,
+        tipo_camion_id=tipo_camion["id"] if tipo_camion else 1,
         patente=datos.patente,
         capacidad_kg=datos.capacidad_kg,
         volumen_m3=datos.volumen_m3,
@@ -139,9 +206,21 @@ def registro_transportista(datos: schemas.RegistroTransportista, db: Session = D
         combustible=datos.combustible
     )
     db.add(nuevo_camion)
+    estadisticas.sumar(
+        db, total_usuarios=1, total_transportistas=1,
+        co2_emitido=nuevo_transportista.emisiones_co2_total,
+        suma_reputacion=nuevo_transportista.reputacion,
+        transportistas_con_reputacion=1
+    )
+    eventos.registrar(
+        db, "usuario", f"Nuevo usuario registrado: {nuevo_usuario.email}",
+        usuario_id=nuevo_usuario.id, entidad="usuario", entidad_id=nuevo_usuario.id, rol="transportista"
+    )
     db.commit()
     db.refresh(nuevo_transportista)
     db.refresh(nuevo_camion)
+    indice_transportistas.registrar(nuevo_transportista, nuevo_camion)
+    motor_asignacion.invalidar()
     
     return {
         "usuario": nuevo_usuario,
@@ -214,10 +293,8 @@ def login(credentials: schemas.LoginRequest, db: Session = Depends(get_db)):
         
         tipo_camion = None
         if camion:
-            tipo_camion_obj = db.query(models.TipoCamion).filter(
-                models.TipoCamion.id == camion.tipo_camion_id
-            ).first()
-            tipo_camion = tipo_camion_obj.nombre if tipo_camion_obj else "Camión"
+            tipo_camion_obj = catalogo.obtener(db)["tipos_camion"].por_id.get(camion.tipo_camion_id)
+            tipo_camion = tipo_camion_obj["nombre"] if tipo_camion_obj else "Camión"
         
         return {
             "usuario": {
@@ -286,63 +363,126 @@ def admin_login(credentials: schemas.LoginRequest, db: Session = Depends(get_db)
 
 # ============== TRANSPORTISTA ENDPOINTS ==============
 
+def consulta_transportistas_con_camion(db: Session):
+    """Transportista + primer camión + nombre del tipo de camión en una sola consulta"""
+    # Primer camión de cada transportista (el mismo que usaba el .first() anterior)
+    primer_camion = db.query(
+        models.Camion.transportista_id.label("transportista_id"),
+        func.min(models.Camion.id).label("camion_id")
+    ).group_by(models.Camion.transportista_id).subquery()
+
+    return db.query(models.Transportista, models.Camion, models.TipoCamion.nombre).join(
+        primer_camion, primer_camion.c.transportista_id == models.Transportista.id
+    ).join(
+        models.Camion, models.Camion.id == primer_camion.c.camion_id
+    ).outerjoin(
+        models.TipoCamion, models.TipoCamion.id == models.Camion.tipo_camion_id
+    )
+
+def transportista_a_dict(t, camion, tipo_camion_nombre):
+    # Con write-behind la posición más reciente puede no estar escrita todavía
+    lat, lon = buffer_ubicaciones.posicion(t.id) or (t.ubicacion_actual_lat, t.ubicacion_actual_lon)
+    return {
+        "id": t.id,
+        "usuario_id": t.usuario_id,
+        "nombre": f"Transportista {t.id}",
+        "cuil_cuit": t.cuil_cuit,
+        "telefono": t.telefono,
+        "disponible": t.disponible,
+        "ubicacion_actual_lat": lat,
+        "ubicacion_actual_lon": lon,
+        "camion": {
+            "id": camion.id,
+            "patente": camion.patente,
+            "tipo_camion": tipo_camion_nombre or "Camión",
+            "capacidad_kg": float(camion.capacidad_kg),
+            "volumen_m3": float(camion.volumen_m3) if camion.volumen_m3 else 0,
+            "reefer": camion.reefer,
+            "adr": camion.adr,
+            "combustible": camion.combustible
+        },
+        "viajes_completados": t.viajes_completados,
+        "reputacion": float(t.reputacion),
+        "emisiones_co2_total": float(t.emisiones_co2_total)
+    }
+
 @app.get("/api/transportistas", response_model=List[schemas.TransportistaDetalle])
 def listar_transportistas(
     disponible: Optional[bool] = None,
     tipo_camion: Optional[str] = None,
     reefer: Optional[bool] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: Optional[int] = Query(None, ge=0),
+    despues_de_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    """Listar transportistas con sus camiones"""
-    query = db.query(models.Transportista)
-    
-    transportistas = query.all()
+    """Listar transportistas con sus camiones.
+
+    Se resuelve con una única consulta (transportista + primer camión + tipo de
+    camión) y todos los filtros se aplican en SQL, así que la cantidad de
+    consultas no depende del tamaño de la flota. Para paginar se puede usar
+    limit/offset o, preferentemente, `despues_de_id` con el último id recibido.
+    La respuesta se codifica sin pasar por el response_model (serializacion.py).
+    """
+    query = consulta_transportistas_con_camion(db)
+
+    if disponible is not None:
+        query = query.filter(models.Transportista.disponible == disponible)
+    if tipo_camion:
+        query = query.filter(models.TipoCamion.nombre == tipo_camion)
+    if reefer is not None:
+        query = query.filter(models.Camion.reefer == reefer)
+    if despues_de_id is not None:
+        query = query.filter(models.Transportista.id > despues_de_id)
+
+    query = query.order_by(models.Transportista.id)
+    if offset:
+        query = query.offset(offset)
+    if limit:
+        query = query.limit(limit)
+
+    return serializacion.respuesta_json([
+        transportista_a_dict(t, camion, tipo_camion_nombre)
+        for t, camion, tipo_camion_nombre in query.all()
+    ])
+
+
+@app.get("/api/transportistas/cercanos", response_model=List[schemas.TransportistaCercano])
+def listar_transportistas_cercanos(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=100),
+    radio_km: Optional[float] = Query(None, gt=0),
+    capacidad_kg: Optional[float] = None,
+    volumen_m3: Optional[float] = None,
+    reefer: Optional[bool] = None,
+    adr: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    """Los k transportistas disponibles más cercanos a un punto (p. ej. el retiro).
+
+    La búsqueda se resuelve sobre el índice espacial en memoria; la base sólo
+    se consulta para traer los datos de los k resultados.
+    """
+    indice_transportistas.asegurar_cargado(db)
+    cercanos = indice_transportistas.cercanos(
+        lat, lon, k=k, radio_max_km=radio_km,
+        capacidad_kg=capacidad_kg, volumen_m3=volumen_m3, reefer=reefer, adr=adr
+    )
+    if not cercanos:
+        return []
+
+    distancias = dict(cercanos)
+    filas = consulta_transportistas_con_camion(db).filter(
+        models.Transportista.id.in_(distancias.keys())
+    ).all()
+
     resultado = []
-    
-    for t in transportistas:
-        camion = db.query(models.Camion).filter(
-            models.Camion.transportista_id == t.id
-        ).first()
-        
-        if not camion:
-            continue
-            
-        tipo_camion_obj = db.query(models.TipoCamion).filter(
-            models.TipoCamion.id == camion.tipo_camion_id
-        ).first()
-        
-        # Aplicar filtros
-        if disponible is not None and t.disponible != disponible:
-            continue
-        if tipo_camion and tipo_camion_obj and tipo_camion_obj.nombre != tipo_camion:
-            continue
-        if reefer is not None and camion.reefer != reefer:
-            continue
-        
-        resultado.append({
-            "id": t.id,
-            "usuario_id": t.usuario_id,
-            "nombre": f"Transportista {t.id}",
-            "cuil_cuit": t.cuil_cuit,
-            "telefono": t.telefono,
-            "disponible": t.disponible,
-            "ubicacion_actual_lat": t.ubicacion_actual_lat,
-            "ubicacion_actual_lon": t.ubicacion_actual_lon,
-            "camion": {
-                "id": camion.id,
-                "patente": camion.patente,
-                "tipo_camion": tipo_camion_obj.nombre if tipo_camion_obj else "Camión",
-                "capacidad_kg": float(camion.capacidad_kg),
-                "volumen_m3": float(camion.volumen_m3) if camion.volumen_m3 else 0,
-                "reefer": camion.reefer,
-                "adr": camion.adr,
-                "combustible": camion.combustible
-            },
-            "viajes_completados": t.viajes_completados,
-            "reputacion": float(t.reputacion),
-            "emisiones_co2_total": float(t.emisiones_co2_total)
-        })
-    
+    for t, camion, tipo_camion_nombre in filas:
+        item = transportista_a_dict(t, camion, tipo_camion_nombre)
+        item["distancia_km"] = round(distancias[t.id], 2)
+        resultado.append(item)
+    resultado.sort(key=lambda item: item["distancia_km"])
     return resultado
 
 
@@ -362,6 +502,8 @@ def actualizar_disponibilidad(
     
     transportista.disponible = disponibilidad.disponible
     db.commit()
+    indice_transportistas.actualizar_disponibilidad(transportista.id, transportista.disponible)
+    motor_asignacion.actualizar_disponibilidad(transportista.id, transportista.disponible)
     
     return {"message": "Disponibilidad actualizada", "disponible": transportista.disponible}
 
@@ -376,32 +518,61 @@ def obtener_perfil_transportista(transportista_id: int, db: Session = Depends(ge
     if not transportista:
         raise HTTPException(status_code=404, detail="Transportista no encontrado")
     
+    posicion = buffer_ubicaciones.posicion(transportista.id)
+    if posicion:
+        # Posición todavía en el buffer write-behind; no escribirla desde acá
+        db.expunge(transportista)
+        transportista.ubicacion_actual_lat, transportista.ubicacion_actual_lon = posicion
+    
     camion = db.query(models.Camion).filter(
         models.Camion.transportista_id == transportista.id
     ).first()
     
     tipo_camion = None
     if camion:
-        tipo_camion = db.query(models.TipoCamion).filter(
-            models.TipoCamion.id == camion.tipo_camion_id
-        ).first()
+        tipo_camion = catalogo.obtener(db)["tipos_camion"].por_id.get(camion.tipo_camion_id)
     
     return {
         "transportista": transportista,
         "camion": camion,
-        "tipo_camion": tipo_camion.nombre if tipo_camion else None
+        "tipo_camion": tipo_camion["nombre"] if tipo_camion else None
     }
 
+def coordenada(ubicacion: dict, campo: str) -> float:
+    """Valor numérico de `campo` en el body de ubicación, o 422"""
+    try:
+        return float(ubicacion.get(campo))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail=f"{campo} debe ser un número")
+
 @app.put("/api/transportistas/{transportista_id}/ubicacion")
 async def actualizar_ubicacion_transportista(
     transportista_id: int,
     ubicacion: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Actualizar ubicación GPS del transportista en tiempo real"""
-    transportista = db.query(models.Transportista).filter(
-        models.Transportista.id == transportista_id
-    ).first()
+    if buffer_ubicaciones.activo:
+        # Modo write-behind: sólo se guarda la última posición en memoria
+        lat = coordenada(ubicacion, "ubicacion_actual_lat")
+        lon = coordenada(ubicacion, "ubicacion_actual_lon")
+        if not buffer_ubicaciones.conocido(transportista_id):
+            existe = await db.scalar(
+                select(models.Transportista.id).where(models.Transportista.id == transportista_id)
+            )
+            if existe is None:
+                raise HTTPException(status_code=404, detail="Transportista no encontrado")
+            buffer_ubicaciones.marcar_conocido(transportista_id)
+        buffer_ubicaciones.registrar(transportista_id, lat, lon)
+        indice_transportistas.mover(transportista_id, lat, lon)
+        motor_asignacion.mover(transportista_id, lat, lon)
+        return {
+            "message": "Ubicación actualizada",
+            "ubicacion_actual_lat": lat,
+            "ubicacion_actual_lon": lon
+        }
+    
+    transportista = await db.get(models.Transportista, transportista_id)
     
     if not transportista:
         raise HTTPException(status_code=404, detail="Transportista no encontrado")
@@ -409,33 +580,66 @@ async def actualizar_ubicacion_transportista(
     transportista.ubicacion_actual_lat = ubicacion.get("ubicacion_actual_lat")
     transportista.ubicacion_actual_lon = ubicacion.get("ubicacion_actual_lon")
     
-    # Actualizar también los viajes activos del transportista
-    viajes_activos = db.query(models.Viaje).filter(
-        models.Viaje.transportista_id == transportista_id,
-        models.Viaje.estado == "en_progreso"
-    ).all()
+    # Actualizar también los viajes activos del transportista. Las rutas no se
+    # leen de la base salvo que falten en la cache (ver rutas.progreso_viaje).
+    filas_activos = (await db.execute(
+        select(models.Viaje, models.OrdenCarga.proveedor_id).options(
+            defer(models.Viaje.ruta_geom),
+            defer(models.Viaje.ruta_completa)
+        ).outerjoin(
+            models.OrdenCarga, models.OrdenCarga.id == models.Viaje.orden_id
+        ).where(
+            models.Viaje.transportista_id == transportista_id,
+            models.Viaje.estado == "en_progreso"
+        )
+    )).all()
+    viajes_activos = [fila.Viaje for fila in filas_activos]
+    
+    # Con la sesión async no hay carga perezosa: las rutas que faltan en la
+    # cache se leen juntas en una sola consulta
+    version_rutas = rutas.cache_rutas.version()
+    sin_cache = [v.id for v in viajes_activos if rutas.cache_rutas.obtener(v.id) is None]
+    rutas_cargadas = {}
+    if sin_cache:
+        filas = await db.execute(
+            select(models.Viaje.id, models.Viaje.ruta_geom, models.Viaje.ruta_completa).where(
+                models.Viaje.id.in_(sin_cache)
+            )
+        )
+        rutas_cargadas = {fila.id: (fila.ruta_geom, fila.ruta_completa) for fila in filas}
     
     for viaje in viajes_activos:
         viaje.ubicacion_actual_lat = ubicacion.get("ubicacion_actual_lat")
         viaje.ubicacion_actual_lon = ubicacion.get("ubicacion_actual_lon")
         viaje.ultima_actualizacion = datetime.now()
         
-        # Calcular distancia recorrida si hay ruta completa
-        if viaje.ruta_completa:
-            try:
-                ruta = json.loads(viaje.ruta_completa)
-                # Calcular distancia recorrida basándose en la posición actual
-                # (esto es una aproximación simple, se puede mejorar)
-                distancia_recorrida = calcular_distancia_recorrida(
-                    ruta,
-                    float(ubicacion.get("ubicacion_actual_lat")),
-                    float(ubicacion.get("ubicacion_actual_lon"))
-                )
+        # Calcular distancia recorrida proyectando la posición sobre la ruta
+        try:
+            distancia_recorrida = rutas.progreso_viaje(
+                viaje.id,
+                lambda: rutas.ruta_de_viaje(*rutas_cargadas.get(viaje.id, (None, None))),
+                float(ubicacion.get("ubicacion_actual_lat")),
+                float(ubicacion.get("ubicacion_actual_lon")),
+                version_rutas
+            )
+            if distancia_recorrida is not None:
                 viaje.distancia_recorrida_km = distancia_recorrida
-            except Exception as e:
-                print(f"[v1] Error calculando distancia recorrida para viaje {viaje.id}: {e}")
+        except Exception as e:
+            print(f"[v1] Error calculando distancia recorrida para viaje {viaje.id}: {e}")
     
-    db.commit()
+    await db.commit()
+    indice_transportistas.mover(
+        transportista.id, transportista.ubicacion_actual_lat, transportista.ubicacion_actual_lon
+    )
+    motor_asignacion.mover(
+        transportista.id, transportista.ubicacion_actual_lat, transportista.ubicacion_actual_lon
+    )
+    for viaje, proveedor_id in filas_activos:
+        tiempo_real.publicar_posicion_viaje(
+            viaje.id, viaje.transportista_id, proveedor_id,
+            viaje.ubicacion_actual_lat, viaje.ubicacion_actual_lon,
+            viaje.distancia_recorrida_km, viaje.ultima_actualizacion
+        )
     
     return {
         "message": "Ubicación actualizada",
@@ -443,180 +647,252 @@ async def actualizar_ubicacion_transportista(
         "ubicacion_actual_lon": float(transportista.ubicacion_actual_lon)
     }
 
-def calcular_distancia_recorrida(ruta, lat_actual, lon_actual):
-    """Calcula la distancia recorrida en la ruta hasta la posición actual"""
-    # No es necesario importar math aquí ya que está importado al inicio del archivo
-    
-    def distancia_haversine(lat1, lon1, lat2, lon2):
-        R = 6371  # Radio de la Tierra en km
-        dlat = math.radians(lat2 - lat1)
-        dlon = math.radians(lon2 - lon1)
-        a = (math.sin(dlat / 2) ** 2 +
-             math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-             math.sin(dlon / 2) ** 2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c
-    
-    # Encontrar el punto más cercano en la ruta
-    distancia_min = float('inf')
-    indice_cercano = 0
-    
-    for i, punto in enumerate(ruta):
-        # Asegurarse de que los puntos tengan claves 'lat' y 'lng'
-        if 'lat' in punto and 'lng' in punto:
-            dist = distancia_haversine(lat_actual, lon_actual, punto['lat'], punto['lng'])
-            if dist < distancia_min:
-                distancia_min = dist
-                indice_cercano = i
-        else:
-            print(f"[v1] Advertencia: Punto de ruta sin 'lat' o 'lng': {punto}")
-
-    # Sumar distancias hasta el punto más cercano
-    distancia_total = 0
-    for i in range(indice_cercano):
-        if i + 1 < len(ruta) and 'lat' in ruta[i] and 'lng' in ruta[i] and 'lat' in ruta[i+1] and 'lng' in ruta[i+1]:
-            distancia_total += distancia_haversine(
-                ruta[i]['lat'], ruta[i]['lng'],
-                ruta[i + 1]['lat'], ruta[i + 1]['lng']
-            )
-        else:
-             print(f"[v1] Advertencia: Puntos de ruta inválidos al calcular distancia total.")
-    
-    return distancia_total
+MAX_UBICACIONES_LOTE = int(os.getenv("MAX_UBICACIONES_LOTE", "5000"))
 
+@app.post("/api/transportistas/ubicaciones", response_model=List[schemas.ResultadoUbicacion])
+async def actualizar_ubicaciones_lote(
+    ubicaciones: List[schemas.UbicacionGPS],
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Ingesta por lotes de posiciones GPS (gateways de telemática).
 
-@app.get("/api/transportistas/{transportista_id}/estadisticas")
-def obtener_estadisticas_transportista(transportista_id: int, db: Session = Depends(get_db)):
-    """Obtener estadísticas completas del transportista"""
-    transportista = db.query(models.Transportista).filter(
-        models.Transportista.id == transportista_id
-    ).first()
+    Todo el lote se aplica en una transacción (ver ubicaciones.aplicar_ubicaciones):
+    un UPDATE sobre los transportistas y otro sobre sus viajes en progreso. Si un
+    transportista aparece varias veces en el lote sólo se aplica su lectura más
+    reciente; las demás se informan como "reemplazada".
+    """
+    if len(ubicaciones) > MAX_UBICACIONES_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote no puede superar {MAX_UBICACIONES_LOTE} ubicaciones"
+        )
     
-    if not transportista:
-        raise HTTPException(status_code=404, detail="Transportista no encontrado")
+    recibida = datetime.now().astimezone()
+    momentos = [u.ts.astimezone() if u.ts else recibida for u in ubicaciones]
+    resultados = [
+        {"indice": i, "transportista_id": u.transportista_id, "estado": "invalida", "viajes_actualizados": 0}
+        for i, u in enumerate(ubicaciones)
+    ]
     
-    # Viajes completados
-    viajes_completados = db.query(models.Viaje).filter(
-        models.Viaje.transportista_id == transportista_id,
-        models.Viaje.estado == "completado"
-    ).count()
-    
-    # Viajes en progreso
-    viajes_en_progreso = db.query(models.Viaje).filter(
-        models.Viaje.transportista_id == transportista_id,
-        models.Viaje.estado == "en_progreso"
-    ).count()
-    
-    # Ofertas aceptadas
-    ofertas_aceptadas = db.query(models.OrdenCarga).filter(
-        models.OrdenCarga.transportista_asignado_id == transportista_id,
-        models.OrdenCarga.estado == "aceptada"
-    ).count()
-    
-    # Ingresos totales
-    ingresos_totales = db.query(func.sum(models.OrdenCarga.precio)).filter(
-        models.OrdenCarga.transportista_asignado_id == transportista_id,
-        models.OrdenCarga.estado == "completada"
-    ).scalar() or 0
-    
-    # Distancia total
-    distancia_total = db.query(func.sum(models.Viaje.distancia_total_km)).filter(
-        models.Viaje.transportista_id == transportista_id,
-        models.Viaje.estado == "completado"
-    ).scalar() or 0
-    
-    # Calcular promedios
-    co2_promedio_viaje = (
-        float(transportista.emisiones_co2_total) / viajes_completados 
-        if viajes_completados > 0 else 0
-    )
+    # Última lectura válida de cada transportista: transportista_id -> índice
+    ultimas = {}
+    for i, u in enumerate(ubicaciones):
+        if not (-90 <= u.lat <= 90 and -180 <= u.lon <= 180):
+            continue
+        anterior = ultimas.get(u.transportista_id)
+        if anterior is not None and momentos[anterior] > momentos[i]:
+            resultados[i]["estado"] = "reemplazada"
+            continue
+        if anterior is not None:
+            resultados[anterior]["estado"] = "reemplazada"
+        ultimas[u.transportista_id] = i
     
-    ingreso_promedio_viaje = (
-        float(ingresos_totales) / viajes_completados 
-        if viajes_completados > 0 else 0
-    )
+    if not ultimas:
+        return resultados
     
-    # Tasa de aceptación
-    total_ofertas_recibidas = db.query(models.OrdenCarga).filter(
-        models.OrdenCarga.transportista_asignado_id == transportista_id
-    ).count()
+    lecturas = {
+        tid: (ubicaciones[i].lat, ubicaciones[i].lon, momentos[i]) for tid, i in ultimas.items()
+    }
+    encontrados, viajes_actualizados = await aplicar_ubicaciones(db, lecturas)
+    await db.commit()
+    # Que el buffer write-behind no pise estas posiciones con otras más viejas
+    buffer_ubicaciones.descartar_anteriores(lecturas)
+    publicar_viajes(viajes_actualizados)
+    
+    viajes_por_transportista = {}
+    for viaje in viajes_actualizados:
+        viajes_por_transportista[viaje[1]] = viajes_por_transportista.get(viaje[1], 0) + 1
+    
+    for transportista_id, i in ultimas.items():
+        if transportista_id in encontrados:
+            indice_transportistas.mover(transportista_id, ubicaciones[i].lat, ubicaciones[i].lon)
+            motor_asignacion.mover(transportista_id, ubicaciones[i].lat, ubicaciones[i].lon)
+            resultados[i]["estado"] = "actualizada"
+            resultados[i]["viajes_actualizados"] = viajes_por_transportista.get(transportista_id, 0)
+        else:
+            resultados[i]["estado"] = "no_encontrado"
     
-    tasa_aceptacion = (
-        (ofertas_aceptadas / total_ofertas_recibidas * 100) 
-        if total_ofertas_recibidas > 0 else 0
+    return resultados
+
+@app.get("/api/transportistas/{transportista_id}/estadisticas")
+def obtener_estadisticas_transportista(transportista_id: int, db: Session = Depends(get_db)):
+    """Obtener estadísticas completas del transportista (una consulta, cacheada unos segundos)"""
+    datos = estadisticas.cache_estadisticas_transportista.obtener(
+        transportista_id, lambda: estadisticas.calcular_transportista(db, transportista_id)
     )
     
+    if datos is None:
+        raise HTTPException(status_code=404, detail="Transportista no encontrado")
+    
+    return datos
+
+# ============== OFERTAS/ORDENES ENDPOINTS ==============
+
+def filtrar_ordenes(query, proveedor_id, transportista_id, estado):
+    if proveedor_id:
+        query = query.filter(models.OrdenCarga.proveedor_id == proveedor_id)
+    if transportista_id:
+        query = query.filter(models.OrdenCarga.transportista_asignado_id == transportista_id)
+    if estado:
+        query = query.filter(models.OrdenCarga.estado == estado)
+    return query
+
+def version_ordenes(db: Session, proveedor_id, transportista_id, estado):
+    """Versión barata de un listado de órdenes: cantidad, id máximo y suma de las fechas de modificación.
+
+    La suma cambia con cualquier modificación aunque las transacciones
+    confirmen en otro orden que el de sus timestamps (un máximo no lo vería).
+    """
+    return tuple(filtrar_ordenes(db.query(
+        func.count(models.OrdenCarga.id),
+        func.max(models.OrdenCarga.id),
+        func.sum(func.extract("epoch", models.OrdenCarga.actualizada_en))
+    ), proveedor_id, transportista_id, estado).one())
+
+def orden_a_dict(orden):
+    origen = orden.origen
+    destino = orden.destino
+    tipo_carga = orden.tipo_carga
+
     return {
-        "viajes_completados": viajes_completados,
-        "viajes_en_progreso": viajes_en_progreso,
-        "ofertas_aceptadas": ofertas_aceptadas,
-        "reputacion": float(transportista.reputacion),
-        "cantidad_calificaciones": transportista.cantidad_calificaciones,
-        "emisiones_co2_total": float(transportista.emisiones_co2_total),
-        "co2_ahorrado": float(transportista.co2_ahorrado) if transportista.co2_ahorrado else 0,
-        "co2_promedio_viaje": co2_promedio_viaje,
-        "ingresos_totales": float(ingresos_totales),
-        "ingreso_promedio_viaje": ingreso_promedio_viaje,
-        "distancia_total_km": float(distancia_total),
-        "tasa_aceptacion": round(tasa_aceptacion, 1)
+        "id": orden.id,
+        "proveedor_id": orden.proveedor_id,
+        "tipo_carga": tipo_carga.nombre if tipo_carga else "Carga general",
+        "peso_kg": float(orden.peso_kg),
+        "volumen_m3": float(orden.volumen_m3) if orden.volumen_m3 else 0,
+        "origen": origen.nombre if origen else "Origen",
+        "destino": destino.nombre if destino else "Destino",
+        "ventana_desde": orden.ventana_desde.isoformat() if orden.ventana_desde else None,
+        "ventana_hasta": orden.ventana_hasta.isoformat() if orden.ventana_hasta else None,
+        "req_reefer": orden.req_reefer,
+        "req_adr": orden.req_adr,
+        "estado": orden.estado,
+        "precio": float(orden.precio) if orden.precio else 0,
+        "distancia_km": float(orden.distancia_km) if orden.distancia_km else 0,
+        "co2_estimado": float(orden.co2_estimado) if orden.co2_estimado else 0,
+        "creada_en": orden.creada_en.isoformat()
     }
 
-# ============== OFERTAS/ORDENES ENDPOINTS ==============
+def ordenes_eliminadas(db: Session, modificadas_desde, proveedor_id, transportista_id, estado):
+    """Ids de las órdenes modificadas desde `modificadas_desde` que salieron del filtro.
+
+    El proveedor de una orden no cambia; el estado y el transportista asignado
+    sí. Las reasignadas a otro transportista se buscan en el registro de eventos.
+    """
+    eliminadas = set()
+    if estado:
+        eliminadas.update(id for (id,) in filtrar_ordenes(
+            db.query(models.OrdenCarga.id), proveedor_id, transportista_id, None
+        ).filter(
+            models.OrdenCarga.actualizada_en > modificadas_desde,
+            models.OrdenCarga.estado.is_distinct_from(estado)
+        ))
+    if transportista_id:
+        reasignadas = db.query(models.Evento.entidad_id).filter(
+            models.Evento.creado_en > modificadas_desde,
+            models.Evento.entidad == "orden",
+            models.Evento.datos["transportista_anterior_id"].as_integer() == transportista_id
+        )
+        eliminadas.update(id for (id,) in filtrar_ordenes(
+            db.query(models.OrdenCarga.id), proveedor_id, None, None
+        ).filter(
+            models.OrdenCarga.id.in_(reasignadas),
+            models.OrdenCarga.transportista_asignado_id.is_distinct_from(transportista_id)
+        ))
+    return sorted(eliminadas)
 
 @app.get("/api/ordenes", response_model=List[schemas.OrdenCargaDetalle])
 def listar_ordenes(
+    response: Response,
     proveedor_id: Optional[int] = None,
     transportista_id: Optional[int] = None,
     estado: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    since: Optional[str] = None,
+    formato: Optional[str] = FORMATO_STREAM,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """Listar órdenes de carga"""
-    query = db.query(models.OrdenCarga)
-    
-    if proveedor_id:
-        query = query.filter(models.OrdenCarga.proveedor_id == proveedor_id)
-    if estado:
-        query = query.filter(models.OrdenCarga.estado == estado)
-    
+    """Listar órdenes de carga.
+
+    Origen, destino y tipo de carga se cargan en la misma consulta (joined
+    loading). Con `limit` la respuesta se pagina por (creada_en, id) y el
+    cursor de la página siguiente se devuelve en el header X-Siguiente-Cursor.
+    Responde 304 si el ETag enviado en If-None-Match sigue vigente.
+
+    Con `since` (el header X-Sync-Cursor de una respuesta anterior) devuelve
+    sólo los cambios: {cambios, eliminados, cursor} (ver sincronizacion.py).
+    La respuesta se codifica sin pasar por el response_model (serializacion.py).
+
+    Con `formato=stream` (array JSON) o `formato=ndjson` la respuesta se envía
+    a medida que se lee la tabla, sin paginar y con memoria constante.
+    """
+    if formato and (since or limit):
+        raise HTTPException(status_code=400, detail="formato no se puede combinar con since ni limit")
+    if since:
+        if cursor or limit:
+            raise HTTPException(status_code=400, detail="since no se puede combinar con cursor ni limit")
+        modificadas_desde = sincronizacion.desde(since)
+    else:
+        etag = cache_http.etag_version(
+            "ordenes", proveedor_id, transportista_id, estado, cursor, limit, formato,
+            *version_ordenes(db, proveedor_id, transportista_id, estado)
+        )
+        no_modificado = cache_http.no_modificado(response, if_none_match, etag)
+        if no_modificado is not None:
+            return no_modificado
+    # now() es el mismo en toda la transacción: vale aunque se lea después de la versión
+    cursor_sync = sincronizacion.cursor_actual(db)
+    response.headers["X-Sync-Cursor"] = cursor_sync
+
+    query = filtrar_ordenes(db.query(models.OrdenCarga).options(
+        joinedload(models.OrdenCarga.origen),
+        joinedload(models.OrdenCarga.destino),
+        joinedload(models.OrdenCarga.tipo_carga)
+    ), proveedor_id, transportista_id, estado)
+    if since:
+        query = query.filter(models.OrdenCarga.actualizada_en > modificadas_desde)
+    if cursor:
+        creada_en_cursor, id_cursor = decodificar_cursor(cursor)
+        query = query.filter(or_(
+            models.OrdenCarga.creada_en > creada_en_cursor,
+            and_(models.OrdenCarga.creada_en == creada_en_cursor, models.OrdenCarga.id > id_cursor)
+        ))
+
+    query = query.order_by(models.OrdenCarga.creada_en, models.OrdenCarga.id)
+    if limit:
+        query = query.limit(limit)
+
+    if formato:
+        return serializacion.respuesta_stream(filas_en_stream(query, orden_a_dict), formato, response)
+
     ordenes = query.all()
-    resultado = []
-    
-    for orden in ordenes:
-        origen = db.query(models.Origen).filter(models.Origen.id == orden.origen_id).first()
-        destino = db.query(models.Origen).filter(models.Origen.id == orden.destino_id).first()
-        tipo_carga = db.query(models.TipoCarga).filter(models.TipoCarga.id == orden.tipo_carga_id).first()
-        
-        resultado.append({
-            "id": orden.id,
-            "proveedor_id": orden.proveedor_id,
-            "tipo_carga": tipo_carga.nombre if tipo_carga else "Carga general",
-            "peso_kg": float(orden.peso_kg),
-            "volumen_m3": float(orden.volumen_m3) if orden.volumen_m3 else 0,
-            "origen": origen.nombre if origen else "Origen",
-            "destino": destino.nombre if destino else "Destino",
-            "ventana_desde": orden.ventana_desde.isoformat() if orden.ventana_desde else None,
-            "ventana_hasta": orden.ventana_hasta.isoformat() if orden.ventana_hasta else None,
-            "req_reefer": orden.req_reefer,
-            "req_adr": orden.req_adr,
-            "estado": orden.estado,
-            "precio": float(orden.precio) if orden.precio else 0,
-            "distancia_km": float(orden.distancia_km) if orden.distancia_km else 0,
-            "co2_estimado": float(orden.co2_estimado) if orden.co2_estimado else 0,
-            "creada_en": orden.creada_en.isoformat()
-        })
-    
-    return resultado
+
+    if limit and len(ordenes) == limit:
+        ultima = ordenes[-1]
+        response.headers["X-Siguiente-Cursor"] = codificar_cursor(ultima.creada_en, ultima.id)
+
+    resultado = [orden_a_dict(orden) for orden in ordenes]
+
+    if since:
+        return sincronizacion.respuesta(
+            resultado, ordenes_eliminadas(db, modificadas_desde, proveedor_id, transportista_id, estado), cursor_sync
+        )
+    return serializacion.respuesta_json(resultado, response)
 
 
 @app.post("/api/ordenes", response_model=schemas.OrdenCargaDetalle)
-async def crear_orden(orden: schemas.OrdenCargaCreate, db: Session = Depends(get_db)):
+async def crear_orden(orden: schemas.OrdenCargaCreate, db: AsyncSession = Depends(get_async_db)):
     """Crear nueva orden de carga"""
     
     # Buscar o crear origen con coordenadas exactas
-    origen = db.query(models.Origen).filter(
-        models.Origen.lat == orden.origen_lat,
-        models.Origen.lon == orden.origen_lon
-    ).first()
+    origen = (await db.execute(
+        select(models.Origen).where(
+            models.Origen.lat == orden.origen_lat,
+            models.Origen.lon == orden.origen_lon
+        ).limit(1)
+    )).scalars().first()
     
     if not origen:
         origen = models.Origen(
@@ -626,13 +902,15 @@ async def crear_orden(orden: schemas.OrdenCargaCreate, db: Session = Depends(get
             lon=orden.origen_lon
         )
         db.add(origen)
-        db.flush()
+        await db.flush()
     
     # Buscar o crear destino con coordenadas exactas
-    destino = db.query(models.Origen).filter(
-        models.Origen.lat == orden.destino_lat,
-        models.Origen.lon == orden.destino_lon
-    ).first()
+    destino = (await db.execute(
+        select(models.Origen).where(
+            models.Origen.lat == orden.destino_lat,
+            models.Origen.lon == orden.destino_lon
+        ).limit(1)
+    )).scalars().first()
     
     if not destino:
         destino = models.Origen(
@@ -642,23 +920,29 @@ async def crear_orden(orden: schemas.OrdenCargaCreate, db: Session = Depends(get
             lon=orden.destino_lon
         )
         db.add(destino)
-        db.flush()
+        await db.flush()
     
-    # Buscar o crear tipo de carga
-    tipo_carga = db.query(models.TipoCarga).filter(
-        models.TipoCarga.nombre == orden.tipo_carga
-    ).first()
+    # Buscar o crear tipo de carga (los existentes salen de la cache de catálogos)
+    tipo_carga = (await catalogo.obtener_async(db))["tipos_carga"].por_nombre.get(orden.tipo_carga)
+    tipo_carga_nuevo = False
     if not tipo_carga:
-        tipo_carga = models.TipoCarga(
-            nombre=orden.tipo_carga,
-            requiere_reefer=orden.req_reefer
-        )
-        db.add(tipo_carga)
-        db.flush()
+        # Confirmar contra la base: otro proceso pudo haberlo creado después de la última carga
+        tipo_carga_obj = (await db.execute(
+            select(models.TipoCarga).where(models.TipoCarga.nombre == orden.tipo_carga).limit(1)
+        )).scalars().first()
+        if not tipo_carga_obj:
+            tipo_carga_obj = models.TipoCarga(
+                nombre=orden.tipo_carga,
+                requiere_reefer=orden.req_reefer
+            )
+            db.add(tipo_carga_obj)
+            await db.flush()
+        tipo_carga_nuevo = True
+        tipo_carga = {"id": tipo_carga_obj.id, "nombre": tipo_carga_obj.nombre}
     
     nueva_orden = models.OrdenCarga(
         proveedor_id=orden.proveedor_id,
-        tipo_carga_id=tipo_carga.id,
+        tipo_carga_id=tipo_carga["id"],
         peso_kg=orden.peso_kg,
         volumen_m3=orden.volumen_m3,
         origen_id=origen.id,
@@ -675,13 +959,27 @@ async def crear_orden(orden: schemas.OrdenCargaCreate, db: Session = Depends(get
     )
     
     db.add(nueva_orden)
-    db.commit()
-    db.refresh(nueva_orden)
+    await estadisticas.sumar_async(
+        db, total_ordenes=1,
+        **estadisticas.delta_estado_orden(None, nueva_orden.estado, nueva_orden.precio)
+    )
+    await db.flush()
+    # Como en el feed anterior, la orden se atribuye a su proveedor
+    eventos.registrar(
+        db, "orden", f"Nueva orden de carga #{nueva_orden.id}",
+        usuario_id=nueva_orden.proveedor_id,
+        entidad="orden", entidad_id=nueva_orden.id, proveedor_id=nueva_orden.proveedor_id
+    )
+    await db.commit()
+    await db.refresh(nueva_orden)
+    estadisticas.cache_estadisticas_transportista.invalidar(nueva_orden.transportista_asignado_id)
+    if tipo_carga_nuevo:
+        catalogo.invalidar()
     
     return {
         "id": nueva_orden.id,
         "proveedor_id": nueva_orden.proveedor_id,
-        "tipo_carga": tipo_carga.nombre,
+        "tipo_carga": tipo_carga["nombre"],
         "peso_kg": float(nueva_orden.peso_kg),
         "volumen_m3": float(nueva_orden.volumen_m3) if nueva_orden.volumen_m3 else 0,
         "origen": origen.nombre,
@@ -698,26 +996,74 @@ async def crear_orden(orden: schemas.OrdenCargaCreate, db: Session = Depends(get
     }
 
 
+@app.get("/api/ordenes/{orden_id}/candidatos", response_model=List[schemas.CandidatoAsignacion])
+def listar_candidatos_orden(
+    orden_id: int,
+    k: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Los k transportistas que mejor se ajustan a una orden, del mejor al peor.
+
+    El ranking se calcula en memoria sobre todos los pares transportista/camión
+    (ver asignacion.py); la base sólo se consulta para la orden y para traer
+    los datos de los k resultados, cada uno con su camión elegido.
+    """
+    orden = db.query(models.OrdenCarga).options(
+        joinedload(models.OrdenCarga.origen)
+    ).filter(models.OrdenCarga.id == orden_id).first()
+    if not orden:
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
+    if orden.origen is None or orden.origen.lat is None or orden.origen.lon is None:
+        raise HTTPException(status_code=422, detail="La orden no tiene coordenadas de origen")
+
+    candidatos = motor_asignacion.candidatos(db, orden, k=k)
+    if not candidatos:
+        return []
+
+    filas = db.query(models.Transportista, models.Camion, models.TipoCamion.nombre).join(
+        models.Camion, models.Camion.transportista_id == models.Transportista.id
+    ).outerjoin(
+        models.TipoCamion, models.TipoCamion.id == models.Camion.tipo_camion_id
+    ).filter(models.Camion.id.in_([c["camion_id"] for c in candidatos])).all()
+    por_camion = {camion.id: (t, camion, tipo_camion_nombre) for t, camion, tipo_camion_nombre in filas}
+
+    resultado = []
+    for candidato in candidatos:
+        fila = por_camion.get(candidato["camion_id"])
+        if fila is None:
+            continue  # Camión borrado después de cargar la instantánea
+        item = transportista_a_dict(*fila)
+        item["distancia_vacio_km"] = candidato["distancia_vacio_km"]
+        item["co2_estimado_kg"] = candidato["co2_estimado_kg"]
+        item["puntaje"] = candidato["puntaje"]
+        resultado.append(item)
+    return resultado
+
+
 @app.put("/api/ordenes/{orden_id}/estado")
 async def actualizar_estado_orden(
     orden_id: int,
     estado: schemas.EstadoOrdenUpdate,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Actualizar estado de una orden (aceptar/rechazar)"""
-    orden = db.query(models.OrdenCarga).filter(models.OrdenCarga.id == orden_id).first()
+    orden = await db.get(models.OrdenCarga, orden_id)
     
     if not orden:
         raise HTTPException(status_code=404, detail="Orden no encontrada")
     
+    transportista_anterior_id = orden.transportista_asignado_id
     if estado.estado == "aceptada" and hasattr(estado, 'transportista_id'):
         transportista_id = estado.transportista_id
         
         # Contar ofertas aceptadas actuales del transportista
-        ofertas_aceptadas = db.query(models.OrdenCarga).filter(
-            models.OrdenCarga.transportista_asignado_id == transportista_id,
-            models.OrdenCarga.estado == "aceptada"
-        ).count()
+        ofertas_aceptadas = await db.scalar(
+            select(func.count(models.OrdenCarga.id)).where(
+                models.OrdenCarga.transportista_asignado_id == transportista_id,
+                models.OrdenCarga.estado == "aceptada"
+            )
+        )
         
         if ofertas_aceptadas >= 2:
             raise HTTPException(
@@ -730,6 +1076,19 @@ async def actualizar_estado_orden(
     
     estado_anterior = orden.estado
     orden.estado = estado.estado
+    await estadisticas.sumar_async(db, **estadisticas.delta_estado_orden(estado_anterior, orden.estado, orden.precio))
+    if estado_anterior != orden.estado or transportista_anterior_id != orden.transportista_asignado_id:
+        # transportista_anterior_id: la sincronización incremental lo usa para
+        # avisar al transportista que perdió la orden
+        eventos.registrar(
+            db, "orden_estado", f"Orden #{orden.id}: {estado_anterior} → {orden.estado}",
+            entidad="orden", entidad_id=orden.id,
+            estado_anterior=estado_anterior, estado=orden.estado,
+            transportista_id=orden.transportista_asignado_id,
+            transportista_anterior_id=transportista_anterior_id
+        )
+    nuevo_viaje = None
+    nueva_notificacion = None
     
     # Si la orden fue aceptada, crear notificación al proveedor y crear viaje
     if estado.estado == "aceptada" and estado_anterior != "aceptada":
@@ -738,15 +1097,16 @@ async def actualizar_estado_orden(
         
         if transportista_id:
             # Obtener el usuario del proveedor
-            proveedor = db.query(models.Proveedor).filter(
-                models.Proveedor.id == orden.proveedor_id
-            ).first()
+            proveedor = await db.get(models.Proveedor, orden.proveedor_id)
             
             if proveedor:
                 # Obtener datos del transportista para la notificación
-                transportista = db.query(models.Transportista).filter(
-                    models.Transportista.id == transportista_id
-                ).first()
+                transportista = await db.get(models.Transportista, transportista_id)
+                posicion = None
+                if transportista:
+                    posicion = buffer_ubicaciones.posicion(transportista.id) or (
+                        transportista.ubicacion_actual_lat, transportista.ubicacion_actual_lon
+                    )
                 
                 # Crear notificación para el proveedor
                 nueva_notificacion = models.Notificacion(
@@ -757,32 +1117,35 @@ async def actualizar_estado_orden(
                 )
                 db.add(nueva_notificacion)
                 
-                origen = db.query(models.Origen).filter(models.Origen.id == orden.origen_id).first()
-                destino = db.query(models.Origen).filter(models.Origen.id == orden.destino_id).first()
+                origen = await db.get(models.Origen, orden.origen_id)
+                destino = await db.get(models.Origen, orden.destino_id)
                 
-                ruta_data = None
+                puntos = None
                 if origen and destino and origen.lon is not None and origen.lat is not None and destino.lon is not None and destino.lat is not None:
-                    ruta_data = await obtener_ruta_osrm(
-                        float(origen.lon), float(origen.lat),
-                        float(destino.lon), float(destino.lat)
-                    )
+                    puntos = (float(origen.lon), float(origen.lat), float(destino.lon), float(destino.lat))
+                
+                # El viaje se crea ya con una línea recta; la ruta real se
+                # calcula en segundo plano (ver completar_ruta_viaje)
+                distancia_km = float(orden.distancia_km) if orden.distancia_km else None
+                if distancia_km is None and puntos:
+                    distancia_km = round(rutas.distancia_haversine(puntos[1], puntos[0], puntos[3], puntos[2]), 2)
                 
-                # Crear viaje automáticamente con ruta completa
                 nuevo_viaje = models.Viaje(
                     transportista_id=transportista_id,
                     orden_id=orden.id,
                     origen_id=orden.origen_id,
                     destino_id=orden.destino_id,
-                    ubicacion_actual_lat=transportista.ubicacion_actual_lat if transportista else (origen.lat if origen else None),
-                    ubicacion_actual_lon=transportista.ubicacion_actual_lon if transportista else (origen.lon if origen else None),
-                    distancia_total_km=ruta_data["distance"] if ruta_data else orden.distancia_km,
+                    ubicacion_actual_lat=posicion[0] if posicion else (origen.lat if origen else None),
+                    ubicacion_actual_lon=posicion[1] if posicion else (origen.lon if origen else None),
+                    distancia_total_km=distancia_km,
                     distancia_recorrida_km=0,
-                    tiempo_estimado_minutos=ruta_data["duration"] if ruta_data else (int(float(orden.distancia_km) * 1.5) if orden.distancia_km else 60),
+                    tiempo_estimado_minutos=int(distancia_km * 1.5) if distancia_km else 60,
                     tiempo_transcurrido_minutos=0,
                     estado="en_progreso",
                     fecha_inicio=datetime.now(),
                     detenido_minutos=0,
-                    ruta_completa=json.dumps(ruta_data["coordinates"]) if ruta_data else None
+                    ruta_geom=rutas.codificar_ruta([(puntos[1], puntos[0]), (puntos[3], puntos[2])]) if puntos else None,
+                    ruta_estado="pendiente" if puntos else "linea_recta"
                 )
                 db.add(nuevo_viaje)
                 
@@ -790,83 +1153,310 @@ async def actualizar_estado_orden(
                 if transportista:
                     transportista.disponible = False
     
-    db.commit()
+    await db.commit()
+    estadisticas.cache_estadisticas_transportista.invalidar(transportista_anterior_id, orden.transportista_asignado_id)
+    if estado.estado == "aceptada" and orden.transportista_asignado_id:
+        indice_transportistas.actualizar_disponibilidad(orden.transportista_asignado_id, False)
+    if "aceptada" in (estado_anterior, orden.estado):
+        # Cambian las ofertas aceptadas (y la disponibilidad) de algún
+        # transportista: el motor de asignación recarga la instantánea
+        motor_asignacion.invalidar()
+    if nueva_notificacion is not None:
+        # ts_envio lo asigna la base
+        await db.refresh(nueva_notificacion)
+        tiempo_real.publicar_notificacion(nueva_notificacion)
+    if nuevo_viaje is not None:
+        tiempo_real.publicar_viaje(
+            nuevo_viaje.id, nuevo_viaje.transportista_id, orden.proveedor_id,
+            estado=nuevo_viaje.estado, ruta_estado=nuevo_viaje.ruta_estado
+        )
+        if nuevo_viaje.ruta_estado == "pendiente":
+            background_tasks.add_task(completar_ruta_viaje, nuevo_viaje.id, *puntos)
     
     return {"message": "Estado actualizado", "estado": orden.estado}
 
+# ============== RUTAS DE VIAJES (SEGUNDO PLANO) ==============
+
+RUTA_INTENTOS = int(os.getenv("RUTA_INTENTOS", "4"))
+RUTA_ESPERA_SEGUNDOS = float(os.getenv("RUTA_ESPERA_SEGUNDOS", "2"))
+
+def guardar_ruta_viaje(viaje_id: int, ruta: Optional[dict]):
+    """Guardar la ruta calculada de un viaje, o marcarla como línea recta si no se pudo"""
+    db = SessionLocal()
+    try:
+        viaje = db.query(models.Viaje).filter(
+            models.Viaje.id == viaje_id,
+            models.Viaje.ruta_estado == "pendiente"
+        ).first()
+        if not viaje:
+            return
+        proveedor_id = db.query(models.OrdenCarga.proveedor_id).filter(
+            models.OrdenCarga.id == viaje.orden_id
+        ).scalar() if viaje.orden_id else None
+        if ruta:
+            viaje.ruta_geom = ruta["ruta_geom"]
+            viaje.distancia_total_km = ruta["distance"]
+            viaje.tiempo_estimado_minutos = ruta["duration"]
+            viaje.ruta_estado = "calculada"
+        else:
+            # Se conserva la línea recta con la que se creó el viaje
+            viaje.ruta_estado = "linea_recta"
+        db.commit()
+        evento = {
+            "ruta_estado": viaje.ruta_estado,
+            "distancia_total_km": float(viaje.distancia_total_km or 0),
+            "tiempo_estimado_minutos": viaje.tiempo_estimado_minutos or 0
+        }
+        transportista_id = viaje.transportista_id
+    finally:
+        db.close()
+    # El progreso se venía calculando sobre la línea recta
+    rutas.cache_rutas.invalidar(viaje_id)
+    tiempo_real.publicar_viaje(viaje_id, transportista_id, proveedor_id, **evento)
+
+async def completar_ruta_viaje(viaje_id: int, origen_lon: float, origen_lat: float, destino_lon: float, destino_lat: float):
+    """Calcular la ruta de un viaje recién creado, con reintentos y espera creciente"""
+    ruta = None
+    for intento in range(RUTA_INTENTOS):
+        ruta = await cache_rutas_osrm.obtener(origen_lon, origen_lat, destino_lon, destino_lat)
+        if ruta is not None:
+            break
+        if intento < RUTA_INTENTOS - 1:
+            await asyncio.sleep(RUTA_ESPERA_SEGUNDOS * 2 ** intento)
+    if ruta is None:
+        print(f"[v0] No se pudo obtener la ruta del viaje {viaje_id} tras {RUTA_INTENTOS} intentos")
+    await asyncio.to_thread(guardar_ruta_viaje, viaje_id, ruta)
+
+def viajes_con_ruta_pendiente():
+    db = SessionLocal()
+    try:
+        origen = aliased(models.Origen)
+        destino = aliased(models.Origen)
+        return db.query(
+            models.Viaje.id, origen.lon, origen.lat, destino.lon, destino.lat
+        ).join(
+            origen, origen.id == models.Viaje.origen_id
+        ).join(
+            destino, destino.id == models.Viaje.destino_id
+        ).filter(models.Viaje.ruta_estado == "pendiente").all()
+    finally:
+        db.close()
+
+async def completar_rutas_pendientes():
+    try:
+        pendientes = await asyncio.to_thread(viajes_con_ruta_pendiente)
+    except Exception as e:
+        print(f"[v0] Error buscando viajes con ruta pendiente: {e}")
+        return
+    for viaje_id, origen_lon, origen_lat, destino_lon, destino_lat in pendientes:
+        await completar_ruta_viaje(
+            viaje_id, float(origen_lon), float(origen_lat), float(destino_lon), float(destino_lat)
+        )
+
 # ============== VIAJES ENDPOINTS ==============
 
+def filtrar_viajes(query, proveedor_id, transportista_id, estado):
+    """Filtros de listar_viajes; con proveedor_id la consulta debe incluir OrdenCarga"""
+    if proveedor_id:
+        query = query.filter(models.OrdenCarga.proveedor_id == proveedor_id)
+    if transportista_id:
+        query = query.filter(models.Viaje.transportista_id == transportista_id)
+    if estado:
+        query = query.filter(models.Viaje.estado == estado)
+    return query
+
+def version_viajes(db: Session, proveedor_id, transportista_id, estado):
+    """Versión barata de un listado de viajes (ver version_ordenes)"""
+    query = db.query(
+        func.count(models.Viaje.id),
+        func.max(models.Viaje.id),
+        func.sum(func.extract("epoch", models.Viaje.ultima_actualizacion))
+    )
+    if proveedor_id:
+        query = query.join(models.OrdenCarga, models.OrdenCarga.id == models.Viaje.orden_id)
+    return tuple(filtrar_viajes(query, proveedor_id, transportista_id, estado).one())
+
+def viajes_eliminados(db: Session, modificados_desde, proveedor_id, transportista_id, estado):
+    """Ids de los viajes modificados desde `modificados_desde` que ya no tienen el estado pedido.
+
+    El transportista y la orden (el proveedor) de un viaje no cambian.
+    """
+    if not estado:
+        return []
+    query = db.query(models.Viaje.id)
+    if proveedor_id:
+        query = query.join(models.OrdenCarga, models.OrdenCarga.id == models.Viaje.orden_id)
+    return [id for (id,) in filtrar_viajes(query, proveedor_id, transportista_id, None).filter(
+        models.Viaje.actualizado_en > modificados_desde,
+        models.Viaje.estado.is_distinct_from(estado)
+    ).order_by(models.Viaje.id)]
+
+def viaje_a_dict(viaje, incluir_ruta):
+    """Fila de la consulta de listar_viajes (columnas proyectadas) como ViajeDetalle"""
+    ruta_completa = None
+    if incluir_ruta:
+        coordenadas = rutas.ruta_de_viaje(viaje.ruta_geom, viaje.ruta_completa)
+        if coordenadas is not None:
+            ruta_completa = rutas.ruta_a_json(coordenadas)
+
+    origen_lat = float(viaje.origen_lat) if viaje.origen_lat else 40.4168
+    origen_lon = float(viaje.origen_lon) if viaje.origen_lon else -3.7038
+    
+    ubicacion_lat, ubicacion_lon = viaje.ubicacion_actual_lat, viaje.ubicacion_actual_lon
+    if viaje.estado == "en_progreso":
+        ubicacion_lat, ubicacion_lon = buffer_ubicaciones.posicion(viaje.transportista_id) or (ubicacion_lat, ubicacion_lon)
+
+    return {
+        "id": viaje.id,
+        "transportista_id": viaje.transportista_id,
+        "orden_id": viaje.orden_id,
+        "proveedor_id": viaje.proveedor_id,
+        "origen": viaje.origen_nombre or "Origen",
+        "destino": viaje.destino_nombre or "Destino",
+        "origen_lat": origen_lat,
+        "origen_lon": origen_lon,
+        "destino_lat": float(viaje.destino_lat) if viaje.destino_lat else 41.3851,
+        "destino_lon": float(viaje.destino_lon) if viaje.destino_lon else 2.1734,
+        "ubicacion_actual_lat": float(ubicacion_lat) if ubicacion_lat else origen_lat,
+        "ubicacion_actual_lon": float(ubicacion_lon) if ubicacion_lon else origen_lon,
+        "distancia_total_km": float(viaje.distancia_total_km) if viaje.distancia_total_km else 0,
+        "distancia_recorrida_km": float(viaje.distancia_recorrida_km) if viaje.distancia_recorrida_km else 0,
+        "tiempo_estimado_minutos": viaje.tiempo_estimado_minutos if viaje.tiempo_estimado_minutos else 0,
+        "tiempo_transcurrido_minutos": viaje.tiempo_transcurrido_minutos if viaje.tiempo_transcurrido_minutos else 0,
+        "estado": viaje.estado,
+        "fecha_inicio": viaje.fecha_inicio.isoformat() if viaje.fecha_inicio else None,
+        "fecha_fin": viaje.fecha_fin.isoformat() if viaje.fecha_fin else None,
+        "ultima_actualizacion": viaje.ultima_actualizacion.isoformat() if viaje.ultima_actualizacion else None,
+        "detenido_minutos": viaje.detenido_minutos if viaje.detenido_minutos else 0,
+        "ruta_completa": ruta_completa,
+        "ruta_estado": viaje.ruta_estado or "calculada"
+    }
+
 @app.get("/api/viajes", response_model=List[schemas.ViajeDetalle])
 def listar_viajes(
+    response: Response,
     proveedor_id: Optional[int] = None,
     transportista_id: Optional[int] = None,
     estado: Optional[str] = None,
+    include: Optional[str] = None,
+    since: Optional[str] = None,
+    formato: Optional[str] = FORMATO_STREAM,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """Listar viajes activos"""
-    query = db.query(models.Viaje)
-    
-    if transportista_id:
-        query = query.filter(models.Viaje.transportista_id == transportista_id)
-    if estado:
-        query = query.filter(models.Viaje.estado == estado)
-    
-    viajes = query.all()
-    resultado = []
-    
-    for viaje in viajes:
-        orden = db.query(models.OrdenCarga).filter(
-            models.OrdenCarga.id == viaje.orden_id
-        ).first()
-        
-        if proveedor_id and orden and orden.proveedor_id != proveedor_id:
-            continue
-        
-        transportista = db.query(models.Transportista).filter(
-            models.Transportista.id == viaje.transportista_id
-        ).first()
-        
-        origen = db.query(models.Origen).filter(
-            models.Origen.id == viaje.origen_id
-        ).first()
-        
-        destino = db.query(models.Origen).filter(
-            models.Origen.id == viaje.destino_id
-        ).first()
-        
-        ruta_completa = None
-        if viaje.ruta_completa:
-            try:
-                ruta_completa = json.loads(viaje.ruta_completa)
-            except:
-                pass
-        
-        resultado.append({
-            "id": viaje.id,
-            "transportista_id": viaje.transportista_id,
-            "orden_id": viaje.orden_id,
-            "proveedor_id": orden.proveedor_id if orden else None,
-            "origen": origen.nombre if origen else "Origen",
-            "destino": destino.nombre if destino else "Destino",
-            "origen_lat": float(origen.lat) if origen and origen.lat else 40.4168,
-            "origen_lon": float(origen.lon) if origen and origen.lon else -3.7038,
-            "destino_lat": float(destino.lat) if destino and destino.lat else 41.3851,
-            "destino_lon": float(destino.lon) if destino and destino.lon else 2.1734,
-            "ubicacion_actual_lat": float(viaje.ubicacion_actual_lat) if viaje.ubicacion_actual_lat else (float(origen.lat) if origen and origen.lat else 40.4168),
-            "ubicacion_actual_lon": float(viaje.ubicacion_actual_lon) if viaje.ubicacion_actual_lon else (float(origen.lon) if origen and origen.lon else -3.7038),
-            "distancia_total_km": float(viaje.distancia_total_km) if viaje.distancia_total_km else 0,
-            "distancia_recorrida_km": float(viaje.distancia_recorrida_km) if viaje.distancia_recorrida_km else 0,
-            "tiempo_estimado_minutos": viaje.tiempo_estimado_minutos if viaje.tiempo_estimado_minutos else 0,
-            "tiempo_transcurrido_minutos": viaje.tiempo_transcurrido_minutos if viaje.tiempo_transcurrido_minutos else 0,
-            "estado": viaje.estado,
-            "fecha_inicio": viaje.fecha_inicio.isoformat() if viaje.fecha_inicio else None,
-            "fecha_fin": viaje.fecha_fin.isoformat() if viaje.fecha_fin else None,
-            "ultima_actualizacion": viaje.ultima_actualizacion.isoformat() if viaje.ultima_actualizacion else None,
-            "detenido_minutos": viaje.detenido_minutos if viaje.detenido_minutos else 0,
-            "ruta_completa": ruta_completa
-        })
-    
-    return resultado
+    """Listar viajes activos.
+
+    Una sola consulta que proyecta únicamente las columnas necesarias del
+    viaje, su orden y los dos puntos (origen/destino). La geometría de la ruta
+    sólo se lee y decodifica con `include=ruta`; los clientes que hacen polling
+    de posiciones y progreso no la necesitan.
+
+    Responde 304 si el ETag enviado en If-None-Match sigue vigente; la versión
+    incluye las posiciones pendientes del modo write-behind.
+
+    Con `since` (el header X-Sync-Cursor de una respuesta anterior) devuelve
+    sólo los cambios: {cambios, eliminados, cursor} (ver sincronizacion.py).
+    Las posiciones del modo write-behind llegan cuando se escriben en la base.
+    La respuesta se codifica sin pasar por el response_model (serializacion.py).
+
+    Con `formato=stream` (array JSON) o `formato=ndjson` la respuesta se envía
+    a medida que se lee la tabla, con memoria constante.
+    """
+    incluir_ruta = "ruta" in (include or "").split(",")
+
+    if formato and since:
+        raise HTTPException(status_code=400, detail="formato no se puede combinar con since")
+    if since:
+        modificados_desde = sincronizacion.desde(since)
+    else:
+        etag = cache_http.etag_version(
+            "viajes", proveedor_id, transportista_id, estado, incluir_ruta, formato,
+            *version_viajes(db, proveedor_id, transportista_id, estado),
+            buffer_ubicaciones.version
+        )
+        no_modificado = cache_http.no_modificado(response, if_none_match, etag)
+        if no_modificado is not None:
+            return no_modificado
+    # now() es el mismo en toda la transacción: vale aunque se lea después de la versión
+    cursor_sync = sincronizacion.cursor_actual(db)
+    response.headers["X-Sync-Cursor"] = cursor_sync
+
+    origen = aliased(models.Origen)
+    destino = aliased(models.Origen)
+
+    columnas = [
+        models.Viaje.id,
+        models.Viaje.transportista_id,
+        models.Viaje.orden_id,
+        models.OrdenCarga.proveedor_id,
+        origen.nombre.label("origen_nombre"),
+        origen.lat.label("origen_lat"),
+        origen.lon.label("origen_lon"),
+        destino.nombre.label("destino_nombre"),
+        destino.lat.label("destino_lat"),
+        destino.lon.label("destino_lon"),
+        models.Viaje.ubicacion_actual_lat,
+        models.Viaje.ubicacion_actual_lon,
+        models.Viaje.distancia_total_km,
+        models.Viaje.distancia_recorrida_km,
+        models.Viaje.tiempo_estimado_minutos,
+        models.Viaje.tiempo_transcurrido_minutos,
+        models.Viaje.estado,
+        models.Viaje.fecha_inicio,
+        models.Viaje.fecha_fin,
+        models.Viaje.ultima_actualizacion,
+        models.Viaje.detenido_minutos,
+        models.Viaje.ruta_estado,
+    ]
+    if incluir_ruta:
+        columnas += [models.Viaje.ruta_geom, models.Viaje.ruta_completa]
+
+    query = db.query(*columnas).outerjoin(
+        models.OrdenCarga, models.OrdenCarga.id == models.Viaje.orden_id
+    ).outerjoin(
+        origen, origen.id == models.Viaje.origen_id
+    ).outerjoin(
+        destino, destino.id == models.Viaje.destino_id
+    )
+
+    query = filtrar_viajes(query, proveedor_id, transportista_id, estado)
+    if since:
+        query = query.filter(models.Viaje.actualizado_en > modificados_desde)
+
+    if formato:
+        return serializacion.respuesta_stream(
+            filas_en_stream(query, lambda viaje: viaje_a_dict(viaje, incluir_ruta)), formato, response
+        )
+
+    resultado = [viaje_a_dict(viaje, incluir_ruta) for viaje in query.all()]
+
+    if since:
+        return sincronizacion.respuesta(
+            resultado, viajes_eliminados(db, modificados_desde, proveedor_id, transportista_id, estado), cursor_sync
+        )
+    return serializacion.respuesta_json(resultado, response)
+
+@app.get("/api/viajes/stream")
+async def stream_viajes(
+    request: Request,
+    proveedor_id: Optional[int] = None,
+    transportista_id: Optional[int] = None
+):
+    """Cambios de los viajes de un proveedor o de un transportista (Server-Sent Events).
+
+    Cada evento `viaje` trae `viaje_id` y sólo los campos que cambiaron
+    (posición, progreso, estado o ruta). La lista inicial se obtiene una vez con
+    GET /api/viajes; ante un evento `resync`, o de un viaje desconocido, el
+    cliente debe volver a pedirla.
+    """
+    if (proveedor_id is None) == (transportista_id is None):
+        raise HTTPException(status_code=400, detail="Indicar proveedor_id o transportista_id")
+    tema = ("proveedor", proveedor_id) if proveedor_id is not None else ("transportista", transportista_id)
+    return StreamingResponse(
+        tiempo_real.flujo_sse(request, tiempo_real.canal_viajes, tema, "viaje"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.put("/api/viajes/{viaje_id}/estado")
 def actualizar_estado_viaje(
@@ -889,6 +1479,18 @@ def actualizar_estado_viaje(
     
     estado_anterior = viaje.estado
     viaje.estado = estado.estado
+    nueva_notificacion = None
+    if estado_anterior != viaje.estado:
+        eventos.registrar(
+            db, "viaje_estado", f"Viaje #{viaje.id}: {estado_anterior} → {viaje.estado}",
+            entidad="viaje", entidad_id=viaje.id,
+            estado_anterior=estado_anterior, estado=viaje.estado,
+            transportista_id=viaje.transportista_id
+        )
+    
+    # Sólo los viajes en progreso reciben posiciones: liberar su ruta de la cache
+    if estado.estado != "en_progreso":
+        rutas.cache_rutas.invalidar(viaje.id)
     
     # Si se marca como entregado o finalizado, registrar fecha de fin
     if estado.estado in ["entregado", "finalizado", "completado"]:
@@ -907,6 +1509,7 @@ def actualizar_estado_viaje(
                 models.OrdenCarga.id == viaje.orden_id
             ).first()
             if orden:
+                estadisticas.sumar(db, **estadisticas.delta_estado_orden(orden.estado, "completada", orden.precio))
                 orden.estado = "completada"
                 orden.completada_en = datetime.now()
         
@@ -917,6 +1520,7 @@ def actualizar_estado_viaje(
         if transportista:
             transportista.viajes_completados += 1
             transportista.disponible = True  # El transportista vuelve a estar disponible
+            estadisticas.sumar(db, viajes_completados=1)
             
         # Crear notificación al proveedor
         if viaje.orden_id:
@@ -962,14 +1566,50 @@ def actualizar_estado_viaje(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Error actualizando viaje: {str(e)}")
     
+    estadisticas.cache_estadisticas_transportista.invalidar(viaje.transportista_id)
+    if estado.estado == "finalizado" and estado_anterior != "finalizado":
+        indice_transportistas.actualizar_disponibilidad(viaje.transportista_id, True)
+        # La orden pasó a completada: deja de contar como oferta aceptada
+        motor_asignacion.invalidar()
+    if nueva_notificacion is not None:
+        tiempo_real.publicar_notificacion(nueva_notificacion)
+    
+    proveedor_id = db.query(models.OrdenCarga.proveedor_id).filter(
+        models.OrdenCarga.id == viaje.orden_id
+    ).scalar() if viaje.orden_id else None
+    tiempo_real.publicar_viaje(
+        viaje.id, viaje.transportista_id, proveedor_id,
+        estado=viaje.estado,
+        fecha_fin=viaje.fecha_fin.isoformat() if viaje.fecha_fin else None,
+        tiempo_transcurrido_minutos=viaje.tiempo_transcurrido_minutos or 0
+    )
+    
     return {"message": "Estado del viaje actualizado", "estado": viaje.estado}
 
 
 # ============== NOTIFICACIONES ENDPOINTS ==============
 
 @app.get("/api/notificaciones/{usuario_id}", response_model=List[schemas.NotificacionDetalle])
-def listar_notificaciones(usuario_id: int, db: Session = Depends(get_db)):
-    """Listar notificaciones de un usuario"""
+def listar_notificaciones(
+    usuario_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Listar notificaciones de un usuario (304 si no hubo nuevas ni se marcaron leídas)"""
+    # Las notificaciones sólo se agregan o pasan a leídas: con estos tres valores alcanza
+    version = db.query(
+        func.count(),
+        func.count().filter(models.Notificacion.leida == True),
+        func.max(models.Notificacion.id)
+    ).select_from(models.Notificacion).filter(
+        models.Notificacion.usuario_id == usuario_id
+    ).one()
+    etag = cache_http.etag_version("notificaciones", usuario_id, *version)
+    no_modificado = cache_http.no_modificado(response, if_none_match, etag)
+    if no_modificado is not None:
+        return no_modificado
+    
     notificaciones = db.query(models.Notificacion).filter(
         models.Notificacion.usuario_id == usuario_id
     ).order_by(models.Notificacion.ts_envio.desc()).limit(50).all()
@@ -977,6 +1617,77 @@ def listar_notificaciones(usuario_id: int, db: Session = Depends(get_db)):
     return notificaciones
 
 
+MAX_NOTIFICACIONES_REENVIO = 200
+
+@app.get("/api/notificaciones/{usuario_id}/stream")
+async def stream_notificaciones(
+    usuario_id: int,
+    request: Request,
+    desde_id: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """Notificaciones nuevas de un usuario (Server-Sent Events).
+
+    Se reanuda desde la última notificación vista: `desde_id` en la primera
+    conexión (el id más alto que ya tiene el cliente) y el header Last-Event-ID,
+    que el navegador envía solo, en las reconexiones.
+    """
+    if last_event_id and last_event_id.isdigit():
+        desde_id = int(last_event_id)
+    
+    async def anteriores():
+        async with AsyncSessionLocal() as db:
+            filas = (await db.execute(
+                select(models.Notificacion).where(
+                    models.Notificacion.usuario_id == usuario_id,
+                    models.Notificacion.id > desde_id
+                ).order_by(models.Notificacion.id).limit(MAX_NOTIFICACIONES_REENVIO + 1)
+            )).scalars().all()
+        if len(filas) > MAX_NOTIFICACIONES_REENVIO:
+            return None
+        return [tiempo_real.notificacion_a_dict(n) for n in filas]
+    
+    return StreamingResponse(
+        tiempo_real.flujo_sse(
+            request, tiempo_real.canal_notificaciones, ("usuario", usuario_id), "notificacion",
+            campo_id="id", anteriores=anteriores if desde_id is not None else None
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/notificaciones/{usuario_id}/no-leidas")
+def contar_notificaciones_no_leidas(usuario_id: int, db: Session = Depends(get_db)):
+    """Cantidad de notificaciones sin leer (para el badge), sin traer las filas"""
+    # count(*) y no count(id): se resuelve sólo con el índice (usuario_id, leida, ts_envio)
+    no_leidas = db.query(func.count()).select_from(models.Notificacion).filter(
+        models.Notificacion.usuario_id == usuario_id,
+        models.Notificacion.leida == False
+    ).scalar()
+    
+    return {"usuario_id": usuario_id, "no_leidas": no_leidas}
+
+@app.put("/api/notificaciones/{usuario_id}/leer-todas")
+def marcar_notificaciones_leidas(
+    usuario_id: int,
+    datos: Optional[schemas.MarcarNotificacionesLeidas] = None,
+    db: Session = Depends(get_db)
+):
+    """Marcar como leídas todas las notificaciones de un usuario, o sólo `ids`, con un único UPDATE"""
+    consulta = db.query(models.Notificacion).filter(
+        models.Notificacion.usuario_id == usuario_id,
+        models.Notificacion.leida == False
+    )
+    if datos is not None and datos.ids is not None:
+        if not datos.ids:
+            return {"actualizadas": 0}
+        consulta = consulta.filter(models.Notificacion.id.in_(datos.ids))
+    
+    actualizadas = consulta.update({models.Notificacion.leida: True}, synchronize_session=False)
+    db.commit()
+    
+    return {"actualizadas": actualizadas}
+
 @app.put("/api/notificaciones/{notificacion_id}/leer")
 def marcar_notificacion_leida(notificacion_id: int, db: Session = Depends(get_db)):
     """Marcar notificación como leída"""
@@ -995,76 +1706,64 @@ def marcar_notificacion_leida(notificacion_id: int, db: Session = Depends(get_db
 
 # ============== CONFIGURACIÓN ENDPOINTS ==============
 
+CATALOGOS_CACHE_CONTROL = f"public, max-age={int(os.getenv('CATALOGOS_MAX_AGE_SEGUNDOS', '60'))}"
+
 @app.get("/api/config/tipos-camion")
-def listar_tipos_camion(db: Session = Depends(get_db)):
-    """Listar tipos de camión disponibles"""
-    tipos = db.query(models.TipoCamion).all()
-    return tipos
+def listar_tipos_camion(
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Listar tipos de camión disponibles (cache de catálogos; 304 si no cambiaron)"""
+    tipos = catalogo.obtener(db)["tipos_camion"]
+    return cache_http.respuesta_json(tipos.cuerpo, tipos.etag, if_none_match, CATALOGOS_CACHE_CONTROL)
 
 
 @app.get("/api/config/tipos-carga")
-def listar_tipos_carga(db: Session = Depends(get_db)):
-    """Listar tipos de carga disponibles"""
-    tipos = db.query(models.TipoCarga).all()
-    return tipos
+def listar_tipos_carga(
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Listar tipos de carga disponibles (cache de catálogos; 304 si no cambiaron)"""
+    tipos = catalogo.obtener(db)["tipos_carga"]
+    return cache_http.respuesta_json(tipos.cuerpo, tipos.etag, if_none_match, CATALOGOS_CACHE_CONTROL)
 
 
 # ============== ADMIN ENDPOINTS ==============
 
 @app.get("/api/admin/estadisticas", response_model=schemas.EstadisticasAdmin)
 def obtener_estadisticas_admin(db: Session = Depends(get_db)):
-    """Obtener estadísticas completas del sistema"""
-    
-    total_usuarios = db.query(models.Usuario).count()
-    total_proveedores = db.query(models.Proveedor).count()
-    total_transportistas = db.query(models.Transportista).count()
-    total_ordenes = db.query(models.OrdenCarga).count()
-    ordenes_completadas = db.query(models.OrdenCarga).filter(
-        models.OrdenCarga.estado == "completada"
-    ).count()
-    ordenes_en_progreso = db.query(models.OrdenCarga).filter(
-        models.OrdenCarga.estado.in_(["aceptada", "en_progreso"])
-    ).count()
-    
-    # Calcular CO2 total emitido
-    co2_emitido = db.query(func.sum(models.Transportista.emisiones_co2_total)).scalar() or 0
-    
-    # Calcular CO2 total ahorrado
-    co2_ahorrado_transportistas = db.query(func.sum(models.Transportista.co2_ahorrado)).scalar() or 0
-    co2_ahorrado_ordenes = db.query(func.sum(models.OrdenCarga.co2_ahorrado)).scalar() or 0
-    co2_total_ahorrado = float(co2_ahorrado_transportistas) + float(co2_ahorrado_ordenes)
+    """Obtener estadísticas completas del sistema (contadores mantenidos en estadisticas.py)"""
+    fila = db.get(models.EstadisticasPlataforma, estadisticas.FILA_ID)
+    if fila is None:
+        estadisticas.reconciliar(db)
+        fila = db.get(models.EstadisticasPlataforma, estadisticas.FILA_ID)
     
-    viajes_completados = db.query(func.sum(models.Transportista.viajes_completados)).scalar() or 0
-    
-    # Calcular ingresos totales
-    ingresos_totales = db.query(func.sum(models.OrdenCarga.precio)).filter(
-        models.OrdenCarga.estado == "completada"
-    ).scalar() or 0
-    
-    # Calcular reputación promedio
-    reputacion_promedio = db.query(func.avg(models.Transportista.reputacion)).scalar() or 0
-    
-    return {
-        "total_usuarios": total_usuarios,
-        "total_proveedores": total_proveedores,
-        "total_transportistas": total_transportistas,
-        "total_ordenes": total_ordenes,
-        "ordenes_completadas": ordenes_completadas,
-        "ordenes_en_progreso": ordenes_en_progreso,
-        "co2_total_emitido": float(co2_emitido),
-        "co2_total_ahorrado": co2_total_ahorrado,
-        "viajes_completados": viajes_completados,
-        "ingresos_totales": float(ingresos_totales),
-        "reputacion_promedio": float(reputacion_promedio)
-    }
+    return estadisticas.a_respuesta(fila)
+
+@app.post("/api/admin/estadisticas/reconciliar")
+def reconciliar_estadisticas_admin(db: Session = Depends(get_db)):
+    """Recalcular los contadores desde las tablas y devolver los que estaban desfasados"""
+    deriva = estadisticas.reconciliar(db)
+    return {"corregidos": len(deriva), "deriva": deriva}
+
+@app.get("/api/admin/cache-rutas")
+def obtener_estadisticas_cache_rutas():
+    """Aciertos/fallos de la cache de rutas OSRM de este proceso"""
+    return cache_rutas_osrm.resumen()
+
+@app.get("/api/admin/buffer-ubicaciones")
+def estado_buffer_ubicaciones():
+    """Estado del modo write-behind de posiciones GPS"""
+    return buffer_ubicaciones.resumen()
 
 @app.get("/api/admin/usuarios", response_model=List[schemas.UsuarioAdmin])
 def listar_usuarios_admin(
     rol: Optional[str] = None,
     estado: Optional[str] = None,
+    formato: Optional[str] = FORMATO_STREAM,
     db: Session = Depends(get_db)
 ):
-    """Listar todos los usuarios del sistema"""
+    """Listar todos los usuarios del sistema (`formato=stream|ndjson` para enviarlos a medida que se leen)"""
     query = db.query(models.Usuario)
     
     if rol:
@@ -1072,6 +1771,9 @@ def listar_usuarios_admin(
     if estado:
         query = query.filter(models.Usuario.estado == estado)
     
+    if formato:
+        return serializacion.respuesta_stream(filas_en_stream(query, volcar_con_schema(schemas.UsuarioAdmin)), formato)
+
     usuarios = query.all()
     return usuarios
 
@@ -1109,40 +1811,45 @@ def eliminar_usuario_admin(usuario_id: int, db: Session = Depends(get_db)):
     return {"message": "Usuario dado de baja correctamente"}
 
 @app.get("/api/admin/actividad-reciente", response_model=List[schemas.ActividadReciente])
-def obtener_actividad_reciente(db: Session = Depends(get_db)):
-    """Obtener actividad reciente del sistema"""
-    actividades = []
-    
-    # Órdenes recientes
-    ordenes_recientes = db.query(models.OrdenCarga).order_by(
-        models.OrdenCarga.creada_en.desc()
-    ).limit(10).all()
-    
-    for orden in ordenes_recientes:
-        actividades.append({
-            "tipo": "orden",
-            "descripcion": f"Nueva orden de carga #{orden.id}",
-            "fecha": orden.creada_en,
-            "usuario_id": orden.proveedor_id
-        })
-    
-    # Usuarios recientes
-    usuarios_recientes = db.query(models.Usuario).order_by(
-        models.Usuario.creado_en.desc()
-    ).limit(10).all()
-    
-    for usuario in usuarios_recientes:
-        actividades.append({
-            "tipo": "usuario",
-            "descripcion": f"Nuevo usuario registrado: {usuario.email}",
-            "fecha": usuario.creado_en,
-            "usuario_id": usuario.id
-        })
-    
-    # Ordenar por fecha
-    actividades.sort(key=lambda x: x["fecha"], reverse=True)
-    
-    return actividades[:20]
+def obtener_actividad_reciente(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db)
+):
+    """Actividad reciente del sistema, de la más nueva a la más vieja.
+
+    Se lee del registro de eventos recorriendo el índice (creado_en, id). Si
+    hay más, el cursor de la página siguiente se devuelve en el header
+    X-Siguiente-Cursor.
+    """
+    query = db.query(models.Evento)
+    if cursor:
+        creado_en_cursor, id_cursor = decodificar_cursor(cursor)
+        query = query.filter(
+            tuple_(models.Evento.creado_en, models.Evento.id) < tuple_(creado_en_cursor, id_cursor)
+        )
+    
+    eventos_pagina = query.order_by(
+        models.Evento.creado_en.desc(), models.Evento.id.desc()
+    ).limit(limit).all()
+    
+    if len(eventos_pagina) == limit:
+        ultimo = eventos_pagina[-1]
+        response.headers["X-Siguiente-Cursor"] = codificar_cursor(ultimo.creado_en, ultimo.id)
+    
+    return [
+        {
+            "id": evento.id,
+            "tipo": evento.tipo,
+            "descripcion": evento.descripcion,
+            "fecha": evento.creado_en,
+            "usuario_id": evento.usuario_id,
+            "entidad": evento.entidad,
+            "entidad_id": evento.entidad_id
+        }
+        for evento in eventos_pagina
+    ]
 
 # ============== CALIFICACIONES ENDPOINTS ==============
 
@@ -1193,64 +1900,36 @@ def crear_calificacion(calificacion: schemas.CalificacionCreate, db: Session = D
         total_calificaciones = transportista.cantidad_calificaciones
         reputacion_actual = float(transportista.reputacion)
         nueva_reputacion = (reputacion_actual * total_calificaciones + calificacion.puntuacion) / (total_calificaciones + 1)
+        # Redondeado como lo guarda la columna, para que el contador sume lo mismo
+        nueva_reputacion = Decimal(str(nueva_reputacion)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
         
+        estadisticas.sumar(db, suma_reputacion=nueva_reputacion - transportista.reputacion)
         transportista.reputacion = nueva_reputacion
         transportista.cantidad_calificaciones += 1
     
     db.commit()
     db.refresh(nueva_calificacion)
+    estadisticas.cache_estadisticas_transportista.invalidar(calificacion.transportista_id)
     
     return nueva_calificacion
 
 @app.get("/api/calificaciones/transportista/{transportista_id}", response_model=List[schemas.CalificacionDetalle])
-def obtener_calificaciones_transportista(transportista_id: int, db: Session = Depends(get_db)):
-    """Obtener todas las calificaciones de un transportista"""
-    calificaciones = db.query(models.Calificacion).filter(
+def obtener_calificaciones_transportista(
+    transportista_id: int,
+    formato: Optional[str] = FORMATO_STREAM,
+    db: Session = Depends(get_db)
+):
+    """Obtener todas las calificaciones de un transportista (`formato=stream|ndjson` para enviarlas a medida que se leen)"""
+    query = db.query(models.Calificacion).filter(
         models.Calificacion.transportista_id == transportista_id
-    ).order_by(models.Calificacion.creada_en.desc()).all()
-    
-    return calificaciones
+    ).order_by(models.Calificacion.creada_en.desc())
 
-async def obtener_ruta_osrm(origen_lon: float, origen_lat: float, destino_lon: float, destino_lat: float):
-    """Obtener ruta completa usando OSRM con coordenadas precisas"""
-    url = f"http://router.project-osrm.org/route/v1/driving/{origen_lon},{origen_lat};{destino_lon},{destino_lat}?overview=full&geometries=geojson"
-    
-    try:
-        # Aumentar timeout a 30 segundos para solicitudes a OSRM
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            response.raise_for_status() # Lanza una excepción para códigos de estado de error HTTP
-            data = response.json()
-            
-            if data.get("code") == "Ok" and data.get("routes"):
-                route = data["routes"][0]
-                coordinates = route["geometry"]["coordinates"]
-                # Convertir de [lon, lat] a {"lat": lat, "lng": lon}
-                coords_formatted = [{"lat": coord[1], "lng": coord[0]} for coord in coordinates]
-                distance_km = round(route["distance"] / 1000, 2)
-                duration_min = round(route["duration"] / 60)
-                
-                return {
-                    "coordinates": coords_formatted,
-                    "distance": distance_km,
-                    "duration": duration_min
-                }
-    except httpx.HTTPStatusError as e:
-        print(f"[v0] Error HTTP obteniendo ruta OSRM: {e.response.status_code} - {e.response.text}")
-    except httpx.RequestError as e:
-        print(f"[v0] Error de solicitud al obtener ruta OSRM: {e}")
-    except Exception as e:
-        print(f"[v0] Error inesperado obteniendo ruta OSRM: {e}")
+    if formato:
+        return serializacion.respuesta_stream(filas_en_stream(query, volcar_con_schema(schemas.CalificacionDetalle)), formato)
+
+    calificaciones = query.all()
     
-    # Fallback: línea recta
-    return {
-        "coordinates": [
-            {"lat": origen_lat, "lng": origen_lon},
-            {"lat": destino_lat, "lng": destino_lon}
-        ],
-        "distance": 0,
-        "duration": 0
-    }
+    return calificaciones
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,80 @@
+"""Migraciones incrementales e idempotentes para bases ya existentes.
+
+`Base.metadata.create_all` sólo crea tablas nuevas: no agrega columnas ni
+índices a tablas que ya existen. Este script aplica esos cambios a mano y se
+puede ejecutar las veces que haga falta: python migraciones.py
+"""
+from sqlalchemy import text
+from database import engine
+import models
+import rutas
+import estadisticas
+import eventos
+
+MIGRACIONES = [
+    # Paginación por cursor de órdenes y filtro por transportista asignado
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_carga_creada_en_id ON ordenes_carga (creada_en, id)",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_carga_transportista_asignado_id ON ordenes_carga (transportista_asignado_id)",
+    # Rutas empaquetadas en binario (ver rutas.py)
+    "ALTER TABLE viajes ADD COLUMN IF NOT EXISTS ruta_geom BYTEA",
+    # Estado de la ruta calculada en segundo plano al aceptar una orden
+    "ALTER TABLE viajes ADD COLUMN IF NOT EXISTS ruta_estado VARCHAR(20) DEFAULT 'calculada'",
+    # Estadísticas y viajes activos por transportista
+    "CREATE INDEX IF NOT EXISTS ix_viajes_transportista_id_estado ON viajes (transportista_id, estado)",
+    # Versión de los listados de órdenes (GET condicional)
+    "ALTER TABLE ordenes_carga ADD COLUMN IF NOT EXISTS actualizada_en TIMESTAMPTZ DEFAULT now()",
+    # Stream de notificaciones: reanudar por usuario desde un id
+    "CREATE INDEX IF NOT EXISTS ix_notificaciones_usuario_id_id ON notificaciones (usuario_id, id)",
+    # Conteo de no leídas y marcado masivo como leídas
+    "CREATE INDEX IF NOT EXISTS ix_notificaciones_usuario_id_leida_ts_envio ON notificaciones (usuario_id, leida, ts_envio)",
+    # Sincronización incremental de órdenes y viajes (?since=)
+    "ALTER TABLE viajes ADD COLUMN IF NOT EXISTS actualizado_en TIMESTAMPTZ DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_carga_actualizada_en ON ordenes_carga (actualizada_en)",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_carga_proveedor_id_actualizada_en ON ordenes_carga (proveedor_id, actualizada_en)",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_carga_transportista_asignado_id_actualizada_en ON ordenes_carga (transportista_asignado_id, actualizada_en)",
+    "CREATE INDEX IF NOT EXISTS ix_viajes_actualizado_en ON viajes (actualizado_en)",
+    "CREATE INDEX IF NOT EXISTS ix_viajes_transportista_id_actualizado_en ON viajes (transportista_id, actualizado_en)",
+    # Eventos de órdenes nuevas guardados sin usuario: atribuirlos al proveedor
+    "UPDATE eventos SET usuario_id = o.proveedor_id FROM ordenes_carga o "
+    "WHERE eventos.tipo = 'orden' AND eventos.usuario_id IS NULL AND o.id = eventos.entidad_id",
+]
+
+def migrar_rutas_a_binario(conn, lote=200):
+    """Pasar las rutas JSON legadas (ruta_completa) al formato binario ruta_geom"""
+    migradas = 0
+    while True:
+        filas = conn.execute(text(
+            "SELECT id, ruta_completa FROM viajes "
+            "WHERE ruta_completa IS NOT NULL AND ruta_geom IS NULL "
+            "ORDER BY id LIMIT :lote"
+        ), {"lote": lote}).all()
+        if not filas:
+            break
+        for viaje_id, ruta_completa in filas:
+            coordenadas = rutas.ruta_de_viaje(None, ruta_completa)
+            conn.execute(text(
+                "UPDATE viajes SET ruta_geom = :geom, ruta_completa = NULL WHERE id = :id"
+            ), {"geom": rutas.codificar_ruta(coordenadas) if coordenadas is not None else b"", "id": viaje_id})
+        migradas += len(filas)
+    return migradas
+
+def aplicar_migraciones():
+    """Crear tablas faltantes y aplicar las migraciones pendientes"""
+    # models.Base (la de database.py) tiene registradas todas las tablas de models.py
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for sentencia in MIGRACIONES:
+            conn.execute(text(sentencia))
+        migradas = migrar_rutas_a_binario(conn)
+        if migradas:
+            print(f"🗺️  {migradas} rutas migradas a formato binario")
+        # Tabla de eventos nueva: arrancar el feed con los usuarios y órdenes existentes
+        creados = eventos.poblar_desde_tablas(conn)
+        if creados:
+            print(f"📜 {creados} eventos creados a partir de usuarios y órdenes existentes")
+    # Contadores del dashboard de administración (tabla nueva: se calculan desde cero)
+    estadisticas.asegurar_fila()
+
+if __name__ == "__main__":
+    aplicar_migraciones()
+    print("✅ Migraciones aplicadas")
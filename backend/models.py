@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, Numeric, Text, DateTime, ForeignKey, Date, SmallInteger, JSON
+from sqlalchemy import BigInteger, Boolean, Column, Integer, String, Numeric, Text, DateTime, ForeignKey, Date, SmallInteger, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -146,12 +146,27 @@ class OrdenCarga(Base):
     co2_ahorrado = Column(Numeric(12, 2), default=0)
     transportista_asignado_id = Column(Integer, ForeignKey("transportistas.id"))
     completada_en = Column(DateTime(timezone=True))
+    # Última modificación de la fila según el reloj de la base (versión de los
+    # listados y sincronización incremental, ver version_ordenes y sincronizacion.py)
+    actualizada_en = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relaciones
     proveedor = relationship("Proveedor", back_populates="ordenes")
     tipo_carga = relationship("TipoCarga", back_populates="ordenes")
+    origen = relationship("Origen", foreign_keys=[origen_id])
+    destino = relationship("Origen", foreign_keys=[destino_id])
     calificaciones = relationship("Calificacion", back_populates="orden")
 
+    __table_args__ = (
+        # Paginación por cursor (creada_en, id) y filtro por transportista asignado
+        Index("ix_ordenes_carga_creada_en_id", "creada_en", "id"),
+        Index("ix_ordenes_carga_transportista_asignado_id", "transportista_asignado_id"),
+        # Sincronización incremental (?since=): cambios desde un instante, total y por dueño
+        Index("ix_ordenes_carga_actualizada_en", "actualizada_en"),
+        Index("ix_ordenes_carga_proveedor_id_actualizada_en", "proveedor_id", "actualizada_en"),
+        Index("ix_ordenes_carga_transportista_asignado_id_actualizada_en", "transportista_asignado_id", "actualizada_en"),
+    )
+
 
 class Viaje(Base):
     __tablename__ = "viajes"
@@ -173,12 +188,26 @@ class Viaje(Base):
     tiempo_entrega_esperado = Column(DateTime(timezone=True))  # When delivery is expected
     tiempo_entrega_real = Column(DateTime(timezone=True))  # When actually delivered
     cumple_plazo = Column(Boolean)  # Whether delivery was on time
-    ultima_actualizacion = Column(DateTime(timezone=True), server_default=func.now())
+    # Posición GPS y cualquier otro cambio de la fila (estado, ruta...)
+    ultima_actualizacion = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # Igual que ultima_actualizacion pero siempre con el reloj de la base: las
+    # posiciones GPS guardan ahí el ts del dispositivo (sincronización incremental)
+    actualizado_en = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     detenido_minutos = Column(Integer, default=0)
-    ruta_completa = Column(Text)  # JSON string with route coordinates
+    ruta_completa = Column(Text)  # Formato legado: JSON con las coordenadas (migrado a ruta_geom)
+    ruta_geom = Column(LargeBinary)  # Ruta empaquetada en int32 (lat, lng), ver rutas.py
+    ruta_estado = Column(String(20), default="calculada")  # pendiente, calculada, linea_recta
     
     # Relaciones
     transportista = relationship("Transportista", back_populates="viajes")
+    
+    __table_args__ = (
+        # Estadísticas y viajes activos de un transportista
+        Index("ix_viajes_transportista_id_estado", "transportista_id", "estado"),
+        # Sincronización incremental (?since=)
+        Index("ix_viajes_actualizado_en", "actualizado_en"),
+        Index("ix_viajes_transportista_id_actualizado_en", "transportista_id", "actualizado_en"),
+    )
 
 class Notificacion(Base):
     __tablename__ = "notificaciones"
@@ -192,6 +221,13 @@ class Notificacion(Base):
     
     # Relaciones
     usuario = relationship("Usuario", back_populates="notificaciones")
+    
+    __table_args__ = (
+        # Reanudar el stream de un usuario desde la última notificación vista
+        Index("ix_notificaciones_usuario_id_id", "usuario_id", "id"),
+        # Conteo de no leídas y "marcar todas" sin leer la tabla
+        Index("ix_notificaciones_usuario_id_leida_ts_envio", "usuario_id", "leida", "ts_envio"),
+    )
 
 
 class Calificacion(Base):
@@ -214,3 +250,60 @@ class Calificacion(Base):
     orden = relationship("OrdenCarga", back_populates="calificaciones")
     transportista = relationship("Transportista", back_populates="calificaciones")
     proveedor = relationship("Proveedor")
+
+
+class RutaOSRMCache(Base):
+    __tablename__ = "rutas_osrm_cache"
+    
+    # Clave: coordenadas de origen y destino redondeadas (ver osrm.py)
+    clave = Column(String(80), primary_key=True)
+    ruta_geom = Column(LargeBinary, nullable=False)  # Mismo formato que Viaje.ruta_geom
+    distancia_km = Column(Numeric(10, 2))
+    duracion_minutos = Column(Integer)
+    creada_en = Column(DateTime(timezone=True), server_default=func.now())
+    expira_en = Column(DateTime(timezone=True), index=True)
+
+
+class Evento(Base):
+    """Registro de eventos de dominio, sólo inserciones (ver eventos.py)"""
+    __tablename__ = "eventos"
+    
+    id = Column(BigInteger, primary_key=True)
+    tipo = Column(String(40), nullable=False)  # usuario, orden, orden_estado, viaje_estado
+    descripcion = Column(Text, nullable=False)
+    usuario_id = Column(Integer)  # Usuario relacionado, si lo hay
+    entidad = Column(String(20))  # usuario, orden, viaje
+    entidad_id = Column(Integer)
+    datos = Column(JSON)
+    creado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    
+    __table_args__ = (
+        # Feed de actividad: rango por fecha, desempatando por id
+        Index("ix_eventos_creado_en_id", "creado_en", "id"),
+    )
+
+
+class EstadisticasPlataforma(Base):
+    """Contadores del dashboard de administración (una sola fila, id=1).
+
+    Se actualizan en la misma transacción que los cambios que los afectan (ver
+    estadisticas.py) y se recalculan desde cero con estadisticas.reconciliar.
+    """
+    __tablename__ = "estadisticas_plataforma"
+    
+    id = Column(Integer, primary_key=True)
+    total_usuarios = Column(Integer, nullable=False, default=0)
+    total_proveedores = Column(Integer, nullable=False, default=0)
+    total_transportistas = Column(Integer, nullable=False, default=0)
+    total_ordenes = Column(Integer, nullable=False, default=0)
+    ordenes_completadas = Column(Integer, nullable=False, default=0)
+    ordenes_en_progreso = Column(Integer, nullable=False, default=0)
+    viajes_completados = Column(Integer, nullable=False, default=0)
+    co2_emitido = Column(Numeric(16, 2), nullable=False, default=0)
+    co2_ahorrado_transportistas = Column(Numeric(16, 2), nullable=False, default=0)
+    co2_ahorrado_ordenes = Column(Numeric(16, 2), nullable=False, default=0)
+    ingresos_totales = Column(Numeric(16, 2), nullable=False, default=0)
+    # Promedio de reputación = suma / cantidad de transportistas con reputación
+    suma_reputacion = Column(Numeric(16, 4), nullable=False, default=0)
+    transportistas_con_reputacion = Column(Integer, nullable=False, default=0)
+    actualizada_en = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,270 @@
+"""Cliente de rutas OSRM con cache en dos niveles
+
+1. LRU en memoria del proceso.
+2. Tabla `rutas_osrm_cache` en la base, compartida entre procesos y reinicios.
+
+La clave son las coordenadas de origen y destino redondeadas a 4 decimales
+(~11 m), así que pedidos "iguales" comparten ruta. Si llegan varios pedidos
+concurrentes para la misma clave, sólo el primero consulta al router y el resto
+espera ese mismo resultado.
+
+Las rutas se devuelven ya empaquetadas en el formato de rutas.py.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy.exc import SQLAlchemyError
+
+import database
+import models
+import rutas
+
+OSRM_URL = os.getenv("OSRM_URL", "http://router.project-osrm.org").rstrip("/")
+DECIMALES_CLAVE = 4
+
+
+def clave_ruta(origen_lon, origen_lat, destino_lon, destino_lat):
+    r = DECIMALES_CLAVE
+    return f"{round(origen_lat, r)},{round(origen_lon, r)};{round(destino_lat, r)},{round(destino_lon, r)}"
+
+
+class ClienteOSRM:
+    """Cliente HTTP compartido (keep-alive) con límite de consultas concurrentes.
+
+    Se crea al iniciar la app y se cierra al apagarla (ver lifespan en main.py);
+    seed_data.py usa el mismo cliente. `transport` permite apuntarlo a un router
+    de prueba dentro del proceso (ver benchmarks/coalescencia_osrm.py).
+    """
+
+    def __init__(self, base_url, max_concurrentes=4, timeout=30.0, transport=None):
+        self.base_url = base_url
+        self.max_concurrentes = max_concurrentes
+        self.timeout = timeout
+        self.transport = transport
+        self._client = None
+        self._semaforo = asyncio.Semaphore(max_concurrentes)
+
+    async def iniciar(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrentes,
+                    max_keepalive_connections=self.max_concurrentes
+                )
+            )
+
+    async def cerrar(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def ruta(self, origen_lon, origen_lat, destino_lon, destino_lat):
+        """Consultar /route. Devuelve coordenadas (lat, lng), km y minutos, o None."""
+        if self._client is None:
+            await self.iniciar()
+        path = f"/route/v1/driving/{origen_lon},{origen_lat};{destino_lon},{destino_lat}"
+
+        try:
+            async with self._semaforo:
+                response = await self._client.get(path, params={"overview": "full", "geometries": "geojson"})
+            response.raise_for_status() # Lanza una excepción para códigos de estado de error HTTP
+            data = response.json()
+
+            if data.get("code") == "Ok" and data.get("routes"):
+                route = data["routes"][0]
+                coordinates = route["geometry"]["coordinates"]
+                # Convertir de [lon, lat] a pares (lat, lng), el orden de rutas.py
+                return {
+                    "coordinates": [(coord[1], coord[0]) for coord in coordinates],
+                    "distance": round(route["distance"] / 1000, 2),
+                    "duration": round(route["duration"] / 60)
+                }
+        except httpx.HTTPStatusError as e:
+            print(f"[v0] Error HTTP obteniendo ruta OSRM: {e.response.status_code} - {e.response.text}")
+        except httpx.RequestError as e:
+            print(f"[v0] Error de solicitud al obtener ruta OSRM: {e}")
+        except Exception as e:
+            print(f"[v0] Error inesperado obteniendo ruta OSRM: {e}")
+        return None
+
+
+cliente_osrm = ClienteOSRM(
+    OSRM_URL,
+    max_concurrentes=int(os.getenv("OSRM_MAX_CONCURRENTES", "4")),
+    timeout=float(os.getenv("OSRM_TIMEOUT_SEGUNDOS", "30"))
+)
+
+
+async def consultar_osrm(origen_lon, origen_lat, destino_lon, destino_lat, cliente=None):
+    """Pedir la ruta al router ya empaquetada. Devuelve None si no se pudo obtener."""
+    ruta = await (cliente or cliente_osrm).ruta(origen_lon, origen_lat, destino_lon, destino_lat)
+    if ruta is None:
+        return None
+    return {
+        "ruta_geom": rutas.codificar_ruta(ruta["coordinates"]),
+        "distance": ruta["distance"],
+        "duration": ruta["duration"]
+    }
+
+
+class CacheRutasOSRM:
+    def __init__(self, max_memoria=1024, ttl=timedelta(days=7), consultar=None):
+        self.max_memoria = max_memoria
+        self.ttl = ttl
+        # Por defecto consulta al cliente compartido; se puede reemplazar en pruebas
+        self.consultar = consultar or consultar_osrm
+        self._memoria = OrderedDict()  # clave -> (expira_monotonic, ruta)
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self.estadisticas = {"hits_memoria": 0, "hits_db": 0, "misses": 0, "coalescidos": 0, "errores": 0}
+
+    # ---------- nivel 1: memoria ----------
+
+    def _leer_memoria(self, clave):
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is None:
+                return None
+            expira, ruta = entrada
+            if expira < time.monotonic():
+                del self._memoria[clave]
+                return None
+            self._memoria.move_to_end(clave)
+            return ruta
+
+    def _guardar_memoria(self, clave, ruta, segundos_restantes=None):
+        if segundos_restantes is None:
+            segundos_restantes = self.ttl.total_seconds()
+        with self._lock:
+            self._memoria[clave] = (time.monotonic() + segundos_restantes, ruta)
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > self.max_memoria:
+                self._memoria.popitem(last=False)
+
+    # ---------- nivel 2: base de datos ----------
+
+    def _leer_db(self, clave):
+        db = database.SessionLocal()
+        try:
+            ahora = datetime.now(timezone.utc)
+            fila = db.query(models.RutaOSRMCache).filter(
+                models.RutaOSRMCache.clave == clave,
+                models.RutaOSRMCache.expira_en > ahora
+            ).first()
+            if fila is None:
+                return None
+            expira_en = fila.expira_en
+            if expira_en.tzinfo is None:
+                # SQLite no guarda la zona horaria; se guardó en UTC
+                expira_en = expira_en.replace(tzinfo=timezone.utc)
+            segundos_restantes = (expira_en - ahora).total_seconds()
+            return {
+                "ruta_geom": fila.ruta_geom,
+                "distance": float(fila.distancia_km or 0),
+                "duration": fila.duracion_minutos or 0
+            }, segundos_restantes
+        finally:
+            db.close()
+
+    def _guardar_db(self, clave, ruta):
+        db = database.SessionLocal()
+        ahora = datetime.now(timezone.utc)
+        try:
+            db.merge(models.RutaOSRMCache(
+                clave=clave,
+                ruta_geom=ruta["ruta_geom"],
+                distancia_km=ruta["distance"],
+                duracion_minutos=ruta["duration"],
+                creada_en=ahora,
+                expira_en=ahora + self.ttl
+            ))
+            db.commit()
+        except SQLAlchemyError as e:
+            # Otro proceso pudo haber guardado la misma clave; no es grave
+            db.rollback()
+            print(f"[v0] No se pudo guardar la ruta en cache: {e}")
+        finally:
+            db.close()
+
+    # ---------- API ----------
+
+    async def obtener(self, origen_lon, origen_lat, destino_lon, destino_lat):
+        """Ruta entre dos puntos, o None si no está en cache y el router falla"""
+        clave = clave_ruta(origen_lon, origen_lat, destino_lon, destino_lat)
+
+        ruta = self._leer_memoria(clave)
+        if ruta is not None:
+            self.estadisticas["hits_memoria"] += 1
+            return ruta
+
+        en_vuelo = self._en_vuelo.get(clave)
+        if en_vuelo is not None:
+            self.estadisticas["coalescidos"] += 1
+            return await asyncio.shield(en_vuelo)
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        ruta = None
+        try:
+            try:
+                desde_db = await asyncio.to_thread(self._leer_db, clave)
+            except SQLAlchemyError as e:
+                print(f"[v0] Error leyendo cache de rutas: {e}")
+                desde_db = None
+
+            if desde_db is not None:
+                ruta, segundos_restantes = desde_db
+                self.estadisticas["hits_db"] += 1
+                self._guardar_memoria(clave, ruta, segundos_restantes)
+            else:
+                self.estadisticas["misses"] += 1
+                ruta = await self.consultar(origen_lon, origen_lat, destino_lon, destino_lat)
+                if ruta is None:
+                    self.estadisticas["errores"] += 1
+                else:
+                    self._guardar_memoria(clave, ruta)
+                    await asyncio.to_thread(self._guardar_db, clave, ruta)
+            return ruta
+        finally:
+            del self._en_vuelo[clave]
+            futuro.set_result(ruta)
+
+    def resumen(self):
+        total = sum(self.estadisticas[k] for k in ("hits_memoria", "hits_db", "misses", "coalescidos"))
+        aciertos = total - self.estadisticas["misses"]
+        return {
+            **self.estadisticas,
+            "en_memoria": len(self._memoria),
+            "tasa_aciertos": round(aciertos / total, 3) if total else 0.0
+        }
+
+
+cache_rutas_osrm = CacheRutasOSRM(
+    max_memoria=int(os.getenv("OSRM_CACHE_MAX_RUTAS", "1024")),
+    ttl=timedelta(hours=float(os.getenv("OSRM_CACHE_TTL_HORAS", "168")))
+)
+
+
+async def obtener_ruta_osrm(origen_lon: float, origen_lat: float, destino_lon: float, destino_lat: float):
+    """Obtener ruta completa usando OSRM (con cache) y, si falla, una línea recta"""
+    ruta = await cache_rutas_osrm.obtener(origen_lon, origen_lat, destino_lon, destino_lat)
+    if ruta is not None:
+        return ruta
+
+    # Fallback: línea recta
+    return {
+        "ruta_geom": rutas.codificar_ruta([
+            (origen_lat, origen_lon),
+            (destino_lat, destino_lon)
+        ]),
+        "distance": 0,
+        "duration": 0
+    }
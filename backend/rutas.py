@@ -0,0 +1,238 @@
+"""Almacenamiento compacto de rutas (Viaje.ruta_geom)
+
+Las rutas se guardan como un arreglo empaquetado de enteros int32
+little-endian en microgrados, con pares (lat, lng) consecutivos: 8 bytes por
+punto, contra ~40 bytes por punto del JSON `[{"lat": ..., "lng": ...}]`
+anterior. Mismo tamaño que un float32 pero sin pérdida para las 6 decimales que
+ya se guardaban (~0,1 m).
+
+La decodificación es perezosa: los bytes viajan tal cual desde la base y se
+convierten con numpy recién cuando hace falta calcular; `ruta_a_json` arma la
+lista de dicts que espera el frontend sólo en el borde de la API.
+"""
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Formato de cada punto: (lat, lng) en microgrados, int32 little-endian
+DTYPE_RUTA = np.dtype("<i4")
+ESCALA = 1_000_000
+
+
+def codificar_ruta(puntos):
+    """Empaquetar una ruta en bytes.
+
+    Acepta pares (lat, lng) o dicts {"lat": ..., "lng": ...} (formato legado).
+    """
+    puntos = list(puntos)
+    if not puntos:
+        return b""
+    if isinstance(puntos[0], dict):
+        puntos = [(p["lat"], p["lng"]) for p in puntos if "lat" in p and "lng" in p]
+    arreglo = np.rint(np.asarray(puntos, dtype=np.float64).reshape(-1, 2) * ESCALA)
+    return arreglo.astype(DTYPE_RUTA).tobytes()
+
+
+def decodificar_ruta(datos):
+    """Devolver la ruta como arreglo float64 (n, 2) de [lat, lng] en grados"""
+    if not datos:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.frombuffer(datos, dtype=DTYPE_RUTA).reshape(-1, 2) / ESCALA
+
+
+def ruta_a_json(coordenadas):
+    """Convertir un arreglo (n, 2) al formato de la API: [{"lat", "lng"}]"""
+    return [{"lat": lat, "lng": lng} for lat, lng in coordenadas.round(6).tolist()]
+
+
+def ruta_de_viaje(ruta_geom, ruta_completa=None):
+    """Coordenadas de un viaje, tanto del formato binario como del JSON legado"""
+    if ruta_geom:
+        return decodificar_ruta(ruta_geom)
+    if ruta_completa:
+        try:
+            return decodificar_ruta(codificar_ruta(json.loads(ruta_completa)))
+        except (ValueError, TypeError, KeyError):
+            return None
+    return None
+
+
+# ============== PROGRESO SOBRE LA RUTA ==============
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = math.radians(1) * RADIO_TIERRA_KM
+
+
+def distancia_haversine(lat1, lon1, lat2, lon2):
+    """Distancia en km entre dos puntos"""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(dlon / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def distancias_acumuladas(coordenadas):
+    """Distancia recorrida (km, haversine) hasta cada vértice de la ruta"""
+    if len(coordenadas) < 2:
+        return np.zeros(len(coordenadas))
+    lat = np.radians(coordenadas[:, 0])
+    lon = np.radians(coordenadas[:, 1])
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    segmentos = 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return np.concatenate(([0.0], np.cumsum(segmentos)))
+
+
+def proyectar_en_ruta(coordenadas, acumuladas, lat, lon, desde=0, hasta=None):
+    """Proyectar una posición sobre los segmentos de la ruta.
+
+    Devuelve (distancia_recorrida_km, indice_segmento, desvio_km), donde
+    desvio_km es la distancia de la posición a la ruta. Sólo se evalúan los
+    segmentos [desde, hasta) y todo se resuelve con operaciones vectorizadas
+    sobre un plano equirectangular centrado en la posición, suficiente a la
+    escala de un segmento de ruta.
+    """
+    n = len(coordenadas)
+    if n < 2:
+        return 0.0, 0, 0.0
+
+    hasta = n - 1 if hasta is None else min(hasta, n - 1)
+    desde = max(0, min(desde, hasta - 1))
+
+    escala_lon = math.cos(math.radians(lat))
+    tramo = coordenadas[desde:hasta + 1]
+    # Coordenadas planas (en grados de latitud) relativas a la posición actual
+    y = tramo[:, 0] - lat
+    x = (tramo[:, 1] - lon) * escala_lon
+
+    ax, ay = x[:-1], y[:-1]
+    dx, dy = x[1:] - ax, y[1:] - ay
+    largo2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(largo2 > 0, -(ax * dx + ay * dy) / largo2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    px = ax + t * dx
+    py = ay + t * dy
+
+    d2 = px * px + py * py
+    i = int(np.argmin(d2))
+    indice = desde + i
+    largo_segmento = acumuladas[indice + 1] - acumuladas[indice]
+    desvio_km = math.sqrt(d2[i]) * KM_POR_GRADO
+    return float(acumuladas[indice] + t[i] * largo_segmento), indice, desvio_km
+
+
+# ============== CACHE DE RUTAS DE VIAJES ACTIVOS ==============
+
+# Ventana de segmentos que se revisa alrededor del último segmento encontrado.
+# Un camión avanza pocos segmentos entre dos reportes, así que casi siempre
+# alcanza con mirar un tramo corto en vez de la ruta completa.
+VENTANA_ATRAS = 20
+VENTANA_ADELANTE = 400
+# Si la posición queda más lejos que esto de la ventana, se busca en toda la ruta
+DESVIO_MAXIMO_VENTANA_KM = 0.5
+
+
+class RutaCacheada:
+    """Ruta decodificada de un viaje con sus distancias acumuladas"""
+
+    __slots__ = ("coordenadas", "acumuladas", "ultimo_indice")
+
+    def __init__(self, coordenadas):
+        self.coordenadas = coordenadas
+        self.acumuladas = distancias_acumuladas(coordenadas)
+        self.ultimo_indice = None
+
+
+class CacheRutas:
+    """LRU en memoria, acotada por cantidad de viajes, indexada por viaje_id
+
+    Quien lee una ruta de la base para guardarla toma antes `version()` y la
+    pasa a `guardar`: si el viaje se invalidó en el medio (p. ej. se guardó la
+    ruta calculada mientras se procesaba una posición), lo leído puede ser la
+    ruta vieja y no se guarda.
+    """
+
+    def __init__(self, max_viajes=512):
+        self.max_viajes = max_viajes
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0  # Aumenta con cada invalidación
+        self._invalidados = OrderedDict()  # viaje_id -> versión de su última invalidación
+        self._version_olvidada = 0  # Mayor versión descartada de _invalidados
+
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def obtener(self, viaje_id):
+        with self._lock:
+            entrada = self._entradas.get(viaje_id)
+            if entrada is not None:
+                self._entradas.move_to_end(viaje_id)
+            return entrada
+
+    def guardar(self, viaje_id, coordenadas, version=None):
+        """Guardar la ruta de un viaje; con `version`, sólo si no se invalidó después"""
+        entrada = RutaCacheada(coordenadas)
+        with self._lock:
+            if version is not None and version < self._invalidados.get(viaje_id, self._version_olvidada):
+                return entrada
+            self._entradas[viaje_id] = entrada
+            self._entradas.move_to_end(viaje_id)
+            while len(self._entradas) > self.max_viajes:
+                self._entradas.popitem(last=False)
+        return entrada
+
+    def invalidar(self, viaje_id):
+        """Descartar la ruta de un viaje (cambió la ruta o el viaje terminó)"""
+        with self._lock:
+            self._entradas.pop(viaje_id, None)
+            self._version += 1
+            self._invalidados[viaje_id] = self._version
+            self._invalidados.move_to_end(viaje_id)
+            while len(self._invalidados) > 4 * self.max_viajes:
+                _, self._version_olvidada = self._invalidados.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+cache_rutas = CacheRutas(int(os.getenv("RUTAS_CACHE_MAX_VIAJES", "512")))
+
+
+def progreso_viaje(viaje_id, cargar_ruta, lat, lon, version=None):
+    """Distancia recorrida (km) de un viaje activo para una nueva posición.
+
+    `cargar_ruta` sólo se llama si la ruta no está en la cache y debe devolver
+    las coordenadas (n, 2) o None. Devuelve None si el viaje no tiene ruta.
+    `version` es la de la cache (`cache_rutas.version()`) al leer la ruta de
+    la base; ver CacheRutas.
+    """
+    entrada = cache_rutas.obtener(viaje_id)
+    if entrada is None:
+        coordenadas = cargar_ruta()
+        if coordenadas is None or len(coordenadas) < 2:
+            return None
+        entrada = cache_rutas.guardar(viaje_id, coordenadas, version)
+
+    resultado = None
+    if entrada.ultimo_indice is not None:
+        resultado = proyectar_en_ruta(
+            entrada.coordenadas, entrada.acumuladas, lat, lon,
+            desde=entrada.ultimo_indice - VENTANA_ATRAS,
+            hasta=entrada.ultimo_indice + VENTANA_ADELANTE
+        )
+        if resultado[2] > DESVIO_MAXIMO_VENTANA_KM:
+            resultado = None
+    if resultado is None:
+        resultado = proyectar_en_ruta(entrada.coordenadas, entrada.acumuladas, lat, lon)
+
+    distancia, entrada.ultimo_indice, _ = resultado
+    return distancia
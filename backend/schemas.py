@@ -64,9 +64,30 @@ class TransportistaDetalle(BaseModel):
     reputacion: float
     emisiones_co2_total: float
 
+class TransportistaCercano(TransportistaDetalle):
+    distancia_km: float
+
+class CandidatoAsignacion(TransportistaDetalle):
+    # `camion` es el camión del transportista que mejor se ajusta a la orden
+    distancia_vacio_km: float  # Desde la posición actual hasta el origen
+    co2_estimado_kg: float  # Vacío + recorrido de la orden
+    puntaje: float  # 0 a 1, ver asignacion.py
+
 class DisponibilidadUpdate(BaseModel):
     disponible: bool
 
+class UbicacionGPS(BaseModel):
+    transportista_id: int
+    lat: float
+    lon: float
+    ts: Optional[datetime] = None  # Momento de la lectura; si falta se usa la hora de recepción
+
+class ResultadoUbicacion(BaseModel):
+    indice: int  # Posición del elemento en el lote recibido
+    transportista_id: int
+    estado: str  # actualizada, reemplazada, no_encontrado, invalida
+    viajes_actualizados: int = 0
+
 # ============== ORDEN/OFERTA SCHEMAS ==============
 
 class OrdenCargaCreate(BaseModel):
@@ -139,6 +160,7 @@ class ViajeDetalle(BaseModel):
     ultima_actualizacion: Optional[str]
     detenido_minutos: int
     ruta_completa: Optional[List[dict]] = None  # Added ruta_completa field to include route coordinates
+    ruta_estado: str = "calculada"  # pendiente mientras la ruta se calcula en segundo plano
 
 # ============== NOTIFICACIÓN SCHEMAS ==============
 
@@ -153,6 +175,9 @@ class NotificacionDetalle(BaseModel):
     class Config:
         from_attributes = True
 
+class MarcarNotificacionesLeidas(BaseModel):
+    ids: Optional[List[int]] = None  # None = todas las del usuario
+
 # ============== CALIFICACIÓN SCHEMAS ==============
 
 class CalificacionCreate(BaseModel):
@@ -203,10 +228,13 @@ class EstadisticasAdmin(BaseModel):
     reputacion_promedio: float
     
 class ActividadReciente(BaseModel):
+    id: Optional[int] = None
     tipo: str
     descripcion: str
     fecha: datetime
     usuario_id: Optional[int]
+    entidad: Optional[str] = None
+    entidad_id: Optional[int] = None
 
 class UsuarioUpdate(BaseModel):
     estado: Optional[str]
@@ -2,36 +2,24 @@
 from sqlalchemy.orm import Session
 from database import SessionLocal, engine, Base
 import models
+import rutas
+import estadisticas
+import eventos
 from datetime import datetime, timedelta
 import random
 from decimal import Decimal
-import json
 import asyncio
-import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from osrm import cliente_osrm
 
 async def obtener_ruta_osrm_async(origen_lon, origen_lat, destino_lon, destino_lat):
-    """Obtener ruta real usando OSRM de forma asíncrona"""
-    url = f"http://router.project-osrm.org/route/v1/driving/{origen_lon},{origen_lat};{destino_lon},{destino_lat}?overview=full&geometries=geojson"
-    
-    try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            data = response.json()
-            
-            if data.get("code") == "Ok" and data.get("routes"):
-                route = data["routes"][0]
-                coordinates = route["geometry"]["coordinates"]
-                coords_formatted = [{"lat": coord[1], "lng": coord[0]} for coord in coordinates]
-                distance_km = round(route["distance"] / 1000, 2)
-                duration_min = round(route["duration"] / 60)
-                
-                return {
-                    "coordinates": coords_formatted,
-                    "distance": distance_km,
-                    "duration": duration_min
-                }
-    except Exception as e:
-        print(f"[Seed] Error obteniendo ruta OSRM: {e}")
+    """Obtener ruta real usando OSRM (cliente compartido de osrm.py)"""
+    ruta = await cliente_osrm.ruta(origen_lon, origen_lat, destino_lon, destino_lat)
+    if ruta is not None:
+        return ruta
     
     # Fallback: línea recta con puntos interpolados
     num_puntos = 20
@@ -40,7 +28,7 @@ async def obtener_ruta_osrm_async(origen_lon, origen_lat, destino_lon, destino_l
         factor = j / num_puntos
         lat_punto = origen_lat + (destino_lat - origen_lat) * factor
         lon_punto = origen_lon + (destino_lon - origen_lon) * factor
-        ruta_coords.append({"lat": round(lat_punto, 6), "lng": round(lon_punto, 6)})
+        ruta_coords.append((round(lat_punto, 6), round(lon_punto, 6)))
     
     # Calcular distancia aproximada
     import math
@@ -64,9 +52,11 @@ async def seed_database_async():
     Base.metadata.create_all(bind=engine)
     
     db = SessionLocal()
+    await cliente_osrm.iniciar()
     
     try:
         # Limpiar tablas existentes
+        db.query(models.Evento).delete()
         db.query(models.Calificacion).delete()
         db.query(models.Notificacion).delete()
         db.query(models.Viaje).delete()
@@ -328,8 +318,8 @@ async def seed_database_async():
                     indice_actual = int(progreso * (len(ruta_data["coordinates"]) - 1))
                     if indice_actual >= len(ruta_data["coordinates"]):
                         indice_actual = len(ruta_data["coordinates"]) - 1
-                    lat_actual = Decimal(str(ruta_data["coordinates"][indice_actual]["lat"]))
-                    lon_actual = Decimal(str(ruta_data["coordinates"][indice_actual]["lng"]))
+                    lat_actual = Decimal(str(ruta_data["coordinates"][indice_actual][0]))
+                    lon_actual = Decimal(str(ruta_data["coordinates"][indice_actual][1]))
                 else:
                     lat_actual = origen.lat
                     lon_actual = origen.lon
@@ -363,7 +353,7 @@ async def seed_database_async():
                     estado=estado_viaje,
                     fecha_inicio=fecha_inicio,
                     detenido_minutos=random.randint(0, 45) if estado_viaje == "en_progreso" else 0,
-                    ruta_completa=json.dumps(ruta_data["coordinates"]),
+                    ruta_geom=rutas.codificar_ruta(ruta_data["coordinates"]),
                     tiempo_entrega_esperado=tiempo_entrega_esperado,
                     tiempo_entrega_real=tiempo_entrega_real,
                     cumple_plazo=not tiene_demora if estado_viaje in ["entregado", "finalizado"] else None
@@ -375,6 +365,11 @@ async def seed_database_async():
         
         db.commit()
         
+        # Los datos se cargaron sin pasar por los endpoints: recalcular los contadores del dashboard
+        estadisticas.reconciliar(db)
+        eventos.poblar_desde_tablas(db)
+        db.commit()
+        
         print("\n✅ ¡Base de datos poblada exitosamente con rutas reales y nuevos estados!")
         print("\n=== CREDENCIALES DE ACCESO ===")
         print("🔐 Administrador: admin@logistica.com / admin123")
@@ -393,6 +388,7 @@ async def seed_database_async():
         db.rollback()
     finally:
         db.close()
+        await cliente_osrm.cerrar()
 
 def seed_database():
     """Wrapper síncrono para ejecutar seed_database_async"""
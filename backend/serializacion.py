@@ -0,0 +1,82 @@
+"""Serialización rápida de los listados grandes
+
+Los listados de transportistas, órdenes y viajes arman los dicts en el servidor
+ya con los tipos finales (float, str ISO, bool). Si se devuelven tal cual,
+FastAPI los vuelve a validar contra el `response_model` y los codifica con el
+módulo json; con muchas filas eso es la mayor parte del tiempo de la respuesta.
+
+`respuesta_json` devuelve una Response ya codificada con orjson, así FastAPI no
+pasa por el `response_model` (que sigue declarado para la documentación). Sólo
+sirve para datos armados por el propio servidor con la forma del schema.
+Medición: benchmarks/bench_serializacion.py
+
+`respuesta_stream` envía un listado a medida que se lee (array JSON o NDJSON),
+sin armarlo entero en memoria.
+"""
+from decimal import Decimal
+
+import orjson
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+
+def _convertir(valor):
+    # Columnas Numeric que llegan sin convertir (p. ej. posiciones leídas de la base)
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError(f"No se puede serializar {type(valor).__name__}")
+
+
+class RespuestaJSON(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_convertir)
+
+
+def respuesta_json(contenido, response: Response = None, headers=None):
+    """Respuesta JSON sin validación; copia los headers ya agregados a `response` (ETag, cursores)"""
+    encabezados = dict(response.headers) if response is not None else {}
+    encabezados.update(headers or {})
+    return RespuestaJSON(contenido, headers=encabezados)
+
+
+# Formatos de `?formato=` en los listados: array JSON enviado por partes o una fila JSON por línea
+FORMATOS_STREAM = {"stream": "application/json", "ndjson": "application/x-ndjson"}
+BYTES_POR_ENVIO = 64 * 1024
+
+
+def _por_partes(fragmentos):
+    """Juntar fragmentos chicos en envíos de ~64 KB"""
+    pendiente = bytearray()
+    for fragmento in fragmentos:
+        pendiente += fragmento
+        if len(pendiente) >= BYTES_POR_ENVIO:
+            yield bytes(pendiente)
+            pendiente.clear()
+    if pendiente:
+        yield bytes(pendiente)
+
+
+def _array_json(filas):
+    yield b"["
+    separador = b""
+    for fila in filas:
+        yield separador + orjson.dumps(fila, default=_convertir)
+        separador = b","
+    yield b"]"
+
+
+def _ndjson(filas):
+    for fila in filas:
+        yield orjson.dumps(fila, default=_convertir, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def respuesta_stream(filas, formato, response: Response = None):
+    """StreamingResponse con `filas` (iterable de dicts) en el formato pedido"""
+    fragmentos = _ndjson(filas) if formato == "ndjson" else _array_json(filas)
+    return StreamingResponse(
+        _por_partes(fragmentos),
+        media_type=FORMATOS_STREAM[formato],
+        headers=dict(response.headers) if response is not None else None
+    )
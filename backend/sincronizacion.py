@@ -0,0 +1,55 @@
+"""Sincronización incremental de listados (`?since=` en GET /api/ordenes y /api/viajes)
+
+Cada respuesta de esos listados trae un cursor de sincronización (header
+X-Sync-Cursor): el `now()` de la transacción que la leyó. Con `?since=<cursor>`
+el listado devuelve sólo las filas modificadas después (`cambios`), los ids de
+las que dejaron de cumplir el filtro (`eliminados`) y el cursor siguiente.
+
+`now()` es la hora de inicio de cada transacción, no la de su commit: una
+transacción que empezó antes de la lectura pero confirmó después queda con un
+timestamp anterior al cursor. Por eso se relee un margen hacia atrás
+(SYNC_MARGEN_SEGUNDOS, que tiene que ser mayor que la transacción más larga
+que modifica órdenes o viajes); alguna fila puede llegar dos veces y el cliente
+la reemplaza por id.
+"""
+import base64
+import os
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from serializacion import respuesta_json
+
+MARGEN = timedelta(seconds=float(os.getenv("SYNC_MARGEN_SEGUNDOS", "30")))
+
+
+def codificar_cursor(instante: datetime) -> str:
+    return base64.urlsafe_b64encode(instante.isoformat().encode()).decode()
+
+
+def decodificar_cursor(cursor: str) -> datetime:
+    try:
+        instante = datetime.fromisoformat(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor de sincronización inválido")
+    if instante.tzinfo is None:
+        raise HTTPException(status_code=400, detail="Cursor de sincronización inválido")
+    return instante
+
+
+def cursor_actual(db):
+    """Cursor para la lectura en curso: el now() de su transacción"""
+    return codificar_cursor(db.query(func.now()).scalar())
+
+
+def desde(cursor: str) -> datetime:
+    """Instante a partir del cual releer las filas modificadas para un cursor"""
+    return decodificar_cursor(cursor) - MARGEN
+
+
+def respuesta(cambios, eliminados, cursor):
+    return respuesta_json(
+        {"cambios": cambios, "eliminados": eliminados, "cursor": cursor},
+        headers={"X-Sync-Cursor": cursor, "Cache-Control": "no-store"}
+    )
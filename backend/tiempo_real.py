@@ -0,0 +1,200 @@
+"""Canal de eventos en tiempo real (Server-Sent Events)
+
+Cada cliente conectado se suscribe a un tema, por ejemplo ("proveedor", 3),
+("transportista", 7) o ("usuario", 12), y recibe sólo los eventos publicados
+para ese tema.
+
+Los eventos de una misma clave (por ejemplo el id del viaje) que todavía no se
+enviaron se combinan en uno solo: un cliente lento recibe el último estado de
+cada viaje en vez de una cola creciente de posiciones viejas. Si aun así
+acumula demasiadas claves, se le avisa con un evento "resync" para que vuelva
+a pedir la lista completa.
+
+`publicar` se puede llamar tanto desde el event loop como desde los endpoints
+sincrónicos (threadpool).
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+
+SSE_KEEPALIVE_SEGUNDOS = float(os.getenv("SSE_KEEPALIVE_SEGUNDOS", "15"))
+
+
+class Suscripcion:
+    def __init__(self, max_pendientes):
+        self.max_pendientes = max_pendientes
+        self.pendientes = OrderedDict()  # clave -> datos combinados
+        self.desbordada = False
+        self._hay_eventos = asyncio.Event()
+
+    def _agregar(self, clave, datos):
+        anterior = self.pendientes.pop(clave, None)
+        self.pendientes[clave] = {**anterior, **datos} if anterior else datos
+        if len(self.pendientes) > self.max_pendientes:
+            self.pendientes.popitem(last=False)
+            self.desbordada = True
+        self._hay_eventos.set()
+
+    async def esperar(self, timeout):
+        """Eventos pendientes (lista de dicts); lista vacía si pasó el timeout"""
+        try:
+            await asyncio.wait_for(self._hay_eventos.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._hay_eventos.clear()
+        eventos = list(self.pendientes.values())
+        self.pendientes.clear()
+        return eventos
+
+
+class CanalTiempoReal:
+    def __init__(self, max_pendientes=500):
+        self.max_pendientes = max_pendientes
+        self._suscripciones = {}  # tema -> set de Suscripcion
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def suscribir(self, tema):
+        """Crear una suscripción (llamar desde el event loop)"""
+        self._loop = asyncio.get_running_loop()
+        suscripcion = Suscripcion(self.max_pendientes)
+        with self._lock:
+            self._suscripciones.setdefault(tema, set()).add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, tema, suscripcion):
+        with self._lock:
+            suscripciones = self._suscripciones.get(tema)
+            if suscripciones is not None:
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._suscripciones[tema]
+
+    def hay_suscriptores(self, tema):
+        return tema in self._suscripciones
+
+    def conectados(self):
+        with self._lock:
+            return sum(len(s) for s in self._suscripciones.values())
+
+    def publicar(self, temas, clave, datos):
+        with self._lock:
+            destinatarios = [s for tema in temas for s in self._suscripciones.get(tema, ())]
+        if not destinatarios or self._loop is None:
+            return
+        try:
+            en_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            self._entregar(destinatarios, clave, datos)
+        else:
+            self._loop.call_soon_threadsafe(self._entregar, destinatarios, clave, datos)
+
+    @staticmethod
+    def _entregar(destinatarios, clave, datos):
+        for suscripcion in destinatarios:
+            suscripcion._agregar(clave, datos)
+
+
+def formato_sse(evento, datos, id=None):
+    lineas = []
+    if id is not None:
+        lineas.append(f"id: {id}")
+    lineas.append(f"event: {evento}")
+    lineas.append(f"data: {json.dumps(datos, ensure_ascii=False)}")
+    return "\n".join(lineas) + "\n\n"
+
+
+async def flujo_sse(request, canal, tema, evento, campo_id=None, anteriores=None):
+    """Generador de la respuesta SSE de una suscripción, hasta que el cliente se desconecta.
+
+    Con `campo_id` cada evento lleva ese campo como id SSE, así el navegador
+    lo reenvía en Last-Event-ID al reconectarse. `anteriores` es una corrutina
+    opcional que devuelve los eventos que el cliente se perdió (o None si son
+    demasiados y conviene un "resync"); se consulta después de suscribirse para
+    no perder nada de lo publicado mientras tanto.
+    """
+    suscripcion = canal.suscribir(tema)
+    try:
+        yield "retry: 5000\n\n"
+        ya_enviados = set()
+        if anteriores is not None:
+            pendientes = await anteriores()
+            if pendientes is None:
+                yield formato_sse("resync", {})
+            else:
+                for datos in pendientes:
+                    ya_enviados.add(datos[campo_id])
+                    yield formato_sse(evento, datos, id=datos[campo_id])
+        while not await request.is_disconnected():
+            eventos = await suscripcion.esperar(SSE_KEEPALIVE_SEGUNDOS)
+            if suscripcion.desbordada:
+                suscripcion.desbordada = False
+                yield formato_sse("resync", {})
+            if not eventos:
+                yield ": ping\n\n"
+                continue
+            for datos in eventos:
+                if campo_id is None:
+                    yield formato_sse(evento, datos)
+                elif datos[campo_id] not in ya_enviados:
+                    yield formato_sse(evento, datos, id=datos[campo_id])
+    finally:
+        canal.desuscribir(tema, suscripcion)
+
+
+# ============== VIAJES ==============
+
+canal_viajes = CanalTiempoReal()
+
+
+def publicar_viaje(viaje_id, transportista_id, proveedor_id, **datos):
+    """Publicar un cambio de un viaje a su transportista y a su proveedor"""
+    temas = [("transportista", transportista_id)]
+    if proveedor_id:
+        temas.append(("proveedor", proveedor_id))
+    canal_viajes.publicar(temas, viaje_id, {
+        "viaje_id": viaje_id,
+        "transportista_id": transportista_id,
+        "proveedor_id": proveedor_id,
+        **datos
+    })
+
+
+def publicar_posicion_viaje(viaje_id, transportista_id, proveedor_id, lat, lon, distancia_recorrida_km, ultima_actualizacion):
+    datos = {
+        "ubicacion_actual_lat": round(float(lat), 6),
+        "ubicacion_actual_lon": round(float(lon), 6),
+        "ultima_actualizacion": ultima_actualizacion.isoformat() if ultima_actualizacion else None
+    }
+    # Sin ruta no hay progreso: no pisar el último valor enviado
+    if distancia_recorrida_km is not None:
+        datos["distancia_recorrida_km"] = round(float(distancia_recorrida_km), 2)
+    publicar_viaje(viaje_id, transportista_id, proveedor_id, **datos)
+
+
+# ============== NOTIFICACIONES ==============
+
+canal_notificaciones = CanalTiempoReal()
+
+
+def notificacion_a_dict(notificacion):
+    return {
+        "id": notificacion.id,
+        "usuario_id": notificacion.usuario_id,
+        "evento": notificacion.evento,
+        "payload_json": notificacion.payload_json,
+        "leida": bool(notificacion.leida),
+        "ts_envio": notificacion.ts_envio.isoformat() if notificacion.ts_envio else None
+    }
+
+
+def publicar_notificacion(notificacion):
+    """Enviar una notificación recién guardada a los clientes conectados de su usuario"""
+    tema = ("usuario", notificacion.usuario_id)
+    # Evita recargar la fila (expirada por el commit) si nadie está escuchando
+    if canal_notificaciones.hay_suscriptores(tema):
+        canal_notificaciones.publicar([tema], notificacion.id, notificacion_a_dict(notificacion))
@@ -0,0 +1,236 @@
+"""Escritura de posiciones GPS en bloque y buffer write-behind
+
+`aplicar_ubicaciones` escribe la última posición de un conjunto de
+transportistas con dos UPDATE ... FROM (VALUES ...): uno sobre `transportistas`
+y otro sobre sus viajes en progreso. La usan el endpoint de lotes y el vaciado
+del buffer.
+
+`BufferUbicaciones` es el modo write-behind opcional del endpoint de ubicación
+(UBICACION_WRITE_BEHIND=1): cada reporte sólo reemplaza la última posición del
+transportista en memoria, y cada N segundos todas las pendientes se escriben
+juntas. Mientras tanto las lecturas de posición actual se sirven del buffer y
+los clientes en tiempo real reciben las posiciones recién al escribirse.
+Al apagar la app se vacía lo pendiente (ver lifespan en main.py).
+"""
+import asyncio
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy import select, update, values, column, func, cast, Integer, Numeric, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import database
+import models
+import rutas
+import tiempo_real
+
+# Límites del intervalo de vaciado (segundos)
+INTERVALO_MINIMO = 0.5
+INTERVALO_MAXIMO = 60.0
+
+
+async def aplicar_ubicaciones(db: AsyncSession, lecturas: dict):
+    """Escribir posiciones sin hacer commit.
+
+    `lecturas` es {transportista_id: (lat, lon, ts)}. Devuelve el conjunto de
+    transportistas encontrados y los viajes actualizados, como tuplas
+    (viaje_id, transportista_id, proveedor_id, lat, lon, ts, distancia_recorrida).
+    """
+    if not lecturas:
+        return set(), []
+
+    # Ordenado por id para que escrituras concurrentes bloqueen filas en el mismo orden
+    lote = values(
+        column("id", Integer), column("lat", Numeric(9, 6)), column("lon", Numeric(9, 6)),
+        name="lote"
+    ).data([(tid, lat, lon) for tid, (lat, lon, _) in sorted(lecturas.items())])
+    encontrados = set((await db.execute(
+        update(models.Transportista).where(
+            models.Transportista.id == lote.c.id
+        ).values(
+            ubicacion_actual_lat=lote.c.lat,
+            ubicacion_actual_lon=lote.c.lon
+        ).returning(models.Transportista.id).execution_options(synchronize_session=False)
+    )).scalars())
+    if not encontrados:
+        return encontrados, []
+
+    viajes_activos = (await db.execute(
+        select(models.Viaje.id, models.Viaje.transportista_id, models.OrdenCarga.proveedor_id).outerjoin(
+            models.OrdenCarga, models.OrdenCarga.id == models.Viaje.orden_id
+        ).where(
+            models.Viaje.transportista_id.in_(encontrados),
+            models.Viaje.estado == "en_progreso"
+        )
+    )).all()
+
+    # Rutas que faltan en la cache, en una sola consulta (ver rutas.progreso_viaje)
+    version_rutas = rutas.cache_rutas.version()
+    sin_cache = [v.id for v in viajes_activos if rutas.cache_rutas.obtener(v.id) is None]
+    rutas_cargadas = {}
+    if sin_cache:
+        filas = await db.execute(
+            select(models.Viaje.id, models.Viaje.ruta_geom, models.Viaje.ruta_completa).where(
+                models.Viaje.id.in_(sin_cache)
+            )
+        )
+        rutas_cargadas = {fila.id: (fila.ruta_geom, fila.ruta_completa) for fila in filas}
+
+    filas_viajes = []
+    actualizados = []
+    for viaje in viajes_activos:
+        lat, lon, ts = lecturas[viaje.transportista_id]
+        try:
+            distancia_recorrida = rutas.progreso_viaje(
+                viaje.id,
+                lambda: rutas.ruta_de_viaje(*rutas_cargadas.get(viaje.id, (None, None))),
+                lat, lon, version_rutas
+            )
+        except Exception as e:
+            print(f"[v1] Error calculando distancia recorrida para viaje {viaje.id}: {e}")
+            distancia_recorrida = None
+        filas_viajes.append((viaje.id, lat, lon, ts, distancia_recorrida))
+        actualizados.append((viaje.id, viaje.transportista_id, viaje.proveedor_id, lat, lon, ts, distancia_recorrida))
+
+    if filas_viajes:
+        lote_viajes = values(
+            column("id", Integer), column("lat", Numeric(9, 6)), column("lon", Numeric(9, 6)),
+            column("ts", DateTime(timezone=True)), column("distancia", Numeric(10, 2)),
+            name="lote_viajes"
+        ).data(sorted(filas_viajes))
+        await db.execute(
+            update(models.Viaje).where(
+                models.Viaje.id == lote_viajes.c.id
+            ).values(
+                ubicacion_actual_lat=lote_viajes.c.lat,
+                ubicacion_actual_lon=lote_viajes.c.lon,
+                ultima_actualizacion=lote_viajes.c.ts,
+                # El cast hace falta si todas las distancias del lote son NULL (la columna quedaría como text)
+                distancia_recorrida_km=func.coalesce(
+                    cast(lote_viajes.c.distancia, Numeric(10, 2)), models.Viaje.distancia_recorrida_km
+                )
+            ).execution_options(synchronize_session=False)
+        )
+
+    return encontrados, actualizados
+
+
+def publicar_viajes(actualizados):
+    """Avisar a los clientes conectados (ver tiempo_real.py) después del commit"""
+    for viaje_id, transportista_id, proveedor_id, lat, lon, ts, distancia in actualizados:
+        tiempo_real.publicar_posicion_viaje(viaje_id, transportista_id, proveedor_id, lat, lon, distancia, ts)
+
+
+class BufferUbicaciones:
+    def __init__(self, activo=False, intervalo=2.0):
+        self.activo = activo
+        self.intervalo = min(INTERVALO_MAXIMO, max(INTERVALO_MINIMO, intervalo))
+        self._pendientes = {}  # transportista_id -> (lat, lon, ts)
+        self._en_escritura = {}  # lo que se está escribiendo en este momento
+        self._conocidos = set()  # transportistas que ya se sabe que existen
+        self.version = 0  # cambia con cada posición recibida (ver GET condicional de viajes)
+        self._lock = threading.Lock()
+        self._tarea = None
+        self._vaciando = asyncio.Lock()
+        self.estadisticas = {"recibidas": 0, "escritas": 0, "vaciados": 0, "errores": 0}
+
+    # ---------- registro y lectura ----------
+
+    def conocido(self, transportista_id):
+        return transportista_id in self._conocidos
+
+    def marcar_conocido(self, transportista_id):
+        self._conocidos.add(transportista_id)
+
+    def registrar(self, transportista_id, lat, lon, ts=None):
+        with self._lock:
+            self._pendientes[transportista_id] = (lat, lon, ts or datetime.now().astimezone())
+            self.estadisticas["recibidas"] += 1
+            self.version += 1
+
+    def posicion(self, transportista_id):
+        """Última posición todavía no escrita de un transportista: (lat, lon) o None"""
+        if not self.activo:
+            return None
+        with self._lock:
+            lectura = self._pendientes.get(transportista_id) or self._en_escritura.get(transportista_id)
+        return (lectura[0], lectura[1]) if lectura else None
+
+    def descartar_anteriores(self, lecturas):
+        """Olvidar posiciones pendientes más viejas que las ya escritas por otra vía"""
+        with self._lock:
+            for transportista_id, (_, _, ts) in lecturas.items():
+                pendiente = self._pendientes.get(transportista_id)
+                if pendiente is not None and pendiente[2] <= ts:
+                    del self._pendientes[transportista_id]
+
+    # ---------- vaciado ----------
+
+    async def vaciar(self):
+        """Escribir todas las posiciones pendientes en una transacción"""
+        async with self._vaciando:
+            with self._lock:
+                if not self._pendientes:
+                    return 0
+                self._en_escritura, self._pendientes = self._pendientes, {}
+                lecturas = self._en_escritura
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    encontrados, actualizados = await aplicar_ubicaciones(db, lecturas)
+                    await db.commit()
+            except Exception:
+                self.estadisticas["errores"] += 1
+                # Volver a encolar lo que no fue reemplazado por un reporte más nuevo
+                with self._lock:
+                    for transportista_id, lectura in lecturas.items():
+                        self._pendientes.setdefault(transportista_id, lectura)
+                raise
+            finally:
+                with self._lock:
+                    self._en_escritura = {}
+            publicar_viajes(actualizados)
+            perdidos = set(lecturas) - encontrados
+            if perdidos:
+                print(f"[v0] Posiciones descartadas de transportistas inexistentes: {sorted(perdidos)}")
+            self.estadisticas["escritas"] += len(encontrados)
+            self.estadisticas["vaciados"] += 1
+            return len(encontrados)
+
+    async def _bucle(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.vaciar()
+            except Exception as e:
+                print(f"[v0] Error escribiendo posiciones pendientes: {e}")
+
+    def iniciar(self):
+        if self.activo and self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        """Cortar el vaciado periódico y escribir lo que haya quedado pendiente"""
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        if self.activo:
+            await self.vaciar()
+
+    def resumen(self):
+        return {
+            **self.estadisticas,
+            "activo": self.activo,
+            "intervalo_segundos": self.intervalo,
+            "pendientes": len(self._pendientes)
+        }
+
+
+buffer_ubicaciones = BufferUbicaciones(
+    activo=os.getenv("UBICACION_WRITE_BEHIND", "0").lower() in ("1", "true", "si", "sí"),
+    intervalo=float(os.getenv("UBICACION_FLUSH_SEGUNDOS", "2"))
+)
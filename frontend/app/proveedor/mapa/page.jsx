@@ -45,6 +45,29 @@ const MapaViajesContratados = dynamic(
   }
 );
 
+// La geometría de cada ruta no cambia durante el viaje: se pide una sola vez
+// (include=ruta) y el polling periódico sólo trae posiciones y progreso.
+// Mientras la ruta esté pendiente (se calcula en segundo plano) se vuelve a pedir.
+const rutasPorViaje = {};
+
+async function obtenerViajesConRutas(proveedorId) {
+  const viajes = await apiClient.getViajes({ proveedor_id: proveedorId });
+
+  const faltanRutas = viajes.some(v => v.estado === "en_progreso" && !rutasPorViaje[v.id]);
+  if (faltanRutas) {
+    const conRuta = await apiClient.getViajes({
+      proveedor_id: proveedorId,
+      estado: "en_progreso",
+      include: "ruta"
+    });
+    conRuta.forEach(v => {
+      if (v.ruta_completa && v.ruta_estado !== "pendiente") rutasPorViaje[v.id] = v.ruta_completa;
+    });
+  }
+
+  return viajes.map(v => ({ ...v, ruta_completa: rutasPorViaje[v.id] || null }));
+}
+
 export default function ProveedorMapa() {
   const router = useRouter();
   const [proveedor, setProveedor] = useState(null);
@@ -80,9 +103,7 @@ export default function ProveedorMapa() {
         
         await cargarTransportistas();
         
-        const todosLosViajes = await apiClient.getViajes({ 
-          proveedor_id: prov.id
-        });
+        const todosLosViajes = await obtenerViajesConRutas(prov.id);
 
         const enProgreso = todosLosViajes.filter(v => v.estado === "en_progreso");
         const entregados = todosLosViajes.filter(v => v.estado === "entregado");
@@ -158,8 +179,48 @@ export default function ProveedorMapa() {
     };
 
     cargarDatos();
-    const intervalo = setInterval(cargarDatos, 15000);
-    return () => clearInterval(intervalo);
+
+    // Posiciones y progreso llegan por SSE; la lista completa sólo se vuelve a
+    // pedir ante cambios de estado/ruta, al reconectar, o cada tanto por las dudas
+    const intervalo = setInterval(cargarDatos, 120000);
+    const proveedorData = localStorage.getItem("proveedor");
+    if (!proveedorData) return () => clearInterval(intervalo);
+
+    const stream = apiClient.streamViajes({ proveedor_id: JSON.parse(proveedorData).id });
+    let reconectando = false;
+    stream.addEventListener("viaje", (e) => {
+      const cambio = JSON.parse(e.data);
+      if (cambio.estado || cambio.ruta_estado) {
+        cargarDatos();
+        return;
+      }
+      setViajesContratados(prev => prev.map(v => {
+        if (v.id !== cambio.viaje_id) return v;
+        const distanciaRecorrida = cambio.distancia_recorrida_km ?? v.distanciaRecorrida;
+        return {
+          ...v,
+          ubicacionActual: {
+            lat: cambio.ubicacion_actual_lat ?? v.ubicacionActual.lat,
+            lng: cambio.ubicacion_actual_lon ?? v.ubicacionActual.lng
+          },
+          distanciaRecorrida,
+          progreso: v.distancia > 0 ? Math.round((distanciaRecorrida / v.distancia) * 100) : 0
+        };
+      }));
+    });
+    stream.addEventListener("resync", cargarDatos);
+    stream.onerror = () => { reconectando = true; };
+    stream.onopen = () => {
+      if (reconectando) {
+        reconectando = false;
+        cargarDatos();
+      }
+    };
+
+    return () => {
+      clearInterval(intervalo);
+      stream.close();
+    };
   }, [router]);
 
   const cargarTransportistas = async () => {
@@ -234,9 +295,7 @@ export default function ProveedorMapa() {
       await apiClient.updateEstadoViaje(viajeParaConfirmar.id, "finalizado");
       
       // Reload trips
-      const todosLosViajes = await apiClient.getViajes({ 
-        proveedor_id: proveedor.id
-      });
+      const todosLosViajes = await obtenerViajesConRutas(proveedor.id);
       
       const enProgreso = todosLosViajes.filter(v => v.estado === "en_progreso");
       const entregados = todosLosViajes.filter(v => v.estado === "entregado");
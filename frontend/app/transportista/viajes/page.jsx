@@ -28,8 +28,35 @@ export default function TransportistaViajes() {
 
   useEffect(() => {
     cargarDatos();
-    const intervalo = setInterval(cargarDatos, 30000);
-    return () => clearInterval(intervalo);
+
+    // Los cambios de los viajes llegan por SSE en vez de consultar cada 30 segundos
+    const intervalo = setInterval(cargarDatos, 120000);
+    const transportistaData = localStorage.getItem("transportista");
+    if (!transportistaData) return () => clearInterval(intervalo);
+
+    const stream = apiClient.streamViajes({ transportista_id: JSON.parse(transportistaData).id });
+    let reconectando = false;
+    stream.addEventListener("viaje", (e) => {
+      const { viaje_id, ...cambio } = JSON.parse(e.data);
+      if (cambio.estado || cambio.ruta_estado) {
+        cargarDatos();
+        return;
+      }
+      setViajesEnProgreso(prev => prev.map(v => v.id === viaje_id ? { ...v, ...cambio } : v));
+    });
+    stream.addEventListener("resync", cargarDatos);
+    stream.onerror = () => { reconectando = true; };
+    stream.onopen = () => {
+      if (reconectando) {
+        reconectando = false;
+        cargarDatos();
+      }
+    };
+
+    return () => {
+      clearInterval(intervalo);
+      stream.close();
+    };
   }, []);
 
   useEffect(() => {
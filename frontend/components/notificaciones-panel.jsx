@@ -13,29 +13,38 @@ export default function NotificacionesPanel({ proveedorId, usuarioId }) {
   const [noLeidas, setNoLeidas] = useState(0);
 
   useEffect(() => {
+    const transformarNotificacion = (n) => ({
+      id: n.id,
+      tipo: extraerTipoDeEvento(n.evento),
+      mensaje: n.evento,
+      timestamp: n.ts_envio,
+      leida: n.leida,
+      urgente: n.evento.includes("detenido") && n.evento.includes("60")
+    });
+
+    // Devuelve el id más alto cargado, para seguir desde ahí con el stream
     const cargarNotificaciones = async () => {
       if (!usuarioId) {
         cargarNotificacionesLocal();
-        return;
+        return null;
       }
 
       try {
-        const data = await apiClient.getNotificaciones(usuarioId);
+        const [data, conteo] = await Promise.all([
+          apiClient.getNotificaciones(usuarioId),
+          apiClient.getNotificacionesNoLeidas(usuarioId)
+        ]);
         
-        const notificacionesTransformadas = data.map(n => ({
-          id: n.id,
-          tipo: extraerTipoDeEvento(n.evento),
-          mensaje: n.evento,
-          timestamp: n.ts_envio,
-          leida: n.leida,
-          urgente: n.evento.includes("detenido") && n.evento.includes("60")
-        }));
+        const notificacionesTransformadas = data.map(transformarNotificacion);
         
         setNotificaciones(notificacionesTransformadas);
-        setNoLeidas(notificacionesTransformadas.filter(n => !n.leida).length);
+        // El conteo incluye las no leídas que no entran en la lista
+        setNoLeidas(conteo.no_leidas);
+        return data.reduce((max, n) => Math.max(max, n.id), 0);
       } catch (error) {
         console.error("[v0] Error cargando notificaciones:", error);
         cargarNotificacionesLocal();
+        return null;
       }
     };
 
@@ -88,10 +97,32 @@ export default function NotificacionesPanel({ proveedorId, usuarioId }) {
       setNoLeidas(todasNotificaciones.filter(n => !n.leida).length);
     };
 
-    cargarNotificaciones();
-    const interval = setInterval(cargarNotificaciones, 30000);
+    // Sin usuario (notificaciones armadas localmente) se sigue consultando cada 30 s
+    if (!usuarioId) {
+      cargarNotificaciones();
+      const interval = setInterval(cargarNotificaciones, 30000);
+      return () => clearInterval(interval);
+    }
+
+    // Con usuario: la lista se pide una vez y las nuevas llegan por SSE. Al
+    // reconectarse el navegador envía Last-Event-ID y el servidor reenvía lo perdido.
+    let stream = null;
+    let cancelado = false;
+    cargarNotificaciones().then((ultimoId) => {
+      if (cancelado || ultimoId == null) return;
+      stream = apiClient.streamNotificaciones(usuarioId, ultimoId);
+      stream.addEventListener("notificacion", (e) => {
+        const nueva = transformarNotificacion(JSON.parse(e.data));
+        setNotificaciones(prev => prev.some(n => n.id === nueva.id) ? prev : [nueva, ...prev]);
+        if (!nueva.leida) setNoLeidas(prev => prev + 1);
+      });
+      stream.addEventListener("resync", cargarNotificaciones);
+    });
 
-    return () => clearInterval(interval);
+    return () => {
+      cancelado = true;
+      if (stream) stream.close();
+    };
   }, [proveedorId, usuarioId]);
 
   const extraerTipoDeEvento = (evento) => {
@@ -117,6 +148,20 @@ export default function NotificacionesPanel({ proveedorId, usuarioId }) {
     setNoLeidas(prev => Math.max(0, prev - 1));
   };
 
+  const marcarTodasComoLeidas = async () => {
+    if (usuarioId) {
+      try {
+        await apiClient.marcarNotificacionesLeidas(usuarioId);
+      } catch (error) {
+        console.error("[v0] Error marcando notificaciones:", error);
+        return;
+      }
+    }
+    
+    setNotificaciones(prev => prev.map(n => ({ ...n, leida: true })));
+    setNoLeidas(0);
+  };
+
   const getIcono = (tipo) => {
     switch (tipo) {
       case "detenido":
@@ -154,13 +199,24 @@ export default function NotificacionesPanel({ proveedorId, usuarioId }) {
         <Card className="notificaciones-panel absolute right-0 top-12 w-80 sm:w-96 max-h-[500px] overflow-y-auto shadow-lg" style={{ zIndex: 9999 }}>
           <div className="p-4 border-b border-border flex items-center justify-between sticky top-0 bg-card z-10">
             <h3 className="font-semibold">Notificaciones</h3>
-            <Button
-              variant="ghost"
-              size="sm"
-              onClick={() => setMostrarPanel(false)}
-            >
-              <X className="h-4 w-4" />
-            </Button>
+            <div className="flex items-center gap-1">
+              {noLeidas > 0 && (
+                <Button
+                  variant="ghost"
+                  size="sm"
+                  onClick={marcarTodasComoLeidas}
+                >
+                  Marcar todas como leídas
+                </Button>
+              )}
+              <Button
+                variant="ghost"
+                size="sm"
+                onClick={() => setMostrarPanel(false)}
+              >
+                <X className="h-4 w-4" />
+              </Button>
+            </div>
           </div>
 
           <div className="divide-y divide-border">
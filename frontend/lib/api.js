@@ -125,11 +125,23 @@ class ApiClient {
     if (filtros.proveedor_id) params.append("proveedor_id", filtros.proveedor_id);
     if (filtros.transportista_id) params.append("transportista_id", filtros.transportista_id);
     if (filtros.estado) params.append("estado", filtros.estado);
+    // include: "ruta" para recibir también la geometría completa de la ruta
+    if (filtros.include) params.append("include", filtros.include);
     
     const query = params.toString();
     return this.request(`/api/viajes${query ? `?${query}` : ""}`);
   }
 
+  // Server-Sent Events con los cambios (posición, progreso, estado) de los viajes
+  // de un proveedor o de un transportista
+  streamViajes(filtros = {}) {
+    const params = new URLSearchParams();
+    if (filtros.proveedor_id) params.append("proveedor_id", filtros.proveedor_id);
+    if (filtros.transportista_id) params.append("transportista_id", filtros.transportista_id);
+
+    return new EventSource(`${API_BASE_URL}/api/viajes/stream?${params.toString()}`);
+  }
+
   async updateEstadoViaje(viajeId, estado) {
     return this.request(`/api/viajes/${viajeId}/estado`, {
       method: "PUT",
@@ -143,12 +155,30 @@ class ApiClient {
     return this.request(`/api/notificaciones/${usuarioId}`);
   }
 
+  // Server-Sent Events con las notificaciones nuevas a partir de desdeId
+  streamNotificaciones(usuarioId, desdeId) {
+    const query = desdeId != null ? `?desde_id=${desdeId}` : "";
+    return new EventSource(`${API_BASE_URL}/api/notificaciones/${usuarioId}/stream${query}`);
+  }
+
   async marcarNotificacionLeida(notificacionId) {
     return this.request(`/api/notificaciones/${notificacionId}/leer`, {
       method: "PUT",
     });
   }
 
+  async getNotificacionesNoLeidas(usuarioId) {
+    return this.request(`/api/notificaciones/${usuarioId}/no-leidas`);
+  }
+
+  // Sin ids marca todas las del usuario
+  async marcarNotificacionesLeidas(usuarioId, ids = null) {
+    return this.request(`/api/notificaciones/${usuarioId}/leer-todas`, {
+      method: "PUT",
+      body: JSON.stringify(ids ? { ids } : {}),
+    });
+  }
+
   // ============== CONFIG ==============
   
   async getTiposCamion() {